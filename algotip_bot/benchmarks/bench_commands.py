@@ -0,0 +1,74 @@
+"""
+Micro-benchmark of the command parser against the former split-based parsing
+
+Usage: python -m algotip_bot.benchmarks.bench_commands
+"""
+
+from timeit import repeat
+
+from algosdk import encoding
+
+from algotip_bot.commands import parse_comment, parse_message
+from algotip_bot.errors import InvalidCommandError
+
+ADDRESS = "Y76M3MSY6DKBRHBL7C3NNDXGS5IIMQVQVUAB6MP4XEMMGVF2QWNPL226CA"
+NOTE = " ".join(["thanks for the great explanation"] * 20)
+
+MESSAGES = ["tip 1 algorandtipbot", f"tip 0.5 redswoosh {NOTE}", f"withdraw all {ADDRESS}",
+            "wallet", "subreddit add algorand", "hello there", "tip one redswoosh"]
+COMMENTS = ["!atip 1", f"!atip 2.5 {NOTE}", f"great post {NOTE}", "!atip"]
+
+
+def is_float(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+def split_parse_message(body):
+    """
+    Parsing of the messages as it was done in EventHandler.handle_message
+    """
+    command = body.split()
+    main_cmd = command.pop(0).lower()
+    if main_cmd == "tip":
+        if len(command) < 2 or not is_float(amount := command.pop(0)):
+            return None
+        return float(amount), command.pop(0), " ".join(command)
+    if main_cmd == "withdraw":
+        if len(command) < 2:
+            return None
+        amount, address = command.pop(0), command.pop(0)
+        return amount, encoding.is_valid_address(address), " ".join(command)
+    return main_cmd, command
+
+def split_parse_comment(body):
+    command = body.split()
+    if command.pop(0).lower() not in "!atip" or not command or not is_float(amount := command.pop(0)):
+        return None
+    return float(amount), " ".join(command)
+
+def grammar_parse_message(body):
+    try:
+        return parse_message(body)
+    except InvalidCommandError:
+        return None
+
+def grammar_parse_comment(body):
+    try:
+        return parse_comment(body)
+    except InvalidCommandError:
+        return None
+
+def bench(name, parser, bodies, number=20000):
+    best = min(repeat(lambda: [parser(body) for body in bodies], number=number, repeat=5))
+    per_event = best / (number * len(bodies)) * 1e6
+    print(f"{name:<24} {per_event:8.3f} us/event")
+
+
+if __name__ == "__main__":
+    bench("split messages", split_parse_message, MESSAGES)
+    bench("grammar messages", grammar_parse_message, MESSAGES)
+    bench("split comments", split_parse_comment, COMMENTS)
+    bench("grammar comments", grammar_parse_comment, COMMENTS)
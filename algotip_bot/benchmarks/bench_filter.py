@@ -0,0 +1,54 @@
+"""
+Benchmark of the comment filter of utils.stream() on large batches of comment
+bodies: the former substring scan (any(command in body for command in commands))
+against the precompiled matcher, for growing sets of commands
+
+Usage: python -m algotip_bot.benchmarks.bench_filter [--comments 100000]
+"""
+
+import argparse
+import random
+from timeit import repeat
+
+from algotip_bot.commands import COMMENT_COMMANDS, compile_commands
+
+WORDS = ["thanks", "for", "the", "great", "explanation", "algorand", "is", "pure", "proof", "of",
+         "stake", "tip", "!", "atip", "wallet", "the", "bot", "https://reddit.com/r/algorand"]
+
+
+def make_bodies(comments: int, commands: set, command_rate: float, seed: int = 0) -> list:
+    """
+    Generates comment bodies of 1 to 200 words, a fraction of them starting with a command
+    """
+    generator = random.Random(seed)
+    commands = sorted(commands)
+    bodies = []
+    for _ in range(comments):
+        body = " ".join(generator.choices(WORDS, k=generator.randint(1, 200)))
+        if generator.random() < command_rate:
+            body = f"{generator.choice(commands)} {generator.randint(1, 100) / 10} {body}"
+        bodies.append(body)
+    return bodies
+
+def bench(name: str, matches, bodies: list) -> None:
+    best = min(repeat(lambda: [body for body in bodies if matches(body)], number=1, repeat=5))
+    print(f"{name:<40} {best / len(bodies) * 1e9:8.1f} ns/comment")
+
+
+def run() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--comments", type=int, default=100_000)
+    parser.add_argument("--command-rate", type=float, default=0.01, help="fraction of comments with a command")
+    args = parser.parse_args()
+
+    for extra in (0, 9, 49):
+        commands = set(COMMENT_COMMANDS) | {f"!atip{index}" for index in range(extra)}
+        bodies = make_bodies(args.comments, commands, args.command_rate)
+        matcher = compile_commands(commands)
+        print(f"{len(commands)} command(s), {args.comments} comments")
+        bench("  substring scan", lambda body, commands=commands: any(command in body for command in commands), bodies)
+        bench("  precompiled matcher", lambda body, matcher=matcher: matcher.match(body) is not None, bodies)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,198 @@
+"""
+Offline benchmark replaying a synthetic workload of tips, withdrawals and
+wallet commands through the bot, Reddit, algod and Redis being replaced by
+the in-process fakes of benchmarks/fakes.py
+
+Two modes are available:
+ * handler: the events are handled one by one by EventHandler.handle_event,
+            the latency being the time taken by each call
+ * main: the events arrive in the fake inbox and subreddit (all at once or at
+         the given rate) and the main loop runs with all its threads, the latency
+         being the time between the arrival of an event and its acknowledgement
+         (comments aren't marked as read, they are acknowledged when their chunk is flushed).
+         The first poll of the comment stream is a full scan, that only reads the newest
+         LISTING_LIMIT comments: the comments beyond them arrive once it is done, so that
+         none of them is skipped. The run fails if some events aren't acknowledged in time
+
+Usage: python -m algotip_bot.benchmarks.bench_pipeline [--mode main] [--events 5000]
+Requires fakeredis and lupa (pip install -r requirements-dev.txt), unless --redis-url
+points to a scratch Redis server
+"""
+
+import argparse
+import os
+import random
+from threading import Thread
+from time import monotonic, perf_counter, sleep
+from typing import List, Tuple
+
+from algosdk.account import generate_account
+
+from algotip_bot.benchmarks.fakes import (CallCounter, FakeComment,
+                                         FakeMessage, install)
+
+SUBREDDIT = "bottesting"
+LISTING_LIMIT = 100 # Comments read by the full scan of the stream (CommentCursor.max_limit)
+MIX = {"tip": 0.5, "comment": 0.25, "withdraw": 0.1, "wallet": 0.1, "invalid": 0.05}
+
+
+def make_workload(reddit, events: int, users: int, seed: int = 0) -> Tuple[List[str], list]:
+    """
+    Generates the users and the events of the workload
+
+    Args:
+        reddit: the fake Reddit client
+        events: number of events to generate
+        users: number of redditors sending and receiving the tips
+        seed: seed of the random generator
+    Returns:
+        names, events: the redditors and the generated events, in arrival order
+    """
+    generator = random.Random(seed)
+    names = [f"bench_user_{index}" for index in range(users)]
+    addresses = [generate_account()[1] for _ in range(16)]
+    kinds, weights = zip(*MIX.items())
+
+    workload = []
+    for index in range(events):
+        author, receiver = generator.sample(names, 2)
+        amount = f"{generator.randint(1, 2000) / 1000:.3f}"
+        kind = generator.choices(kinds, weights)[0]
+        if kind == "comment":
+            workload.append(FakeComment(reddit, f"c{index}", author, f"!atip {amount} thanks", receiver))
+            continue
+        body = {"tip": f"tip {amount} {receiver} thanks",
+                "withdraw": f"withdraw {amount} {generator.choice(addresses)}",
+                "wallet": "wallet",
+                "invalid": "hello there"}[kind]
+        subject = "anonymous" if kind == "tip" and generator.random() < 0.1 else kind
+        workload.append(FakeMessage(reddit, f"m{index}", author, subject, body))
+    return names, workload
+
+def percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0.0
+
+def report(mode: str, latencies: List[float], elapsed: float, calls: CallCounter, events: int) -> None:
+    """
+    Prints the throughput, the latency percentiles and the external calls per event
+    """
+    print(f"Replayed {events} events ({mode} mode) in {elapsed:.2f}s")
+    print(f"Throughput : {events / elapsed:.1f} events/s")
+    print(f"Latency    : p50 {percentile(latencies, 0.5) * 1000:.2f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms")
+
+    services = {}
+    for endpoint, count in calls.items():
+        services[endpoint.split(".")[0]] = services.get(endpoint.split(".")[0], 0) + count
+    print(f"External calls per event : {sum(calls.values()) / events:.2f} ("
+          + ", ".join(f"{service} {count / events:.2f}" for service, count in sorted(services.items())) + ")")
+    for endpoint, count in calls.most_common():
+        print(f"  {endpoint:<36} {count / events:8.3f}")
+
+def replay_handler(workload: list, calls: CallCounter) -> Tuple[List[float], float]:
+    """
+    Handles the events one by one with the EventHandler
+    """
+    from algotip_bot.errors import InvalidCommandError # pylint: disable=C0415
+    from algotip_bot.handlers import EventHandler # pylint: disable=C0415
+
+    event_handler = EventHandler()
+    latencies = []
+    calls.clear()
+    start = perf_counter()
+    for event in workload:
+        event_start = perf_counter()
+        try:
+            if (handled := event_handler.handle_event(event)) is not None:
+                handled.result()
+        except InvalidCommandError:
+            pass
+        latencies.append(perf_counter() - event_start)
+    return latencies, perf_counter() - start
+
+def replay_main(clients, workload: list, calls: CallCounter, rate: float, timeout: float) -> Tuple[List[float], float]:
+    """
+    Makes the events arrive in the fake inbox and subreddit, and runs the
+    main loop until all of them are acknowledged
+    """
+    from algotip_bot import main, pipeline # pylint: disable=C0415
+    from algotip_bot.submitter import submitter # pylint: disable=C0415
+
+    reddit = clients.reddit
+    flush = pipeline.Pipeline._flush # pylint: disable=W0212
+    def recording_flush(self):
+        events = list(self._acks) # pylint: disable=W0212
+        flush(self)
+        now = monotonic()
+        for event in events:
+            reddit.inbox.acknowledged.setdefault(event.fullname, now)
+    pipeline.Pipeline._flush = recording_flush # pylint: disable=W0212
+
+    calls.clear()
+    start = monotonic()
+    held_back = {} # comment -> arrival time, for the comments that arrive after the full scan
+    for index, event in enumerate(workload):
+        event.arrival = start + (index / rate if rate else 0)
+        if isinstance(event, FakeComment):
+            event.created_utc = 2 ** 31 # Never older than the comment retention window
+            if len(reddit.comments) >= LISTING_LIMIT:
+                held_back[event], event.arrival = event.arrival, float("inf")
+            reddit.comments.append(event)
+        else:
+            reddit.inbox.messages.append(event)
+
+    Thread(target=main.main, name="main", daemon=True).start()
+    while held_back and not reddit.listings and monotonic() - start < timeout:
+        sleep(0.01)
+    scanned = monotonic()
+    for comment, arrival in held_back.items():
+        comment.arrival = max(arrival, scanned)
+
+    while len(reddit.inbox.acknowledged) < len(workload) and monotonic() - start < timeout:
+        sleep(0.05)
+
+    acknowledged = reddit.inbox.acknowledged
+    if len(acknowledged) < len(workload):
+        missing = [event.fullname for event in workload if event.fullname not in acknowledged]
+        raise TimeoutError(f"{len(missing)} events were not acknowledged after {timeout}s "
+                           f"(e.g. {', '.join(missing[:5])}), the results would be skewed")
+    latencies = [acknowledged[event.fullname] - event.arrival for event in workload if event.fullname in acknowledged]
+    print(f"Transaction groups : {submitter.stats()}")
+    return latencies, max(acknowledged.values(), default=start) - start
+
+
+def run() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["handler", "main"], default="handler")
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4, help="pipeline workers (main mode)")
+    parser.add_argument("--rate", type=float, default=0, help="arrivals per second, 0 for a burst (main mode)")
+    parser.add_argument("--block-time", type=float, default=0.1, help="seconds between two fake blocks")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds before giving up (main mode)")
+    parser.add_argument("--redis-url", help="scratch Redis server to use instead of fakeredis (it is flushed)")
+    parser.add_argument("--cold", action="store_true", help="don't create the users before the replay")
+    parser.add_argument("--verbose", action="store_true", help="print the logs of the bot")
+    args = parser.parse_args()
+
+    os.environ["WORKERS"] = str(args.workers)
+    calls = CallCounter()
+    clients = install(calls, args.redis_url, args.block_time, args.verbose)
+    clients.redis.sadd("subreddits", SUBREDDIT)
+
+    names, workload = make_workload(clients.reddit, args.events, args.users)
+    if not args.cold:
+        from algotip_bot.instances import User # pylint: disable=C0415
+        for name in names:
+            User.load(name)
+
+    if args.mode == "handler":
+        latencies, elapsed = replay_handler(workload, calls)
+    else:
+        latencies, elapsed = replay_main(clients, workload, calls, args.rate, args.timeout)
+    report(args.mode, latencies, elapsed, calls, len(workload))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,349 @@
+"""
+File containing in-process stand-ins for Reddit, algod and Redis, used
+to replay synthetic workloads through the bot without any network access.
+Every call that would leave the process is counted by endpoint
+
+install() must be called before any other algotip_bot module is imported,
+since they bind the clients at import time
+"""
+
+import base64
+import os
+import sys
+import types
+from collections import Counter, defaultdict
+from threading import Lock
+from time import monotonic, sleep
+from typing import Dict, List, Optional
+
+import msgpack
+from algosdk.future.transaction import SuggestedParams
+from praw.models.reddit.comment import Comment
+from praw.models.reddit.message import Message
+from redis import Redis
+from rich.console import Console
+
+GENESIS_HASH = "SGO1GKSzyE7IEPItTxCByw9x8FmnrCDexi9/cOUJOiI="
+GENESIS_ID = "benchnet-v1"
+MIN_FEE = 1000
+
+
+class CallCounter(Counter):
+    """
+    Thread-safe counter of the external calls, by endpoint
+    """
+    def __init__(self) -> None:
+        super().__init__()
+        self._lock = Lock()
+
+    def hit(self, endpoint: str) -> None:
+        with self._lock:
+            self[endpoint] += 1
+
+
+class FakeRedditor:
+    """
+    Redditor that exists as long as it has a name
+    """
+    def __init__(self, reddit: "FakeReddit", name: str) -> None:
+        self._reddit = reddit
+        self.name = name
+
+    @property
+    def id(self) -> str: # pylint: disable=C0103
+        self._reddit.calls.hit("reddit.redditor.about")
+        return self.name
+
+    def message(self, subject: str, body: str) -> None:
+        self._reddit.calls.hit("reddit.message.compose")
+        self._reddit.sent.append((self.name, subject, body))
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeMessage(Message):
+    """
+    Private message received by the bot. praw's constructor isn't called,
+    the attributes are set directly so that nothing is ever fetched
+    """
+    def __init__(self, reddit: "FakeReddit", message_id: str, author: str, subject: str, body: str) -> None: # pylint: disable=W0231
+        self.__dict__.update(_reddit=reddit, _fetched=True, id=message_id, subject=subject, body=body,
+                             author=FakeRedditor(reddit, author), created_utc=0.0, arrival=0.0)
+
+    @property
+    def fullname(self) -> str:
+        return f"t4_{self.id}"
+
+
+class FakeComment(Comment):
+    """
+    Comment posted in a watched subreddit, replying to a comment of parent_author
+    """
+    def __init__(self, reddit: "FakeReddit", comment_id: str, author: str, body: str, parent_author: str,
+                 subreddit: str = "bottesting") -> None: # pylint: disable=W0231
+        self.__dict__.update(_reddit=reddit, _fetched=True, id=comment_id, body=body, subreddit=subreddit,
+                             author=FakeRedditor(reddit, author), parent_id=f"t1_p{comment_id}",
+                             _parent=types.SimpleNamespace(author=FakeRedditor(reddit, parent_author)),
+                             created_utc=0.0, arrival=0.0)
+
+    @property
+    def fullname(self) -> str:
+        return f"t1_{self.id}"
+
+    def parent(self) -> types.SimpleNamespace:
+        self._reddit.calls.hit("reddit.comment.parent")
+        return self._parent
+
+
+class FakeInbox:
+    """
+    Inbox returning the unread messages that already arrived, newest first
+    """
+    def __init__(self, reddit: "FakeReddit") -> None:
+        self._reddit = reddit
+        self.messages: List[FakeMessage] = []
+        self.acknowledged: Dict[str, float] = {} # fullname -> time it was marked as read
+        self._lock = Lock()
+
+    def unread(self, limit: int = 100) -> List[FakeMessage]:
+        self._reddit.calls.hit("reddit.inbox.unread")
+        now = monotonic()
+        with self._lock:
+            unread = [message for message in reversed(self.messages)
+                      if message.arrival <= now and message.fullname not in self.acknowledged]
+        return unread[:limit]
+
+    def mark_read(self, items: list) -> None:
+        self._reddit.calls.hit("reddit.inbox.mark_read")
+        now = monotonic()
+        with self._lock:
+            for item in items:
+                self.acknowledged.setdefault(item.fullname, now)
+
+
+class FakeSubreddit:
+    """
+    (Multi)subreddit listing the comments that already arrived, newest first
+    """
+    def __init__(self, reddit: "FakeReddit", display_name: str) -> None:
+        self._reddit = reddit
+        self.display_name = display_name
+
+    def comments(self, limit: int = 100, params: Optional[dict] = None) -> List[FakeComment]:
+        self._reddit.calls.hit("reddit.subreddit.comments")
+        now = monotonic()
+        listing = [comment for comment in reversed(self._reddit.comments) if comment.arrival <= now]
+        self._reddit.listings += 1
+        if params and params.get("before"):
+            fullnames = [comment.fullname for comment in listing]
+            if params["before"] not in fullnames:
+                return []
+            # Like Reddit, return the comments right after the anchor
+            return listing[:fullnames.index(params["before"])][-limit:]
+        return listing[:limit]
+
+    def moderator(self) -> List[FakeRedditor]:
+        self._reddit.calls.hit("reddit.subreddit.moderators")
+        return [FakeRedditor(self._reddit, name) for name in self._reddit.moderators]
+
+
+class FakeReddit:
+    """
+    Stand-in for praw.Reddit, covering the endpoints used by the bot
+    """
+    def __init__(self, calls: CallCounter) -> None:
+        self.calls = calls
+        self.inbox = FakeInbox(self)
+        self.comments: List[FakeComment] = []
+        self.listings = 0 # Number of comment listings returned so far
+        self.moderators: List[str] = []
+        self.sent: list = []
+        self.auth = types.SimpleNamespace(limits={"remaining": None, "reset_timestamp": None, "used": None})
+        self.subreddits = types.SimpleNamespace(search_by_name=self._search_subreddits)
+
+    def _search_subreddits(self, name: str, exact: bool = False) -> List[FakeSubreddit]: # pylint: disable=W0613
+        self.calls.hit("reddit.subreddits.search")
+        return [FakeSubreddit(self, name)]
+
+    def subreddit(self, display_name: str) -> FakeSubreddit:
+        return FakeSubreddit(self, display_name)
+
+    def redditor(self, name: str) -> FakeRedditor:
+        return FakeRedditor(self, name)
+
+    def post(self, path: str, data: dict) -> None: # pylint: disable=W0613
+        self.calls.hit("reddit.comment.reply")
+        self.sent.append((data["thing_id"], None, data["text"]))
+
+
+class FakeAlgod:
+    """
+    Stand-in for the AlgodClient: a single node producing a block every block_time
+    seconds, that contains all the transactions sent since the previous one.
+    Every account starts with initial_balance microAlgos
+    """
+    def __init__(self, calls: CallCounter, block_time: float = 0.1, initial_balance: int = 10 ** 9) -> None:
+        self.calls = calls
+        self.block_time = block_time
+        self.round = 1
+        self.balances: Dict[str, int] = defaultdict(lambda: initial_balance)
+        self.confirmed: Dict[str, int] = {} # tx_id -> round
+        self._blocks: Dict[int, bytes] = {}
+        self._mempool: list = []
+        self._started = monotonic()
+        self._lock = Lock()
+
+    def _produce_blocks(self) -> None:
+        """
+        Produces the blocks that are due
+        """
+        with self._lock:
+            while self.round < 1 + int((monotonic() - self._started) / self.block_time):
+                self.round += 1
+                txns, self._mempool = self._mempool, []
+                block_txns = []
+                for signed_txn in txns:
+                    stxn = signed_txn.dictify()
+                    txn = dict(stxn["txn"])
+                    txn.pop("gh")
+                    entry = {"txn": txn, "sig": stxn["sig"]}
+                    if txn.pop("gen", None) is not None:
+                        entry["hgi"] = True
+                    block_txns.append(entry)
+                    self._apply(signed_txn.transaction)
+                    self.confirmed[signed_txn.transaction.get_txid()] = self.round
+                block = {"rnd": self.round, "gh": base64.b64decode(GENESIS_HASH), "gen": GENESIS_ID}
+                if block_txns:
+                    block["txns"] = block_txns
+                self._blocks[self.round] = msgpack.packb({"block": block}, use_bin_type=True)
+
+    def _apply(self, txn) -> None:
+        self.balances[txn.sender] -= txn.amt + txn.fee
+        self.balances[txn.receiver] += txn.amt
+        if txn.close_remainder_to:
+            self.balances[txn.close_remainder_to] += self.balances.pop(txn.sender)
+
+    def status(self) -> dict:
+        self.calls.hit("algod.status")
+        self._produce_blocks()
+        return {"last-round": self.round}
+
+    def status_after_block(self, round_num: int) -> dict:
+        self.calls.hit("algod.status_after_block")
+        while True:
+            self._produce_blocks()
+            if self.round > round_num:
+                return {"last-round": self.round}
+            sleep(self.block_time / 10)
+
+    def block_info(self, round_num: int, response_format: str = "msgpack") -> bytes: # pylint: disable=W0613
+        self.calls.hit("algod.block_info")
+        self._produce_blocks()
+        return self._blocks[round_num]
+
+    def suggested_params(self) -> SuggestedParams:
+        self.calls.hit("algod.suggested_params")
+        self._produce_blocks()
+        return SuggestedParams(MIN_FEE, self.round, self.round + 1000, GENESIS_HASH, GENESIS_ID,
+                               flat_fee=True, min_fee=MIN_FEE)
+
+    def account_info(self, address: str) -> dict:
+        self.calls.hit("algod.account_info")
+        self._produce_blocks()
+        return {"address": address, "amount": self.balances[address]}
+
+    def pending_transaction_info(self, tx_id: str) -> dict:
+        self.calls.hit("algod.pending_transaction_info")
+        self._produce_blocks()
+        return {"confirmed-round": self.confirmed.get(tx_id, 0), "pool-error": ""}
+
+    def send_transaction(self, signed_txn) -> str:
+        self.calls.hit("algod.send_transaction")
+        with self._lock:
+            self._mempool.append(signed_txn)
+        return signed_txn.transaction.get_txid()
+
+    def send_transactions(self, signed_txns: list) -> str:
+        self.calls.hit("algod.send_transactions")
+        with self._lock:
+            self._mempool.extend(signed_txns)
+        return signed_txns[0].transaction.get_txid()
+
+
+def counted_redis(client: Redis, calls: CallCounter) -> Redis:
+    """
+    Counts the commands sent by a Redis client, a pipeline or a script
+    counting as a single round trip
+    """
+    execute_command, pipeline = client.execute_command, client.pipeline
+
+    def counting_execute_command(*args, **options):
+        calls.hit(f"redis.{str(args[0]).lower()}")
+        return execute_command(*args, **options)
+
+    def counting_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+        def counting_execute(*execute_args, **execute_kwargs):
+            calls.hit("redis.pipeline")
+            return execute(*execute_args, **execute_kwargs)
+        pipe.execute = counting_execute
+        return pipe
+
+    client.execute_command = counting_execute_command
+    client.pipeline = counting_pipeline
+    return client
+
+def make_redis(url: Optional[str] = None):
+    """
+    Returns the text and binary Redis clients of the benchmark: fakeredis
+    (with lupa for the Lua scripts) by default, or the Redis server at the given URL
+
+    The database is flushed, never point it to the bot's database
+    """
+    if url is None:
+        import fakeredis # pylint: disable=C0415
+        if fakeredis.__version__.startswith("1."):
+            # Redis runs the scripts with Lua 5.1 (where unpack is a global), but the fakeredis
+            # releases supporting redis-py 3.5 load the default runtime of lupa (Lua 5.4)
+            import lupa.lua51 # pylint: disable=C0415
+            sys.modules["lupa"] = lupa.lua51
+        server = fakeredis.FakeServer()
+        text, binary = (fakeredis.FakeRedis(server=server, decode_responses=True),
+                        fakeredis.FakeRedis(server=server))
+    else:
+        text, binary = Redis.from_url(url, decode_responses=True), Redis.from_url(url)
+    text.flushdb()
+    return text, binary
+
+
+def install(calls: CallCounter,
+            redis_url: Optional[str] = None,
+            block_time: float = 0.1,
+            verbose: bool = False) -> types.ModuleType:
+    """
+    Replaces algotip_bot.clients with the fakes
+
+    Args:
+        calls: the counter of the external calls
+        redis_url: URL of a Redis server to use instead of fakeredis
+        block_time: seconds between two blocks of the fake algod
+        verbose: whether the bot logs are printed
+    Returns:
+        clients: the fake clients module
+    """
+    if "algotip_bot.clients" in sys.modules:
+        raise RuntimeError("The fakes must be installed before the bot modules are imported")
+
+    redis, binary_redis = make_redis(redis_url)
+    clients = types.ModuleType("algotip_bot.clients")
+    clients.__dict__.update(redis=counted_redis(redis, calls),
+                            binary_redis=counted_redis(binary_redis, calls),
+                            algod=FakeAlgod(calls, block_time),
+                            reddit=FakeReddit(calls),
+                            console=Console() if verbose else Console(file=open(os.devnull, "w")), # pylint: disable=R1732
+                            NETWORK="testnet",
+                            REDIS_PW=None)
+    sys.modules["algotip_bot.clients"] = clients
+    return clients
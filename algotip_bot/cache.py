@@ -0,0 +1,339 @@
+"""
+File containing the caches shared by the whole process, used to avoid
+repeating network calls for data that doesn't change between two commands
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Optional, Set, Tuple, Union
+
+from algosdk.future.transaction import SuggestedParams
+from praw.models.reddit.comment import Comment
+from praw.models.reddit.message import Message
+from prawcore.exceptions import NotFound
+
+from algotip_bot.clients import algod, reddit
+from algotip_bot.commands import SubredditCommand, TipCommand, parse_message
+from algotip_bot.errors import InvalidCommandError
+
+
+class SuggestedParamsCache:
+    """
+    Class caching the suggested transaction parameters of algod.
+    They only change once per block, so they are refreshed when
+    a new round is reached or when the time-to-live expires
+    """
+    def __init__(self, ttl: float = 5.0) -> None:
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._params: Optional[SuggestedParams] = None
+        self._fetched = 0.0
+        self._last_round = 0
+        self._lock = Lock()
+
+    def get(self) -> SuggestedParams:
+        """
+        Returns the suggested parameters, fetching them from algod
+        only if the cached ones are outdated
+
+        Returns:
+            params: the suggested parameters
+        """
+        with self._lock:
+            if (self._params is None
+                    or monotonic() - self._fetched > self.ttl
+                    or self._params.first < self._last_round):
+                self._params = algod.suggested_params()
+                self._fetched = monotonic()
+                self.misses += 1
+            else:
+                self.hits += 1
+            return self._params
+
+    def last_round(self) -> int:
+        """
+        Returns the last round known by the cache, without calling algod
+
+        Returns:
+            round: the last round of the chain, 0 if it isn't known yet
+        """
+        with self._lock:
+            return max(self._last_round, self._params.first if self._params is not None else 0)
+
+    def advance(self, round_num: int) -> None:
+        """
+        Tells the cache that the chain reached a new round, which
+        outdates the cached parameters
+
+        Args:
+            round_num: the last round of the chain
+        """
+        with self._lock:
+            self._last_round = max(self._last_round, round_num)
+
+    def stats(self) -> dict:
+        """
+        Returns the hits and misses counters of the cache
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class BalanceCache: # pylint: disable=R0902
+    """
+    Class caching the on-chain balances of the wallets, in microAlgos, keyed by address.
+    The transactions sent by the bot are accounted for by the Ledger until they
+    are confirmed, which invalidates the cached balances so that the next read gets the on-chain value.
+    A balance older than the time-to-live is still returned for a grace period, while it is
+    refreshed in the background (it can only be outdated by transactions the bot didn't send).
+    A fetch that started before an invalidation isn't cached, since it may predate the confirmation
+    """
+    def __init__(self, ttl: float = 10.0, grace: float = 20.0, max_size: int = 1024, workers: int = 2) -> None:
+        self.ttl = ttl
+        self.grace = grace # Seconds past the ttl during which a balance is returned while it is refreshed
+        self.max_size = max_size # Expired balances are only purged above this size
+        self.hits = 0
+        self.misses = 0
+        self._balances: Dict[str, Tuple[int, float]] = {} # address -> (balance, fetch time)
+        self._generation = 0 # Incremented by invalidate
+        self._refreshing: Set[str] = set()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="balance-refresh")
+        self._lock = Lock()
+
+    def get(self, address: str) -> int:
+        """
+        Returns the balance of the given address, fetching it from
+        algod only if it isn't cached or is past the grace period
+
+        Args:
+            address: public key of the wallet
+        Returns:
+            balance: the balance in microAlgos
+        """
+        with self._lock:
+            cached = self._balances.get(address)
+            if cached is not None and (age := monotonic() - cached[1]) <= self.ttl + self.grace:
+                self.hits += 1
+                if age > self.ttl and address not in self._refreshing:
+                    self._refreshing.add(address)
+                    self._executor.submit(self._refresh, address)
+                return cached[0]
+
+        return self._fetch(address)
+
+    def _refresh(self, address: str) -> None:
+        """
+        Fetches an expired balance again, in the background
+        """
+        try:
+            self._fetch(address)
+        except Exception: # pylint: disable=W0703
+            pass # The outdated balance is kept, the next read tries again
+        finally:
+            with self._lock:
+                self._refreshing.discard(address)
+
+    def _fetch(self, address: str, attempts: int = 3) -> int:
+        """
+        Fetches the balance from algod and caches it. If the cache was invalidated
+        meanwhile, the balance may predate a confirmation and is fetched again
+        (it is returned without being cached after the last attempt)
+        """
+        with self._lock:
+            self.misses += 1
+        for _ in range(attempts):
+            with self._lock:
+                generation = self._generation
+            balance = algod.account_info(address)["amount"]
+
+            with self._lock:
+                if generation != self._generation:
+                    continue
+                now = monotonic()
+                if len(self._balances) > self.max_size:
+                    self._balances = {key: value for key, value in self._balances.items()
+                                      if now - value[1] <= self.ttl + self.grace}
+                self._balances[address] = (balance, now)
+                break
+        return balance
+
+    def invalidate(self, *addresses: str) -> None:
+        """
+        Removes the given addresses from the cache
+
+        Args:
+            addresses: public keys of the wallets
+        """
+        with self._lock:
+            self._generation += 1
+            for address in addresses:
+                self._balances.pop(address, None)
+
+    def stats(self) -> dict:
+        """
+        Returns the hits and misses counters of the cache
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._balances)}
+
+
+class RedditCache: # pylint: disable=R0902
+    """
+    Class caching the Reddit metadata used to validate the commands: existence of
+    redditors and subreddits, moderators of subreddits and authors of parent comments.
+    Missing redditors and subreddits are cached too, for a shorter time, and so are
+    the moderators, since they grant the right to (de)activate the bot on a subreddit.
+    The lookups needed by a batch of events can be prefetched concurrently in the background,
+    a command needing a lookup that is being fetched waits for it instead of fetching it again
+    """
+    def __init__(self, # pylint: disable=R0913
+                 ttl: float = 3600,
+                 negative_ttl: float = 300,
+                 moderators_ttl: float = 60,
+                 workers: int = 8,
+                 max_size: int = 4096) -> None:
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.moderators_ttl = moderators_ttl
+        self.max_size = max_size # Expired entries are only purged above this size
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[Tuple[str, str], Tuple[Any, float]] = {} # (kind, key) -> (value, expiry time)
+        self._fetching: Dict[Tuple[str, str], Future] = {} # (kind, key) -> future of the fetch in progress
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="reddit-prefetch")
+        self._lock = Lock()
+
+    def _lookup(self, kind: str, key: str, fetch: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        """
+        Returns the cached value, or fetches and caches it. If another thread is already
+        fetching it, waits for its result (and fetches it again if that fetch failed)
+        Falsy values (missing redditor or subreddit) expire after negative_ttl
+        """
+        with self._lock:
+            cached = self._entries.get((kind, key))
+            if cached is not None and monotonic() < cached[1]:
+                self.hits += 1
+                return cached[0]
+            fetching = self._fetching.get((kind, key))
+            if fetching is None:
+                fetching = self._fetching[(kind, key)] = Future()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            try:
+                return fetching.result()
+            except Exception: # pylint: disable=W0703
+                return self._lookup(kind, key, fetch, ttl) # Failed lookups aren't cached, try again
+
+        try:
+            value = fetch()
+        except Exception as e: # pylint: disable=C0103
+            with self._lock:
+                del self._fetching[(kind, key)]
+            fetching.set_exception(e)
+            raise
+
+        with self._lock:
+            self.misses += 1
+            now = monotonic()
+            if len(self._entries) > self.max_size:
+                self._entries = {entry: cached for entry, cached in self._entries.items() if now < cached[1]}
+            self._entries[(kind, key)] = (value, now + ((ttl or self.ttl) if value else self.negative_ttl))
+            del self._fetching[(kind, key)]
+        fetching.set_result(value)
+        return value
+
+    def invalidate(self, kind: str, key: str) -> None:
+        """
+        Removes an entry from the cache
+
+        Args:
+            kind: kind of the entry (user, subreddit, moderators or parent-author)
+            key: key of the entry
+        """
+        with self._lock:
+            self._entries.pop((kind, key.lower()), None)
+
+    def user_exists(self, username: str) -> bool:
+        """
+        Returns whether or not the redditor exists
+        """
+        def fetch() -> bool:
+            try:
+                reddit.redditor(username).id
+            except NotFound:
+                return False
+            return True
+        return self._lookup("user", username.lower(), fetch)
+
+    def subreddit_exists(self, subreddit: str) -> bool:
+        """
+        Returns whether or not the subreddit exists
+        """
+        def fetch() -> bool:
+            try:
+                reddit.subreddits.search_by_name(subreddit, exact=True)
+            except NotFound:
+                return False
+            return True
+        return self._lookup("subreddit", subreddit.lower(), fetch)
+
+    def moderators(self, subreddit: str) -> FrozenSet[str]:
+        """
+        Returns the lowercase names of the moderators of the subreddit
+        They are only cached for moderators_ttl, so that a removed moderator loses their rights quickly
+        """
+        return self._lookup("moderators", subreddit.lower(),
+                            lambda: frozenset(redditor.name.lower()
+                                              for redditor in reddit.subreddit(subreddit).moderator()),
+                            self.moderators_ttl)
+
+    def parent_author(self, comment: Comment) -> Optional[str]:
+        """
+        Returns the name of the author of the parent of the comment,
+        None if it was deleted
+        """
+        def fetch() -> Optional[str]:
+            author = comment.parent().author
+            return author.name if author is not None else None
+        return self._lookup("parent-author", comment.parent_id, fetch)
+
+    def prefetch(self, events: Iterable[Union[Comment, Message]]) -> None:
+        """
+        Starts fetching concurrently, in the background, the metadata that the given
+        events will need, so that handling them only hits the cache (or waits for the fetch).
+        Doesn't wait for the lookups, so a slow one doesn't hold the caller back
+
+        Args:
+            events: the praw events about to be handled
+        """
+        lookups = []
+        for event in events:
+            if isinstance(event, Comment):
+                lookups.append((self.parent_author, event))
+                continue
+            try:
+                command = parse_message(event.body)
+            except InvalidCommandError:
+                continue
+            if isinstance(command, TipCommand):
+                lookups.append((self.user_exists, command.receiver))
+            elif isinstance(command, SubredditCommand) and command.subreddit is not None:
+                lookups.extend([(self.subreddit_exists, command.subreddit), (self.moderators, command.subreddit)])
+
+        # Failed lookups aren't cached, they are retried (and raise) when the event is handled
+        for lookup, argument in lookups:
+            self._executor.submit(lookup, argument)
+
+    def stats(self) -> dict:
+        """
+        Returns the hits and misses counters of the cache
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+suggested_params = SuggestedParamsCache()
+balances = BalanceCache()
+reddit_metadata = RedditCache()
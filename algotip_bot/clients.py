@@ -18,6 +18,7 @@ from rich.console import Console
 REDIS_PW = os.environ.get("REDIS_PW")
 redis = Redis(password=REDIS_PW, decode_responses=True) # decode_responses is used to automatically
                                                         # convert bytes to strings and vice-versa
+binary_redis = Redis(password=REDIS_PW) # Same DB, for the values stored as raw bytes (msgpack records)
 
 ######################### Initialize Algod connection #########################
 
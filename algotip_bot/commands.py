@@ -0,0 +1,197 @@
+"""
+File containing the command grammar: each event body is tokenized once and
+parsed into a typed command object, amounts being converted to exact microAlgos.
+Malformed commands are rejected here, before any call to Redis, Reddit or algod
+"""
+
+import re
+from dataclasses import dataclass
+from decimal import ROUND_DOWN, Decimal
+from itertools import islice
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+from algosdk import encoding
+
+from algotip_bot.errors import InvalidCommandError
+
+COMMENT_COMMANDS = {"!atip"}
+MICROALGOS_PER_ALGO = 1_000_000
+
+TOKEN = re.compile(r"\S+")
+AMOUNT = re.compile(r"(?:\d{1,12}(?:\.\d*)?|\.\d+)\Z")
+USERNAME = re.compile(r"(?:/?u/)?([A-Za-z0-9_-]{3,20})\Z")
+SUBREDDIT = re.compile(r"(?:/?r/)?([A-Za-z0-9_]{2,21})\Z")
+
+
+def compile_commands(commands: Iterable[str]) -> re.Pattern:
+    """
+    Builds a single matcher for a set of comment commands: a command must be the
+    first word of the comment (in any case). Since the pattern is anchored, the
+    matcher only reads the start of each body, whatever its length or the number of commands
+
+    Args:
+        commands: the commands, e.g. {"!atip"}
+    Returns:
+        pattern: the compiled pattern, to be used with match()
+    """
+    alternatives = "|".join(re.escape(command) for command in sorted(commands, key=len, reverse=True))
+    return re.compile(rf"\s*(?:{alternatives})(?!\S)", re.IGNORECASE)
+
+COMMENT_MATCHER = compile_commands(COMMENT_COMMANDS)
+
+
+@dataclass(frozen=True)
+class TipCommand:
+    """
+    Tip sent by PM (receiver given) or by comment (receiver is the parent author)
+    """
+    amount: int
+    note: str
+    receiver: Optional[str] = None
+    anonymous: bool = False
+
+@dataclass(frozen=True)
+class WithdrawCommand:
+    """
+    Withdrawal to an Algorand address, amount being None to withdraw everything
+    """
+    amount: Optional[int]
+    address: str
+    note: str
+
+@dataclass(frozen=True)
+class WalletCommand:
+    """
+    Request of the wallet information
+    """
+
+@dataclass(frozen=True)
+class SubredditCommand:
+    """
+    Listing, addition or removal of a watched subreddit
+    """
+    action: str
+    subreddit: Optional[str] = None
+
+Command = Union[TipCommand, WithdrawCommand, WalletCommand, SubredditCommand]
+
+
+def parse_amount(token: str) -> int:
+    """
+    Converts a decimal amount of Algos to microAlgos, without going through floats.
+    Digits beyond the microAlgo are dropped
+
+    Args:
+        token: the amount as written in the command
+    Returns:
+        amount: the amount in microAlgos
+    Raises:
+        ValueError: if the token isn't a plain decimal number
+    """
+    if not AMOUNT.match(token):
+        raise ValueError(token)
+    return int((Decimal(token) * MICROALGOS_PER_ALGO).to_integral_value(rounding=ROUND_DOWN))
+
+def _note(body: str, tokens: List[re.Match]) -> str:
+    """
+    Returns the text that follows the given tokens, as it was written
+    """
+    return body[tokens[-1].end():].strip() if tokens else body.strip()
+
+def _parse_tip(body: str, tokens: List[re.Match], subject: str) -> TipCommand:
+    if len(tokens) < 3:
+        raise InvalidCommandError(body)
+    try:
+        amount = parse_amount(tokens[1].group())
+    except ValueError:
+        raise InvalidCommandError(body) from None
+    if not (username := USERNAME.match(tokens[2].group())):
+        raise InvalidCommandError(body)
+    return TipCommand(amount, _note(body, tokens[:3]), username.group(1), subject.lower() == "anonymous")
+
+def _parse_withdraw(body: str, tokens: List[re.Match], _subject: str) -> WithdrawCommand:
+    if len(tokens) < 3:
+        raise InvalidCommandError(body)
+    if (amount_token := tokens[1].group().lower()) == "all":
+        amount = None
+    else:
+        try:
+            amount = parse_amount(amount_token)
+        except ValueError:
+            raise InvalidCommandError(body) from None
+    if not encoding.is_valid_address(address := tokens[2].group()):
+        raise InvalidCommandError(body)
+    return WithdrawCommand(amount, address, _note(body, tokens[:3]))
+
+def _parse_wallet(body: str, tokens: List[re.Match], _subject: str) -> WalletCommand:
+    if len(tokens) > 1:
+        raise InvalidCommandError(body)
+    return WalletCommand()
+
+def _parse_subreddit(body: str, tokens: List[re.Match], _subject: str) -> SubredditCommand:
+    if len(tokens) < 2 or (action := tokens[1].group().lower()) not in ("add", "remove", "list"):
+        raise InvalidCommandError(body)
+    if action == "list":
+        return SubredditCommand(action)
+    if len(tokens) < 3 or not (subreddit := SUBREDDIT.match(tokens[2].group())):
+        raise InvalidCommandError(body)
+    return SubredditCommand(action, subreddit.group(1).lower())
+
+MESSAGE_COMMANDS: Dict[str, Callable[[str, List[re.Match], str], Command]] = {
+    "tip": _parse_tip,
+    "withdraw": _parse_withdraw,
+    "wallet": _parse_wallet,
+    "subreddit": _parse_subreddit,
+}
+
+
+def parse_message(body: str, subject: str = "") -> Command:
+    """
+    Parses the body of a private message
+
+    Args:
+        body: body of the message
+        subject: subject of the message ("anonymous" makes tips anonymous)
+    Returns:
+        command: the parsed command
+    Raises:
+        InvalidCommandError: if the message isn't a valid command
+    """
+    tokens = list(islice(TOKEN.finditer(body), 3)) # The note is sliced from the body, no need to split it
+    if not tokens or (parser := MESSAGE_COMMANDS.get(tokens[0].group().lower())) is None:
+        raise InvalidCommandError(body)
+    return parser(body, tokens, subject)
+
+def find_comment_command(body: str) -> Optional[int]:
+    """
+    Looks for a comment command at the beginning of a comment
+
+    Args:
+        body: body of the comment
+    Returns:
+        position: the position right after the command, None if the comment doesn't start with one
+    """
+    match = COMMENT_MATCHER.match(body)
+    return match.end() if match else None
+
+def parse_comment(body: str, start: Optional[int] = None) -> Optional[TipCommand]:
+    """
+    Parses the body of a comment, which must start with the !atip command
+
+    Args:
+        body: body of the comment
+        start: the position returned by find_comment_command, if it was already called
+    Returns:
+        command: the parsed tip, None if the comment doesn't start with the command
+    Raises:
+        InvalidCommandError: if the comment starts with the command but is malformed
+    """
+    if start is None and (start := find_comment_command(body)) is None:
+        return None
+    if (token := TOKEN.search(body, start)) is None:
+        raise InvalidCommandError(body)
+    try:
+        amount = parse_amount(token.group())
+    except ValueError:
+        raise InvalidCommandError(body) from None
+    return TipCommand(amount, _note(body, [token]))
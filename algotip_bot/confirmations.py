@@ -0,0 +1,276 @@
+"""
+File containing the ConfirmationTracker class, that watches the new
+blocks of the chain and confirms every pending transaction they contain at once
+"""
+
+import base64
+from queue import Empty, Queue
+from threading import Lock, Thread
+from time import sleep
+from typing import Dict, Iterable, List, Optional
+
+import msgpack
+from algosdk import constants, encoding
+
+from algotip_bot.cache import suggested_params
+from algotip_bot.clients import algod, binary_redis
+from algotip_bot.instances import PendingTransaction
+from algotip_bot.ledger import ledger
+from algotip_bot.logs import get_logger
+from algotip_bot.pipeline import lane_of
+
+log = get_logger(__name__)
+
+
+def _canonical(value):
+    """
+    Sorts the keys of (nested) dictionaries so that the msgpack encoding
+    is the canonical one used by Algorand to compute transaction IDs
+    """
+    if isinstance(value, dict):
+        return {key: _canonical(value[key]) for key in sorted(value)}
+    if isinstance(value, list):
+        return [_canonical(item) for item in value]
+    return value
+
+def block_transaction_ids(block: dict) -> List[str]:
+    """
+    Computes the IDs of all the transactions contained in a block
+
+    Args:
+        block: the block as decoded from the msgpack response of algod
+    Returns:
+        tx_ids: list of the transaction IDs found in the block
+    """
+    tx_ids = []
+    for signed_txn in block.get("txns", []):
+        txn = dict(signed_txn["txn"])
+        # The genesis information is stripped from the transactions stored in a block
+        txn["gh"] = block["gh"]
+        if signed_txn.get("hgi"):
+            txn["gen"] = block["gen"]
+        to_sign = constants.txid_prefix + msgpack.packb(_canonical(txn), use_bin_type=True)
+        tx_id = base64.b32encode(encoding.checksum(to_sign)).decode()
+        tx_ids.append(tx_id.rstrip("="))
+    return tx_ids
+
+
+class ConfirmationTracker:
+    """
+    Class keeping an index of the pending transactions by tx_id.
+    Every new block is fetched once and checked against the index, so the
+    polling cost depends on the block rate and not on the number of pending transactions.
+    The blocks outside the validity window of every pending transaction are skipped, and a
+    transaction is only dropped as expired once every block of its window was checked
+    The pending transactions are also saved in the 'pending-transactions' Redis hash
+    (msgpack encoded records), so that they can be recovered after a restart.
+    In the sharded mode, each worker tracks the transactions of the senders of its
+    shards, in one 'pending-transactions:{shard}' hash per shard
+    """
+    def __init__(self, shards: Optional[Iterable[int]] = None, shard_count: int = 1) -> None:
+        self.shards = None if shards is None else list(shards)
+        self.shard_count = shard_count
+        self.pending: Dict[str, PendingTransaction] = {}
+        self.last_round: Optional[int] = None
+        self._confirmed: Queue = Queue()
+        self._lock = Lock()
+        self._thread: Optional[Thread] = None
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def __contains__(self, transaction: PendingTransaction) -> bool:
+        return transaction.tx_id in self.pending
+
+    def _key(self, transaction: PendingTransaction) -> str:
+        """
+        Returns the Redis hash in which the transaction is saved
+        """
+        if self.shards is None:
+            return "pending-transactions"
+        return f"pending-transactions:{lane_of(transaction.sender, self.shard_count)}"
+
+    def _keys(self) -> List[str]:
+        """
+        Returns all the Redis hashes of the transactions tracked by this tracker
+        """
+        if self.shards is None:
+            return ["pending-transactions"]
+        return [f"pending-transactions:{shard}" for shard in self.shards]
+
+    def add(self, transaction: PendingTransaction) -> None:
+        """
+        Starts tracking a transaction that was just sent
+
+        Args:
+            transaction: the record of the sent transaction
+        """
+        with self._lock:
+            self.pending[transaction.tx_id] = transaction
+        binary_redis.hset(self._key(transaction), transaction.tx_id, transaction.pack())
+
+    def recover(self) -> int:
+        """
+        Reloads the transactions that were pending when the bot stopped. Rather than
+        looking each of them up (algod forgets the transactions confirmed a while ago),
+        the tracker resumes from the earliest round in which one of them could have been
+        confirmed, and only checks the blocks within their validity windows (see watch)
+
+        Returns:
+            count: the number of recovered transactions
+        """
+        transactions = [PendingTransaction.unpack(record) for key in self._keys() for record in binary_redis.hvals(key)]
+        if not transactions:
+            return 0
+
+        with self._lock:
+            for transaction in transactions:
+                self.pending[transaction.tx_id] = transaction
+                ledger.record(transaction)
+
+        first_round = min(transaction.first_valid for transaction in transactions)
+        self.last_round = first_round - 1 if self.last_round is None else min(self.last_round, first_round - 1)
+        log.info(f"Recovered {len(transactions)} pending transactions, checking blocks from round {first_round}",
+                 count=len(transactions), round=first_round)
+        return len(transactions)
+
+    def remove(self, transaction: PendingTransaction) -> None:
+        """
+        Stops tracking a transaction
+
+        Args:
+            transaction: the record of the transaction to forget
+        """
+        with self._lock:
+            self.pending.pop(transaction.tx_id, None)
+        binary_redis.hdel(self._key(transaction), transaction.tx_id)
+        ledger.settle(transaction)
+
+    def check_block(self, round_num: int) -> List[PendingTransaction]:
+        """
+        Fetches the given block and confirms all the pending transactions it contains
+
+        Args:
+            round_num: the round of the block to check
+        Returns:
+            confirmed: list of the transactions confirmed in this block
+        """
+        response = msgpack.unpackb(algod.block_info(round_num, response_format="msgpack"), raw=False)
+        tx_ids = block_transaction_ids(response["block"])
+
+        with self._lock:
+            confirmed = [self.pending.pop(tx_id) for tx_id in tx_ids if tx_id in self.pending]
+        self._resolve(confirmed, self._expired(round_num))
+
+        return confirmed
+
+    def _expired(self, round_num: int) -> List[PendingTransaction]:
+        """
+        Stops tracking the transactions whose last valid round is before round_num. Every
+        block of their validity window was checked, so they can't have been confirmed
+        """
+        with self._lock:
+            return [self.pending.pop(transaction.tx_id) for transaction in list(self.pending.values())
+                    if transaction.last_valid is not None and transaction.last_valid < round_num]
+
+    def _next_round(self, round_num: int) -> Optional[int]:
+        """
+        Returns the first round from round_num in which a pending transaction could be
+        confirmed, i.e. within the validity window of one of them, None if there isn't any
+        """
+        with self._lock:
+            return min((max(transaction.first_valid, round_num) for transaction in self.pending.values()
+                        if transaction.last_valid is None or transaction.last_valid >= round_num), default=None)
+
+    def _resolve(self, confirmed: List[PendingTransaction], expired: List[PendingTransaction]) -> None:
+        """
+        Forgets the transactions that were confirmed or expired, and queues the confirmed ones
+        """
+        for transaction in expired:
+            log.warning(f"Transaction {transaction.tx_id} expired without being confirmed", tx_id=transaction.tx_id)
+
+        if confirmed or expired:
+            with binary_redis.pipeline() as pipe:
+                for transaction in confirmed + expired:
+                    pipe.hdel(self._key(transaction), transaction.tx_id)
+                pipe.execute()
+
+        for transaction in confirmed + expired:
+            ledger.settle(transaction)
+
+        for transaction in confirmed:
+            self._confirmed.put(transaction)
+
+    def advance(self, last_round: int) -> None:
+        """
+        Checks the blocks produced since the last checked round, up to last_round,
+        skipping the rounds in which no pending transaction could be confirmed.
+        The last checked round only moves past a block once it was checked,
+        so a block that couldn't be fetched is checked again by the next call
+
+        Args:
+            last_round: the last round of the chain
+        """
+        round_num = self.last_round + 1
+        while (round_num := self._next_round(round_num)) is not None and round_num <= last_round:
+            self.check_block(round_num)
+            self.last_round = round_num
+            round_num += 1
+        self.last_round = last_round
+        self._resolve([], self._expired(last_round + 1))
+
+    def watch(self) -> None:
+        """
+        Blocks on algod until a new round is reached, then checks the
+        blocks that were produced since the last call. Runs forever
+        """
+        if self.last_round is None:
+            self.last_round = algod.status()["last-round"]
+
+        while True:
+            try:
+                last_round = algod.status_after_block(self.last_round)["last-round"]
+                self.advance(last_round)
+                suggested_params.advance(last_round)
+            except Exception: # pylint: disable=W0703
+                log.exception(f"Could not check the blocks after round {self.last_round}", round=self.last_round)
+                sleep(1)
+
+    def start(self) -> None:
+        """
+        Starts watching the chain in a background thread
+        """
+        if self._thread is None:
+            self._thread = Thread(target=self.watch, name="confirmation-tracker", daemon=True)
+            self._thread.start()
+
+    def wait(self, timeout: float) -> List[PendingTransaction]:
+        """
+        Waits until a transaction is confirmed, at most timeout seconds, so that the
+        confirmations are handled as soon as their block was checked
+
+        Args:
+            timeout: maximum number of seconds to wait
+        Returns:
+            confirmed: list of the confirmed PendingTransaction records, empty if none was confirmed in time
+        """
+        try:
+            confirmed = [self._confirmed.get(timeout=timeout)]
+        except Empty:
+            return []
+        return confirmed + self.collect()
+
+    def collect(self) -> List[PendingTransaction]:
+        """
+        Returns the records of all the transactions that were confirmed since the last call,
+        without blocking
+
+        Returns:
+            confirmed: list of the confirmed PendingTransaction records
+        """
+        confirmed = []
+        while True:
+            try:
+                confirmed.append(self._confirmed.get_nowait())
+            except Empty:
+                return confirmed
@@ -12,7 +12,7 @@ class ZeroTransactionError(Exception):
     pass
 
 class InsufficientFundsError(Exception):
-    def __init__(self, amount: float, balance: float) -> None:
+    def __init__(self, amount: int, balance: int) -> None:
         self.amount, self.balance = amount, balance
 
 class InvalidUserError(Exception):
@@ -20,7 +20,7 @@ class InvalidUserError(Exception):
         self.username = username
 
 class FirstTransactionError(Exception):
-    def __init__(self, amount: float) -> None:
+    def __init__(self, amount: int) -> None:
         self.amount = amount
 
 class InvalidSubredditError(Exception):
@@ -29,3 +29,7 @@ class InvalidSubredditError(Exception):
 
 class NotModeratorError(Exception):
     pass
+
+class DuplicateEventError(Exception):
+    def __init__(self, event: str) -> None:
+        self.event = event
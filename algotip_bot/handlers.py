@@ -5,22 +5,36 @@ File containing the EventHandler class, that takes in
 a praw Event and performs the matching action
 """
 
-from time import time_ns
-from typing import Union
+from concurrent.futures import Future
+from typing import Optional, Union
 
-from algosdk import encoding
+from algosdk.util import microalgos_to_algos
 
 from praw.models.reddit.comment import Comment
 from praw.models.reddit.message import Message
 
-from algotip_bot.clients import console, redis
-from algotip_bot.errors import (InsufficientFundsError, InvalidCommandError,
+from algotip_bot.cache import reddit_metadata
+from algotip_bot.clients import redis
+from algotip_bot.commands import (Command, SubredditCommand, TipCommand,
+                                WalletCommand, WithdrawCommand,
+                                parse_comment, parse_message)
+from algotip_bot.confirmations import ConfirmationTracker
+from algotip_bot.errors import (DuplicateEventError, InsufficientFundsError,
                                InvalidSubredditError, InvalidUserError,
                                NotModeratorError, ZeroTransactionError)
+from algotip_bot.idempotency import NEW, SENDING, STARTED, event_log
 from algotip_bot.instances import User
+from algotip_bot.logs import get_logger
+from algotip_bot.messaging import outbox
+from algotip_bot.metrics import metrics
 from algotip_bot.templates import (EVENT_RECEIVED, INSUFFICIENT_FUNDS,
-                                  NO_WALLET, ZERO_TRANSACTION, LIST_SUBREDDITS)
-from algotip_bot.utils import is_float, valid_subreddit, valid_user
+                                  NO_WALLET, ZERO_TRANSACTION, LIST_SUBREDDITS,
+                                  TRANSACTION_NOT_SENT, TRANSACTION_UNKNOWN)
+from algotip_bot.utils import valid_subreddit, valid_user
+
+BODY_LIMIT = 200 # Characters of the event bodies kept in the JSON logs
+
+log = get_logger(__name__)
 
 
 class EventHandler:
@@ -29,151 +43,214 @@ class EventHandler:
     and keep in memory the unconfirmed transactions
     note: could probably do  without a class
     """
-    unconfirmed_transactions: set = set()
+    unconfirmed_transactions: ConfirmationTracker = ConfirmationTracker()
 
-    def handle_comment(self, comment: Comment) -> None:
+    @metrics.timed("handle_comment")
+    def handle_comment(self, comment: Comment, command: TipCommand) -> Optional[Future]:
         """
         Handle a comment.
         The only use of the comment is to tip the person whose
         post/comment was commented using !atip
+
+        Returns:
+            future: resolves to the record of the tip once it is sent, None if nothing is sent
         """
-        author = User(comment.author.name)
+        author = User.load(comment.author.name)
         if author.new:
-            comment.reply(NO_WALLET)
-            return
-        receiver = User(comment.parent().author.name)
-        command = comment.body.split()
-        first_word = command.pop(0).lower() # Get rid of the /u/AlgorandTipBot
-        if first_word not in "!atip":
-            return
-
-        if not command: raise InvalidCommandError(comment.body) # If command empty after popping username
-        if not is_float(amount:=command.pop(0)): raise InvalidCommandError(comment.body)
-
-        amount = float(amount)
-        note = " ".join(command)
+            outbox.reply(comment.fullname, NO_WALLET)
+            return None
+        if (parent_author := reddit_metadata.parent_author(comment)) is None:
+            return None # The parent was deleted, there is no one to tip
+        receiver = User.load(parent_author)
 
         try:
-            transaction = author.send(receiver, amount, note)
-            self.unconfirmed_transactions.add(transaction)
+            return author.send(receiver, command.amount, command.note, event=comment.fullname)
         except ZeroTransactionError:
             author.message("Zero transaction",
                            ZERO_TRANSACTION)
-        except InsufficientFundsError as e: # pylint: disable=C0103
+        except InsufficientFundsError as e: # pylint: disable=C0103
             author.message("Insufficient funds",
-                           INSUFFICIENT_FUNDS.substitute(balance=e.balance,
-                                                         amount=e.amount))
-    def handle_message(self, message: Message) -> None: # pylint: disable=R0912, R0915
+                           INSUFFICIENT_FUNDS.substitute(balance=microalgos_to_algos(e.balance),
+                                                         amount=microalgos_to_algos(e.amount)))
+        return None
+
+    @metrics.timed("handle_message")
+    def handle_message(self, message: Message, command: Command) -> Optional[Future]: # pylint: disable=R0912
         """
-        Parses the incoming message to determine what action to take
+        Performs the action of the command parsed from the message
         The user can:
          * tip (anonymously)
          * withdraw
          * check balance
          * (de)activate the bot on subreddits
+
+        Returns:
+            future: resolves to the record of the tip once it is sent, None if no tip is sent
         """
-        author = User(message.author.name)
-        command = message.body.split()
-        main_cmd = command.pop(0).lower()
-        anonymous = (message.subject.lower() == "anonymous")
+        author = User.load(message.author.name)
 
         ######################### Handle tip command #########################
-        if main_cmd == "tip": # This whole check is ugly, make it nice
-            if len(command) < 2: raise InvalidCommandError(message.body)
-
-            if not is_float(amount:=command.pop(0)): raise InvalidCommandError(message.body)
-
-            if not valid_user(username:=command.pop(0)): raise InvalidUserError(username)
+        if isinstance(command, TipCommand):
+            if not valid_user(command.receiver): raise InvalidUserError(command.receiver)
 
-            amount = float(amount)
-            receiver = User(username)
-            note = " ".join(command)
+            receiver = User.load(command.receiver)
 
             try:
-                transaction = author.send(receiver, amount, note, anonymous)
-                self.unconfirmed_transactions.add(transaction)
+                return author.send(receiver, command.amount, command.note, command.anonymous,
+                                   event=message.fullname)
             except ZeroTransactionError:
                 author.message("Zero transaction",
                                ZERO_TRANSACTION)
-            except InsufficientFundsError as e: # pylint: disable=C0103
+            except InsufficientFundsError as e: # pylint: disable=C0103
                 author.message("Insufficient funds",
-                               INSUFFICIENT_FUNDS.substitute(balance=e.balance,
-                                                             amount=e.amount))
+                               INSUFFICIENT_FUNDS.substitute(balance=microalgos_to_algos(e.balance),
+                                                             amount=microalgos_to_algos(e.amount)))
 
         ######################### Handle withdraw command #########################
-        elif main_cmd == "withdraw":
-            if len(command) < 2: raise InvalidCommandError(message.body)
-            if not ((amount:=command.pop(0)) or is_float(amount)): raise InvalidCommandError(message.body)
-            if not encoding.is_valid_address(address:=command.pop(0)): raise InvalidCommandError(message.body)
-            note = " ".join(command)
-
+        elif isinstance(command, WithdrawCommand):
             try:
-                transaction = author.withdraw(amount, address, note)
+                transaction = author.withdraw(command.amount, command.address, command.note,
+                                              event=message.fullname)
                 self.unconfirmed_transactions.add(transaction)
             except ZeroTransactionError:
                 author.message("Zero transaction",
                                ZERO_TRANSACTION)
-            except InsufficientFundsError as e: # pylint: disable=C0103
+            except InsufficientFundsError as e: # pylint: disable=C0103
                 author.message("Insufficient funds",
-                               INSUFFICIENT_FUNDS.substitute(balance=e.balance,
-                                                             amount=e.amount))
+                               INSUFFICIENT_FUNDS.substitute(balance=microalgos_to_algos(e.balance),
+                                                             amount=microalgos_to_algos(e.amount)))
         ######################### Handle wallet command #########################
-        elif main_cmd == "wallet":
-            if len(command) > 0: raise InvalidCommandError(message.body)
-
+        elif isinstance(command, WalletCommand):
             if author.new:
                 pass
             else:
-                message.reply(str(author.wallet))
+                outbox.reply(message.fullname, str(author.wallet))
 
-            console.log(f"Wallet information sent to {author.name} (#{author.user_id})")
+            log.info(f"Wallet information sent to {author.name} (#{author.user_id})", user=author.name)
 
         ######################### Handle subreddit command #########################
-        elif main_cmd == "subreddit":
-            if not command: raise InvalidCommandError(message.body) # Raise an error if there is nothing after subreddit
-            if (action:=command.pop(0)) not in ("add", "remove", "list"): raise InvalidCommandError(message.body)
-
-            if action == "list":
+        elif isinstance(command, SubredditCommand):
+            if command.action == "list":
                 author.message('Subreddits',
                                LIST_SUBREDDITS.substitute(subreddits=', '.join(redis.smembers('subreddits'))))
-                return
+                return None
 
-            if not command: raise InvalidCommandError(message.body) # Raise error if there is nothing after add/remove
-            if not valid_subreddit(subreddit:=(command.pop(0).lower())): raise InvalidSubredditError(subreddit)
+            subreddit = command.subreddit
+            if not valid_subreddit(subreddit): raise InvalidSubredditError(subreddit)
             if not author.is_moderator(subreddit): raise NotModeratorError
 
-            if action == "add":
+            if command.action == "add":
                 redis.sadd("subreddits", subreddit)
-                console.log(f"Subreddit {subreddit} added")
+                log.info(f"Subreddit {subreddit} added", subreddit=subreddit, user=author.name)
                 author.message('Subreddit added', f'The subreddit {subreddit} was sucessfully added')
-            elif action == "remove":
+            elif command.action == "remove":
                 redis.srem("subreddits", subreddit)
-                console.log(f"Subreddit {subreddit} removed")
+                log.info(f"Subreddit {subreddit} removed", subreddit=subreddit, user=author.name)
                 author.message('Subreddit removed', f'The subreddit {subreddit} was sucessfully removed')
 
+        return None
 
-        ######################### Handle unknown command #########################
-        else:
-            raise InvalidCommandError(message.body)
-
-    def handle_event(self, event: Union[Comment, Message]) -> None:
+    @metrics.timed("handle_event")
+    def handle_event(self, event: Union[Comment, Message], start: Optional[int] = None) -> Optional[Future]:
         """
-        Logs the incoming event and distributes it to handle_comment
+        Parses the incoming event, logs it and distributes it to handle_comment
         or handle_message depending on the type
+        Malformed commands raise an InvalidCommandError before anything is logged or fetched
+        An event whose transaction was already sent (see EventLog) is only looked up,
+        the author of an event left sending its transaction is notified (see _notify_stuck)
+
+        Args:
+            event: the praw event
+            start: position of the command in the body of a comment, as found by stream()
+        Returns:
+            future: for a tip, resolves once the tip is sent and tracked (or to the error
+                    that prevented it), None if the event was handled synchronously
         """
-        command_id = redis.incr("command-id")
-        redis.zadd("commands", {command_id: time_ns() * 1e-6})
-        redis.hmset(f"command:{command_id}", {"user": event.author.name,
-                                              "content": event.body})
-
-        console.log(EVENT_RECEIVED.substitute(author=event.author,
-                                              command_id=command_id,
-                                              event_type=type(event).__name__.lower(),
-                                              body=event.body))
-
-        if isinstance(event, Message):
-            self.handle_message(event)
-        elif isinstance(event, Comment):
-            self.handle_comment(event)
+        with metrics.stage("handle_event.parse"):
+            if isinstance(event, Message):
+                command = parse_message(event.body, event.subject)
+            elif isinstance(event, Comment):
+                if (command := parse_comment(event.body, start)) is None:
+                    return None # The command isn't at the beginning of the comment
+            else:
+                log.warning(f"Unknown event was received, of type : {type(event)}")
+                return None
+
+        with metrics.stage("handle_event.log"):
+            command_id, state = event_log.begin(event.fullname, event.author.name, event.body)
+            if state not in (NEW, STARTED): # Received again after its transaction was claimed
+                if state == SENDING: # Left behind by a crash or an error, it can't be sent again
+                    self._notify_stuck(event, command_id)
+                else:
+                    log.info(f"Event {event.fullname} (command #{command_id}) was already handled, state : {state}",
+                             event=event.fullname, command_id=command_id, state=state)
+                return None
+
+            if log.sampled(): # Event bodies are the chattiest lines, they can be sampled
+                log.info(EVENT_RECEIVED.substitute(author=event.author,
+                                                   command_id=command_id,
+                                                   event_type=type(event).__name__.lower(),
+                                                   body=event.body),
+                         command_id=command_id, author=event.author.name,
+                         event_type=type(event).__name__.lower(), body=event.body[:BODY_LIMIT])
+
+        try:
+            if isinstance(event, Message):
+                sending = self.handle_message(event, command)
+            else:
+                sending = self.handle_comment(event, command)
+        except DuplicateEventError: # Another handler of the same event sent the transaction
+            log.info(f"Event {event.fullname} (command #{command_id}) is handled elsewhere",
+                     event=event.fullname, command_id=command_id)
+            return None
+
+        if sending is None:
+            event_log.done(event.fullname)
+            return None
+        return self._track(event, sending)
+
+    @staticmethod
+    def _notify_stuck(event: Union[Comment, Message], command_id: int) -> None:
+        """
+        Warns the author of an event whose transaction was claimed but not recorded as sent.
+        Without a transaction id it never reached algod, otherwise it may have been sent
+        and the author gets the link to check it. The event is then marked as handled
+
+        Args:
+            event: the praw event left in the sending state
+            command_id: id of the command of the event
+        """
+        tx_id = event_log.tx_id(event.fullname)
+        log.warning(f"Event {event.fullname} (command #{command_id}) was left sending its transaction"
+                    f" ({tx_id or 'not sent'}), notifying {event.author.name}",
+                    event=event.fullname, command_id=command_id, tx_id=tx_id)
+        if tx_id is None:
+            body = TRANSACTION_NOT_SENT.substitute(body=event.body)
         else:
-            console.log(f"Unknown event was received, of type : {type(event)}")
+            body = TRANSACTION_UNKNOWN.substitute(body=event.body, transaction_id=tx_id)
+        outbox.message(event.author.name, "Issue", body)
+        event_log.done(event.fullname)
+
+    def _track(self, event: Union[Comment, Message], sending: Future) -> Future:
+        """
+        Tracks the tip of an event once it is sent, then marks the event as handled
+
+        Args:
+            event: the praw event of the tip
+            sending: future resolving to the record of the tip once it is sent
+        Returns:
+            future: resolves once the event is handled, or to the error raised while sending the tip
+        """
+        handled: Future = Future()
+
+        def track(sending: Future) -> None:
+            try:
+                self.unconfirmed_transactions.add(sending.result())
+                event_log.done(event.fullname)
+            except Exception as e: # pylint: disable=W0703, C0103
+                handled.set_exception(e)
+            else:
+                handled.set_result(None)
+
+        sending.add_done_callback(track)
+        return handled
@@ -0,0 +1,126 @@
+"""
+File containing the EventLog class, that records the outcome of every event in
+Redis, keyed by its Reddit fullname, so that an event handled twice (mark_read failure,
+restart, redelivery to a sharded worker) can't send its transaction twice
+"""
+
+from time import time_ns
+from typing import Dict, Optional, Tuple
+
+from algotip_bot.clients import redis
+from algotip_bot.errors import DuplicateEventError
+from algotip_bot.redis_scripts import BEGIN_EVENT, CLAIM_SEND
+
+EVENT_TTL = 30 * 24 * 3600 # Seconds during which the outcome of an event is remembered
+
+# States of an event, in order
+NEW = "new" # Returned by begin() only, the event wasn't received before
+STARTED = "started" # Being handled, nothing was sent yet: handling it again is safe
+SENDING = "sending" # Its transaction may have reached algod, it must never be sent again
+SENT = "sent" # Its transaction was accepted by algod
+DONE = "done" # Handled
+
+
+class EventLog:
+    """
+    Records in the 'event:{fullname}' Redis hashes the command id, the state
+    and the transaction id of the events. An event goes through:
+     * started: when it is received (begin), along with its command id
+     * sending: right before its transaction is sent (claim_send), atomically,
+                so that only one handler of a duplicated event can send it.
+                The transaction id is recorded before it reaches algod (sending)
+     * sent: once algod accepted the transaction
+     * done: once it was handled
+    An event found in a later state than started is not handled again. An event found
+    sending was left behind by a crash or an error, its transaction may not have been sent
+    """
+    def __init__(self, ttl: int = EVENT_TTL) -> None:
+        self.ttl = ttl
+        self.duplicates = 0
+
+    def begin(self, fullname: str, author: str, body: str) -> Tuple[int, str]:
+        """
+        Allocates a command id for a new event and marks it as started,
+        or returns the command id and state of an event received before
+
+        Args:
+            fullname: fullname of the event
+            author: name of the author of the event
+            body: body of the event
+        Returns:
+            command_id, state: the id of the command and the state of the event before the call
+        """
+        command_id, state = BEGIN_EVENT(keys=[f"event:{fullname}", "command-id", "commands"],
+                                        args=[time_ns() * 1e-6, self.ttl])
+        if state == NEW:
+            redis.hset(f"command:{command_id}", mapping={"user": author, "content": body})
+        elif state != STARTED:
+            self.duplicates += 1
+        return int(command_id), state
+
+    def claim_send(self, fullname: Optional[str]) -> None:
+        """
+        Marks the event as sending its transaction. Must be called right before the send
+
+        Args:
+            fullname: fullname of the event, None if the transaction doesn't come from an event
+        Raises:
+            DuplicateEventError: if the transaction of the event was already sent, or is being sent
+        """
+        if fullname is None:
+            return
+        if not CLAIM_SEND(keys=[f"event:{fullname}"]):
+            self.duplicates += 1
+            raise DuplicateEventError(fullname)
+
+    def release_send(self, fullname: Optional[str]) -> None:
+        """
+        Marks the event as started again, when algod rejected its transaction (nothing was sent)
+        """
+        if fullname is not None:
+            redis.hset(f"event:{fullname}", "state", STARTED)
+
+    def sending(self, tx_ids: Dict[Optional[str], str]) -> None:
+        """
+        Records the transaction ids of events right before their transactions are sent,
+        in a single round trip. An event without one never reached algod
+
+        Args:
+            tx_ids: transaction id of each event, by fullname (None if the transaction doesn't come from an event)
+        """
+        tx_ids = {fullname: tx_id for fullname, tx_id in tx_ids.items() if fullname is not None}
+        if not tx_ids:
+            return
+        with redis.pipeline() as pipe:
+            for fullname, tx_id in tx_ids.items():
+                pipe.hset(f"event:{fullname}", "tx-id", tx_id)
+            pipe.execute()
+
+    def sent(self, fullname: Optional[str], tx_id: str) -> None:
+        """
+        Records the transaction of the event once algod accepted it.
+        Must be called before anything else that can fail
+        """
+        if fullname is not None:
+            redis.hset(f"event:{fullname}", mapping={"state": SENT, "tx-id": tx_id})
+
+    def tx_id(self, fullname: str) -> Optional[str]:
+        """
+        Returns the id of the transaction of the event, None if it didn't reach the sending step
+        """
+        return redis.hget(f"event:{fullname}", "tx-id")
+
+    def done(self, fullname: str) -> None:
+        """
+        Marks the event as handled
+        """
+        redis.hset(f"event:{fullname}", "state", DONE)
+
+    def stats(self) -> dict:
+        """
+        Returns the number of duplicated events that were stopped
+        """
+        return {"duplicates": self.duplicates}
+
+
+event_log = EventLog()
@@ -2,23 +2,41 @@
 TODO
 """
 
+import base64
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future
 from dataclasses import dataclass
+from threading import Lock
 from time import time_ns
-from typing import Optional
+from typing import Optional, Tuple
 
-from algosdk import transaction
+import msgpack
+from algosdk import encoding, transaction
 from algosdk.account import generate_account
+from algosdk.error import AlgodHTTPError
 from algosdk.mnemonic import from_private_key
-from algosdk.util import algos_to_microalgos, microalgos_to_algos
+from algosdk.util import microalgos_to_algos
 
-from algotip_bot.clients import algod, console, reddit, redis
+from algotip_bot.cache import reddit_metadata, suggested_params
+from algotip_bot.clients import algod, redis
 from algotip_bot.errors import (FirstTransactionError, InsufficientFundsError,
                                ZeroTransactionError)
+from algotip_bot.idempotency import event_log
+from algotip_bot.ledger import ledger
+from algotip_bot.logs import get_logger
+from algotip_bot.messaging import outbox
+from algotip_bot.metrics import metrics
+from algotip_bot.redis_scripts import GET_OR_CREATE_USER
+from algotip_bot.submitter import submitter
 from algotip_bot.templates import (NEW_USER, TIP_RECEIVED,
                                   TRANSACTION_CONFIRMATION, WALLET_REPR,
                                   WITHDRAWAL_CONFIRMATION)
 
+MIN_BALANCE = 100_000 # Minimum balance of an Algorand account, in microAlgos
+
+log = get_logger(__name__)
+
 
 @dataclass
 class Wallet:
@@ -51,7 +69,20 @@ class Wallet:
                 None if the wallet information isn't found in the DB
                 An instance of the class Wallet with the fetched keys otherwise
         """
-        wallet_dict = redis.hgetall(f"wallets:{user_id}")
+        return cls.from_dict(redis.hgetall(f"wallets:{user_id}"))
+
+    @classmethod
+    def from_dict(cls, wallet_dict: dict) -> Optional["Wallet"]:
+        """
+        Creates the wallet from the hash stored in the DB
+
+        Args:
+            wallet_dict: the wallet hash, empty if the user has no wallet
+        Returns:
+            wallet:
+                None if the hash is empty
+                An instance of the class Wallet with the stored keys otherwise
+        """
         if not wallet_dict: # pylint: disable=R1705
             return None
         else:
@@ -65,9 +96,10 @@ class Wallet:
         Args:
             user: an instance of User corresponding to the wallet owner
         """
-        console.log(f"Wallet created for user {user.name} (#{user.user_id})")
+        log.info(f"Wallet created for user {user.name} (#{user.user_id})", user=user.name, public_key=self.public_key)
         redis.hmset(f"wallets:{user.user_id}", {"private_key": self.private_key,
                                                 "public_key": self.public_key})
+        users.invalidate(user.name)
 
     @property
     def qrcode(self) -> None:
@@ -77,16 +109,15 @@ class Wallet:
         return f"https://api.qrserver.com/v1/create-qr-code/?data={self.public_key}&size=220x220&margin=4"
 
     @property
-    def balance(self) -> float:
+    def balance(self) -> int:
         """
-        Returns the balance of the wallet
+        Returns the spendable balance of the wallet, i.e. its confirmed
+        balance minus the transactions it is sending
 
         Returns:
-            balance: the balance of the wallet as a float, in Algos
+            balance: the balance of the wallet, in microAlgos
         """
-        account_info = algod.account_info(self.public_key)
-        balance = float(microalgos_to_algos(account_info["amount"]))
-        return balance
+        return ledger.available(self.public_key)
 
     def __repr__(self) -> str:
         """
@@ -97,7 +128,7 @@ class Wallet:
         """
         return WALLET_REPR.substitute(private_key=from_private_key(self.private_key),
                                       public_key=self.public_key,
-                                      balance=self.balance,
+                                      balance=microalgos_to_algos(self.balance),
                                       qr_code_link=self.qrcode)
 
 class User:
@@ -110,26 +141,45 @@ class User:
         """
         self.name = name.lower()
 
-        if (user_id:=redis.get(f"users:{self.name}")) is None:
-            user_id = redis.incr("user-id")
-            self.user_id = user_id
+        # Fetches (or atomically allocates) the user id. The wallet hash is read separately,
+        # its key depends on the id and must be declared to the script otherwise
+        user_id, created = GET_OR_CREATE_USER(keys=[f"users:{self.name}", "user-id"])
+        self.user_id = int(user_id)
+        if created:
             self.log()
-        else:
-            self.user_id = user_id
 
         self.new = False
 
-        if wallet is None:
+        if wallet is None and not created: # A user that was just created has no wallet yet
             wallet = Wallet.load(self.user_id)
 
         if wallet is None:
             self.new = True
             wallet = Wallet.generate()
-            reddit.redditor(self.name).message("Wallet created", NEW_USER.substitute(wallet=str(wallet)))
+            outbox.message(self.name, "Wallet created", NEW_USER.substitute(wallet=str(wallet)))
             wallet.log(self)
 
         self.wallet = wallet
 
+    @classmethod
+    def load(cls, name: str) -> "User":
+        """
+        Returns the user with the given name, from the identity map if it
+        was already loaded, from the DB otherwise
+
+        Args:
+            name: Reddit username
+        Returns:
+            user: the User instance
+        """
+        if (user := users.get(name)) is None:
+            user = cls(name)
+            # Users whose wallet was just created aren't cached, so that
+            # the next lookup doesn't see them as new anymore
+            if not user.new:
+                users.put(user)
+        return user
+
     def is_moderator(self, subreddit: str) -> bool:
         """
         Checks if the user is a moderator of the given subreddit
@@ -141,93 +191,162 @@ class User:
                 True if the user is a mod
                 False otherwise
         """
-        moderators = set(reddit.subreddit(subreddit).moderator())
-        moderators = {redditor.name.lower() for redditor in moderators}
-        return self.name in moderators
+        if self.name in reddit_metadata.moderators(subreddit):
+            return True
+        # The cached moderators may predate the promotion of the user, they are fetched again next time
+        reddit_metadata.invalidate("moderators", subreddit)
+        return False
 
     def send(self,
              other_user: "User",
-             amount: float,
+             amount: int,
              note: str,
-             anonymous: bool = False) -> Optional["Transaction"]:
+             anonymous: bool = False,
+             event: Optional[str] = None) -> Future:
         """
         Send Algos to the targeted user
 
         Args:
             other_user:
-            amount:
+            amount: amount to send, in microAlgos
             note:
-            event:
             anonymous:
+            event: fullname of the Reddit event of the tip, so that it can't be sent twice
         Returns:
-            trsctn: the Transaction instance representing the transaction that was sent
+            future: resolves to the record of the transaction once it is sent, to track its confirmation
         """
-        trsctn = TipTransaction(self, other_user, amount, note, anonymous)
+        trsctn = TipTransaction(self, other_user, amount, note, anonymous, event)
         trsctn.validate()
-        trsctn.send()
-        return trsctn
+        return trsctn.send()
 
-    def withdraw(self, amount: float, address: str, note: str) -> Optional["Transaction"]:
+    def withdraw(self,
+                 amount: Optional[int],
+                 address: str,
+                 note: str,
+                 event: Optional[str] = None) -> "PendingTransaction":
         """
         Withdraw Algos to the targeted address
 
         Args:
-            amount:
+            amount: amount to withdraw in microAlgos, None to withdraw everything
             address:
             note:
+            event: fullname of the Reddit event of the withdrawal, so that it can't be sent twice
         Returns:
-            trsctn: the Transaction instance representing the transaction that was sent
+            pending: the record of the transaction that was sent, to track its confirmation
         """
-        trsctn = WithdrawTransaction(self, address, amount, note)
+        trsctn = WithdrawTransaction(self, address, amount, note, event)
         trsctn.validate()
         trsctn.send()
-        return trsctn
+        return trsctn.pending
 
-    def message(self, subject: str, message: str) -> None:
+    def message(self, subject: str, message: str, coalesce: bool = False) -> None:
         """
-        Messages the user on Reddit
+        Messages the user on Reddit (the message is queued in the outbox)
 
         Arguments:
             subject: subject of the PM
             message: body of the PM
+            coalesce: whether the PM can be merged with other notifications
         """
-        reddit.redditor(self.name).message(subject, message)
+        outbox.message(self.name, subject, message, coalesce)
 
     def log(self):
         """
-        Log the user creation in the console and save it in the DB
+        Log the user creation in the console (the user is saved in
+        the DB when its id is allocated)
+        """
+        log.info(f"New user : {self.name} (#{self.user_id})", user=self.name, user_id=self.user_id)
+
+
+class UserCache:
+    """
+    Bounded LRU identity map of the users already loaded from the DB.
+    It avoids hitting Redis every time the same user is involved in a command,
+    while bounding the number of private keys held in memory
+    """
+    def __init__(self, max_size: int = 1024) -> None:
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._users: "OrderedDict[str, User]" = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, name: str) -> Optional[User]:
+        """
+        Returns the cached user with the given name, if any
+
+        Args:
+            name: Reddit username
+        Returns:
+            user: the cached User instance, None if it isn't cached
+        """
+        name = name.lower()
+        with self._lock:
+            if (user := self._users.get(name)) is None:
+                self.misses += 1
+                return None
+            self._users.move_to_end(name)
+            self.hits += 1
+            return user
+
+    def put(self, user: User) -> None:
+        """
+        Caches a user, evicting the least recently used one if the cache is full
+
+        Args:
+            user: the User instance to cache
+        """
+        with self._lock:
+            self._users[user.name] = user
+            self._users.move_to_end(user.name)
+            while len(self._users) > self.max_size:
+                self._users.popitem(last=False)
+
+    def invalidate(self, name: str) -> None:
+        """
+        Removes a user from the cache
+
+        Args:
+            name: Reddit username
+        """
+        with self._lock:
+            self._users.pop(name.lower(), None)
+
+    def stats(self) -> dict:
+        """
+        Returns the hit rate and size of the cache
         """
-        console.log(f"New user : {self.name} (#{self.user_id})")
-        redis.set(f"users:{self.name}", self.user_id)
+        lookups = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit-rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "size": len(self._users)}
+
+
+users = UserCache()
 
 
 class Transaction(ABC):
     """
     Abstract class to define the methods required for a
-    transaction
+    transaction. A Transaction holds the users (and their keys) only while it
+    is validated and sent, the sent transaction is then tracked as a PendingTransaction
     """
     @abstractmethod
     def validate(self) -> bool: # pylint: disable=C0116
         pass
 
     @abstractmethod
-    def send(self) -> "Transaction": # pylint: disable=C0116
-        pass
-
-    @abstractmethod
-    def confirmed(self) -> bool: # pylint: disable=C0116
-        pass
-
-    @abstractmethod
-    def send_confirmation(self) -> None: # pylint: disable=C0116
+    def build(self) -> transaction.PaymentTxn: # pylint: disable=C0116
         pass
 
     @abstractmethod
-    def log(self) -> None: # pylint: disable=C0116
+    def send(self) -> "Transaction": # pylint: disable=C0116
         pass
 
     @abstractmethod
-    def __hash__(self) -> int: # pylint: disable=C0116
+    def sent(self, signed_txn: transaction.SignedTransaction) -> None: # pylint: disable=C0116
         pass
 
 @dataclass
@@ -238,109 +357,98 @@ class TipTransaction(Transaction): # pylint: disable=R0902
     """
     sender: "User"
     receiver: "User"
-    amount: float
+    amount: int # microAlgos
     message: str
     anonymous: bool
+    event: str = None # Fullname of the Reddit event
     tx_id: str = None
     redis_tx_id: int = None
-    fee: float = None
+    fee: int = None # microAlgos
     time: int = None
+    first_valid: int = None
+    last_valid: int = None
     params = None
+    pending = None
 
+    @metrics.timed("tip.validate")
     def validate(self) -> bool:
         """
         Check that the transaction is valid, otherwise raise
         a custom error indicating the issue.
         """
-        self.params = algod.suggested_params()
-        self.fee = float(microalgos_to_algos(self.params.min_fee))
+        self.params = suggested_params.get()
+        self.fee = self.params.min_fee
 
-        if self.amount < 1e-6:
+        if self.amount <= 0:
             raise ZeroTransactionError
 
-        if (self.amount + self.fee + 0.1) > self.sender.wallet.balance:
-            raise InsufficientFundsError(self.amount,
-                                         self.sender.wallet.balance)
+        if self.amount + self.fee + MIN_BALANCE > (balance := self.sender.wallet.balance):
+            raise InsufficientFundsError(self.amount, balance)
 
-        if self.receiver.wallet.balance == 0 and self.amount < 0.1:
+        if self.amount < MIN_BALANCE and self.receiver.wallet.balance == 0:
             raise FirstTransactionError(self.amount)
 
-    def send(self) -> "TipTransaction":
+    def build(self) -> transaction.PaymentTxn:
         """
-        Perform checks to make sure that the transaction can be done
-        before creating it and sending it
-
-        Returns:
-            Transaction: returns itself if the transaction was successfully
-                         None otherwise
+        Creates the unsigned payment transaction
         """
         params = self.params
-        txn = transaction.PaymentTxn(self.sender.wallet.public_key,
-                                    params.min_fee,
-                                    params.first,
-                                    params.last,
-                                    params.gh,
-                                    self.receiver.wallet.public_key,
-                                    algos_to_microalgos(self.amount),
-                                    note=str.encode(self.message),
-                                    flat_fee=True)
-
-        signed_txn = txn.sign(self.sender.wallet.private_key)
-
-        algod.send_transaction(signed_txn)
-        self.time = time_ns() * 1e-6
-        self.tx_id = signed_txn.transaction.get_txid()
-        self.redis_tx_id = redis.incr("transaction-id")
+        return transaction.PaymentTxn(self.sender.wallet.public_key,
+                                      params.min_fee,
+                                      params.first,
+                                      params.last,
+                                      params.gh,
+                                      self.receiver.wallet.public_key,
+                                      self.amount,
+                                      note=str.encode(self.message),
+                                      flat_fee=True)
+
+    @metrics.timed("tip.send")
+    def send(self) -> Future:
+        """
+        Hands the transaction to the batch submitter, that groups it with the
+        other tips of the tick, without waiting until it is sent
+        The event is claimed first, so that a duplicated event can't be sent twice
 
-        console.log(f"Transaction #{self.redis_tx_id} sent by {self.sender.name} to {self.receiver.name}")
+        Returns:
+            future: resolves to the PendingTransaction record once the transaction is sent
+        """
+        event_log.claim_send(self.event)
+        future = submitter.submit(self)
+        future.add_done_callback(self._release)
+        return future
 
-    def confirmed(self) -> bool:
+    def _release(self, future: Future) -> None:
         """
-        Returns a boolean indicating whether or not the
-        transaction is confirmed
+        Releases the event when algod rejected the transaction, since nothing was sent
         """
-        txinfo = algod.pending_transaction_info(self.tx_id)
-        return txinfo.get('confirmed-round') and txinfo.get('confirmed-round') > 0
+        if isinstance(future.exception(), AlgodHTTPError):
+            event_log.release_send(self.event)
 
-
-    def send_confirmation(self) -> None:
+    def sent(self, signed_txn: transaction.SignedTransaction) -> None:
         """
-        Send a message to confirm the sender of the
-        transaction confirmation and to inform the receiver
-        that someone tipped him
-        """
-        self.sender.message("Tip confirmation",
-                            TRANSACTION_CONFIRMATION.substitute(
-                                amount=self.amount,
-                                receiver=self.receiver.name,
-                                transaction_id=self.tx_id
-                    )
-        )
-
-        self.receiver.message(
-            subject="AlgoTip",
-            message=TIP_RECEIVED.substitute(sender=self.sender.name
-                                                    if not self.anonymous
-                                                    else "An anonymous redditor",
-                                            amount=self.amount)
-        )
+        Records the transaction once algod accepted it
 
-    def log(self) -> None:
-        """
-        Log the transaction to the Redis DB
+        Args:
+            signed_txn: the signed transaction that was sent
         """
-        console.log(f"Transaction #{self.redis_tx_id} confirmed")
+        self.tx_id = signed_txn.transaction.get_txid()
+        event_log.sent(self.event, self.tx_id) # First, the event must never be sent again
+        params = self.params
+        self.time = time_ns() // 1_000_000
+        self.first_valid, self.last_valid = params.first, params.last
+        self.redis_tx_id = redis.incr("transaction-id")
+        self.pending = PendingTransaction("tip", self.tx_id, self.redis_tx_id,
+                                          self.sender.name, self.sender.user_id, self.sender.wallet.public_key,
+                                          self.receiver.name, self.receiver.user_id, self.receiver.wallet.public_key,
+                                          self.amount, self.fee, self.time,
+                                          self.first_valid, self.last_valid, self.anonymous)
 
-        redis.hmset(f"transaction:{self.redis_tx_id}", {"sender": self.sender.user_id,
-                                                    "receiver": self.receiver.user_id,
-                                                    "amount": self.amount,
-                                                    "transaction-id": self.tx_id,
-                                                    "fee": self.fee})
+        ledger.record(self.pending)
 
-        redis.zadd("tips", {self.redis_tx_id: self.time})
-
-    def __hash__(self) -> int:
-        return hash(self.tx_id)
+        log.info(f"Transaction #{self.redis_tx_id} sent by {self.sender.name} to {self.receiver.name}",
+                 id=self.redis_tx_id, tx_id=self.tx_id, sender=self.sender.name, receiver=self.receiver.name,
+                 amount=self.amount)
 
 @dataclass
 class WithdrawTransaction(Transaction): # pylint: disable=R0902
@@ -351,38 +459,48 @@ class WithdrawTransaction(Transaction): # pylint: disable=R0902
     """
     sender: "User"
     destination: str
-    amount: float
+    amount: Optional[int] # microAlgos, None to withdraw everything
     message: str
+    event: str = None # Fullname of the Reddit event
     tx_id: str = None
     close_account: bool = False
     redis_tx_id: int = None
-    fee: float = None
+    fee: int = None # microAlgos
     time: int = None
+    first_valid: int = None
+    last_valid: int = None
     params = None
+    pending = None
 
+    @metrics.timed("withdraw.validate")
     def validate(self) -> bool:
         """
         Chech that the transaction is valid, otherwise raise an error
         that indicates the type of issue
         """
-        self.params = algod.suggested_params()
-        self.fee = float(microalgos_to_algos(self.params.min_fee))
+        self.params = suggested_params.get()
+        self.fee = self.params.min_fee
 
-        self.amount = self.sender.wallet.balance if self.amount == "all" else float(self.amount)
-        self.close_account = (self.amount == self.sender.wallet.balance)
+        balance = self.sender.wallet.balance
+        if self.amount is None:
+            self.amount = balance
+        # An account can't be closed while it is still sending other transactions
+        self.close_account = (self.amount == balance
+                              and not ledger.pending_debit(self.sender.wallet.public_key))
 
         if self.close_account:
             self.amount = self.amount - self.fee
 
-        if self.amount < 1e-6:
+        if self.amount <= 0:
             raise ZeroTransactionError
 
-        if (self.amount + self.fee + (int(not self.close_account)*0.1)) > self.sender.wallet.balance:
-            raise InsufficientFundsError(self.amount, self.sender.wallet.balance)
+        if self.amount + self.fee + (0 if self.close_account else MIN_BALANCE) > balance:
+            raise InsufficientFundsError(self.amount, balance)
 
-        if Wallet("", self.destination).balance == 0 and self.amount < 0.1:
+        if self.amount < MIN_BALANCE and Wallet("", self.destination).balance == 0:
             raise FirstTransactionError(self.amount)
 
+    @metrics.timed("withdraw.send")
     def send(self) -> "WithdrawTransaction":
         """
         Send the transaction with the parameters given during initialization of the class
@@ -390,28 +508,135 @@ class WithdrawTransaction(Transaction): # pylint: disable=R0902
         (TODO : create the transaction with the send time and update it when confirmed
                 with confirmation time)
         """
+        signed_txn = self.build().sign(self.sender.wallet.private_key)
+        event_log.claim_send(self.event)
+        event_log.sending({self.event: signed_txn.transaction.get_txid()})
+        try:
+            algod.send_transaction(signed_txn)
+        except AlgodHTTPError:
+            event_log.release_send(self.event) # Rejected by algod, nothing was sent
+            raise
+        self.sent(signed_txn)
+
+    def build(self) -> transaction.PaymentTxn:
+        """
+        Creates the unsigned payment transaction
+        """
         params = self.params
+        return transaction.PaymentTxn(self.sender.wallet.public_key,
+                                      params.min_fee,
+                                      params.first,
+                                      params.last,
+                                      params.gh,
+                                      self.destination,
+                                      self.amount,
+                                      note=str.encode(self.message),
+                                      close_remainder_to=None if not self.close_account else self.destination,
+                                      flat_fee=True)
+
+    def sent(self, signed_txn: transaction.SignedTransaction) -> None:
+        """
+        Records the withdrawal once algod accepted it
 
-        txn = transaction.PaymentTxn(self.sender.wallet.public_key,
-                                     params.min_fee,
-                                     params.first,
-                                     params.last,
-                                     params.gh,
-                                     self.destination,
-                                     algos_to_microalgos(self.amount),
-                                     note=str.encode(self.message),
-                                     close_remainder_to=None if not self.close_account else self.destination,
-                                     flat_fee=True)
-
-        signed_txn = txn.sign(self.sender.wallet.private_key)
-
-        algod.send_transaction(signed_txn)
-        self.time = time_ns() * 1e-6
+        Args:
+            signed_txn: the signed transaction that was sent
+        """
         self.tx_id = signed_txn.transaction.get_txid()
+        event_log.sent(self.event, self.tx_id) # First, the event must never be sent again
+        params = self.params
+        self.time = time_ns() // 1_000_000
+        self.first_valid, self.last_valid = params.first, params.last
         self.redis_tx_id = redis.incr("transaction-id")
+        self.pending = PendingTransaction("withdraw", self.tx_id, self.redis_tx_id,
+                                          self.sender.name, self.sender.user_id, self.sender.wallet.public_key,
+                                          None, None, self.destination,
+                                          self.amount, self.fee, self.time,
+                                          self.first_valid, self.last_valid)
+
+        ledger.record(self.pending)
+
+        log.info(f"Withdrawal #{self.redis_tx_id} sent by {self.sender.name}",
+                 id=self.redis_tx_id, tx_id=self.tx_id, sender=self.sender.name, amount=self.amount)
+
+
+class PendingTransaction: # pylint: disable=R0902
+    """
+    Compact record of a sent transaction, kept until it is confirmed or expires.
+    It only holds what the confirmation, the ledger and the DB log need: ids,
+    addresses, integer amounts (microAlgos) and validity rounds, never the
+    users' keys. It is stored in Redis with a msgpack encoding (see pack)
+    """
+    __slots__ = ("kind", "tx_id", "redis_tx_id",
+                 "sender", "sender_id", "sender_address",
+                 "receiver", "receiver_id", "receiver_address",
+                 "amount", "fee", "time", "first_valid", "last_valid", "anonymous")
+
+    # The record is flat on purpose (one slot per field, packed as a msgpack array)
+    def __init__(self, # pylint: disable=R0913, R0914, R0917
+                 kind: str,
+                 tx_id: str,
+                 redis_tx_id: int,
+                 sender: str,
+                 sender_id: int,
+                 sender_address: str,
+                 receiver: Optional[str],
+                 receiver_id: Optional[int],
+                 receiver_address: str,
+                 amount: int,
+                 fee: int,
+                 time: int,
+                 first_valid: int,
+                 last_valid: int,
+                 anonymous: bool = False) -> None:
+        self.kind = kind # "tip" or "withdraw"
+        self.tx_id = tx_id
+        self.redis_tx_id = redis_tx_id
+        self.sender, self.sender_id, self.sender_address = sender, sender_id, sender_address
+        # Name and id of the receiver are None for withdrawals
+        self.receiver, self.receiver_id, self.receiver_address = receiver, receiver_id, receiver_address
+        self.amount, self.fee = amount, fee
+        self.time = time
+        self.first_valid, self.last_valid = first_valid, last_valid
+        self.anonymous = anonymous
+
+    def pack(self) -> bytes:
+        """
+        Encodes the record as a msgpack array, the transaction id and
+        the addresses being stored as their raw 32 bytes
+
+        Returns:
+            data: the encoded record
+        """
+        return msgpack.packb([self.kind, base64.b32decode(self.tx_id + "===="), self.redis_tx_id,
+                              self.sender, self.sender_id, encoding.decode_address(self.sender_address),
+                              self.receiver, self.receiver_id, encoding.decode_address(self.receiver_address),
+                              self.amount, self.fee, self.time,
+                              self.first_valid, self.last_valid, self.anonymous], use_bin_type=True)
+
+    @classmethod
+    def unpack(cls, data: bytes) -> "PendingTransaction":
+        """
+        Decodes a record encoded by pack
 
-        console.log(f"Withdrawal #{self.redis_tx_id} sent by {self.sender.name}")
+        Args:
+            data: the encoded record
+        Returns:
+            record: the PendingTransaction instance
+        """
+        fields = msgpack.unpackb(data, raw=False) # In the order of __slots__
+        fields[1] = base64.b32encode(fields[1]).decode().rstrip("=") # tx_id
+        fields[5] = encoding.encode_address(fields[5]) # sender_address
+        fields[8] = encoding.encode_address(fields[8]) # receiver_address
+        return cls(*fields)
 
+    @property
+    def addresses(self) -> Tuple[str, str]:
+        """
+        Returns the addresses whose balance is changed by the transaction
+        """
+        return self.sender_address, self.receiver_address
+
+    @metrics.timed("transaction.confirmed")
     def confirmed(self) -> bool:
         """
         Checks if the transaction has been confirmed
@@ -423,29 +648,53 @@ class WithdrawTransaction(Transaction): # pylint: disable=R0902
         txinfo = algod.pending_transaction_info(self.tx_id)
         return txinfo.get('confirmed-round') and txinfo.get('confirmed-round') > 0
 
+    @metrics.timed("transaction.send_confirmation")
     def send_confirmation(self) -> None:
         """
-        Sends a message to the Reddit user to confirm the withdrawal,
-        and give a link to AlgoExplorer to have a proof of transaction
-        """
-        self.sender.message("Withdrawal confirmations",
-                            WITHDRAWAL_CONFIRMATION.substitute(amount=self.amount,
-                                                               address=self.destination,
-                                                               transaction_id=self.tx_id))
+        Messages the sender to confirm the transaction, with a link to
+        AlgoExplorer as a proof, and informs the receiver of a tip
+        """
+        amount = microalgos_to_algos(self.amount)
+        if self.kind == "withdraw":
+            outbox.message(self.sender, "Withdrawal confirmations",
+                           WITHDRAWAL_CONFIRMATION.substitute(amount=amount,
+                                                              address=self.receiver_address,
+                                                              transaction_id=self.tx_id),
+                           coalesce=True)
+            return
+
+        outbox.message(self.sender, "Tip confirmation",
+                       TRANSACTION_CONFIRMATION.substitute(amount=amount,
+                                                           receiver=self.receiver,
+                                                           transaction_id=self.tx_id),
+                       coalesce=True)
+        outbox.message(self.receiver, "AlgoTip",
+                       TIP_RECEIVED.substitute(sender=self.sender
+                                                      if not self.anonymous
+                                                      else "An anonymous redditor",
+                                               amount=amount),
+                       coalesce=True)
 
     def log(self) -> None:
         """
-        Logs the confirmation of the withdrawal to the console and
-        to the database by adding a transaction record
+        Logs the confirmation to the console and to the Redis DB,
+        amounts being stored in microAlgos
         """
-        console.log(f"Withdrawal #{self.redis_tx_id} confirmed")
+        if self.kind == "withdraw":
+            log.info(f"Withdrawal #{self.redis_tx_id} confirmed", id=self.redis_tx_id, tx_id=self.tx_id)
+            record, index = {"user": self.sender_id}, "withdrawals"
+        else:
+            log.info(f"Transaction #{self.redis_tx_id} confirmed", id=self.redis_tx_id, tx_id=self.tx_id)
+            record, index = {"sender": self.sender_id, "receiver": self.receiver_id}, "tips"
 
-        redis.hmset(f"transaction:{self.redis_tx_id}", {"user": self.sender.user_id,
-                                                    "amount": self.amount,
-                                                    "transaction-id": self.tx_id,
-                                                    "fee": self.fee})
+        record.update({"amount": self.amount, "transaction-id": self.tx_id, "fee": self.fee})
+        with redis.pipeline() as pipe:
+            pipe.hmset(f"transaction:{self.redis_tx_id}", record)
+            pipe.zadd(index, {self.redis_tx_id: self.time})
+            pipe.execute()
 
-        redis.zadd("withdrawals", {self.redis_tx_id: self.time})
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, PendingTransaction) and other.tx_id == self.tx_id
 
     def __hash__(self) -> int:
         """
@@ -453,3 +702,6 @@ class WithdrawTransaction(Transaction): # pylint: disable=R0902
         Allows the use of this class in sets and dictionaries
         """
         return hash(self.tx_id)
+
+    def __repr__(self) -> str:
+        return f"PendingTransaction({self.kind} #{self.redis_tx_id}, {self.tx_id})"
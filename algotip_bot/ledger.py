@@ -0,0 +1,119 @@
+"""
+File containing the Ledger class, that keeps track of the debits and
+credits of the transactions sent by the bot but not confirmed yet
+"""
+
+from collections import defaultdict
+from threading import Lock
+from typing import Dict
+
+from algotip_bot.cache import balances, suggested_params
+
+
+class Ledger:
+    """
+    Optimistic local ledger of the pending (unconfirmed) transactions, in microAlgos.
+    The spendable balance of a wallet is its last confirmed balance minus its pending
+    outflow, so consecutive commands of a sender see their previous debits without
+    calling algod. Pending credits aren't spendable until they are confirmed.
+    Entries are settled by the confirmation tracker when the transaction is
+    confirmed or when it expires. Without a tracker (scripts, tests), they are dropped
+    once the chain is past their last valid round, as seen by the suggested params cache
+    """
+    def __init__(self) -> None:
+        self._debits: Dict[str, Dict[str, int]] = defaultdict(dict) # address -> {tx_id: amount}
+        self._credits: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._transactions: Dict[str, "PendingTransaction"] = {} # tx_id -> record, to expire the entries
+        self._expired_round = 0 # Last round up to which the entries were expired
+        self._lock = Lock()
+
+    def record(self, transaction: "PendingTransaction") -> None:
+        """
+        Records the debit and credit of a transaction that was just sent
+
+        Args:
+            transaction: the record of the sent transaction
+        """
+        sender, receiver = transaction.addresses
+        with self._lock:
+            self._debits[sender][transaction.tx_id] = transaction.amount + transaction.fee
+            self._credits[receiver][transaction.tx_id] = transaction.amount
+            self._transactions[transaction.tx_id] = transaction
+
+    def settle(self, transaction: "PendingTransaction") -> None:
+        """
+        Removes the entries of a transaction that was confirmed or expired.
+        The cached balances are invalidated, so the next read gets the on-chain value
+
+        Args:
+            transaction: the record of the transaction to settle
+        """
+        sender, receiver = transaction.addresses
+        with self._lock:
+            self._remove(transaction)
+        balances.invalidate(sender, receiver)
+
+    def _remove(self, transaction: "PendingTransaction") -> None:
+        """
+        Removes the entries of a transaction, the lock being held
+        """
+        sender, receiver = transaction.addresses
+        self._transactions.pop(transaction.tx_id, None)
+        for entries, address in ((self._debits, sender), (self._credits, receiver)):
+            entries[address].pop(transaction.tx_id, None)
+            if not entries[address]:
+                del entries[address]
+
+    def _expire(self) -> None:
+        """
+        Settles the transactions past their last valid round. They can't be pending
+        anymore, whether they were confirmed or not. Only runs when a new round is known
+        """
+        last_round = suggested_params.last_round()
+        with self._lock:
+            if last_round <= self._expired_round:
+                return
+            self._expired_round = last_round
+            expired = [transaction for transaction in self._transactions.values()
+                       if transaction.last_valid is not None and transaction.last_valid < last_round]
+            for transaction in expired:
+                self._remove(transaction)
+        for transaction in expired:
+            balances.invalidate(*transaction.addresses)
+
+    def pending_debit(self, address: str) -> int:
+        """
+        Returns the total amount (fees included) that the wallet is sending, in microAlgos
+        """
+        self._expire()
+        with self._lock:
+            return sum(self._debits.get(address, {}).values())
+
+    def pending_credit(self, address: str) -> int:
+        """
+        Returns the total amount that the wallet is receiving, in microAlgos
+        """
+        self._expire()
+        with self._lock:
+            return sum(self._credits.get(address, {}).values())
+
+    def available(self, address: str) -> int:
+        """
+        Returns the spendable balance of a wallet
+
+        Args:
+            address: public key of the wallet
+        Returns:
+            balance: the last confirmed balance minus the pending outflow, in microAlgos
+        """
+        pending_debit = self.pending_debit(address) # First, it may expire entries and invalidate the balance
+        return max(balances.get(address) - pending_debit, 0)
+
+    def stats(self) -> dict:
+        """
+        Returns the number of wallets with pending debits and credits
+        """
+        return {"debited-wallets": len(self._debits), "credited-wallets": len(self._credits)}
+
+
+ledger = Ledger()
@@ -0,0 +1,140 @@
+"""
+File containing the loggers of the bot. Two output formats are available,
+selected at startup with the LOG_FORMAT environment variable:
+ * rich (default): pretty terminal output through the rich console, for dev
+ * json: one JSON object per line, written to stdout by a background thread
+         so that the workers never wait on the formatting or the terminal
+The level is set with LOG_LEVEL (default INFO), and LOG_SAMPLE_RATE is the
+fraction of the chatty per-event lines (event bodies) that are logged
+"""
+
+import atexit
+import json
+import logging
+import os
+import sys
+import traceback
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from random import random
+from typing import Optional
+
+from algotip_bot.clients import console
+
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "rich").lower()
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 1))
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats the records as JSON objects, the structured fields
+    given to the logger being added to the object
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"time": round(record.created, 3),
+                 "level": record.levelname.lower(),
+                 "logger": record.name,
+                 "message": record.getMessage()}
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class _QueueHandler(QueueHandler):
+    """
+    Queue handler keeping the exception text out of the message,
+    so that the JSON formatter can put it in its own field
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info))
+        record.msg, record.args, record.exc_info = record.getMessage(), None, None
+        return record
+
+
+class Logger:
+    """
+    Logger of a module. Messages are plain text, the keyword arguments
+    are structured fields that only appear in the JSON output
+    """
+    def __init__(self, name: str) -> None:
+        self._logger = logging.getLogger(name)
+
+    def _log(self, level: int, message: str, fields: dict, exc_info: Optional[tuple] = None) -> None:
+        if not self._logger.isEnabledFor(level):
+            return
+        if LOG_FORMAT == "json":
+            self._logger.log(level, message, exc_info=exc_info, extra={"fields": fields}, stacklevel=3)
+        else:
+            console.log(message, _stack_offset=3)
+            if exc_info:
+                traceback.print_exception(*exc_info)
+
+    def debug(self, message: str, **fields) -> None: # pylint: disable=C0116
+        self._log(logging.DEBUG, message, fields)
+
+    def info(self, message: str, **fields) -> None: # pylint: disable=C0116
+        self._log(logging.INFO, message, fields)
+
+    def warning(self, message: str, **fields) -> None: # pylint: disable=C0116
+        self._log(logging.WARNING, message, fields)
+
+    def error(self, message: str, **fields) -> None: # pylint: disable=C0116
+        self._log(logging.ERROR, message, fields)
+
+    def exception(self, message: str, error: Optional[BaseException] = None, **fields) -> None:
+        """
+        Logs an error along with its traceback
+
+        Args:
+            message: the message to log
+            error: the exception, the one being handled if not given
+            fields: structured fields of the JSON output
+        """
+        exc_info = sys.exc_info() if error is None else (type(error), error, error.__traceback__)
+        self._log(logging.ERROR, message, fields, exc_info if exc_info[0] is not None else None)
+
+    def sampled(self, level: int = logging.INFO) -> bool:
+        """
+        Tells whether a chatty line should be logged, so that the
+        caller doesn't even format the lines that are sampled out
+
+        Args:
+            level: level of the line
+        Returns:
+            bool: True if the line should be logged
+        """
+        return self._logger.isEnabledFor(level) and (LOG_SAMPLE_RATE >= 1 or random() < LOG_SAMPLE_RATE)
+
+
+def get_logger(name: str) -> Logger:
+    """
+    Returns the logger of a module
+
+    Args:
+        name: name of the module
+    """
+    return Logger(name)
+
+def _setup() -> None:
+    """
+    Sets the level of the bot loggers, and in JSON mode starts the thread
+    writing the queued records to stdout
+    """
+    root = logging.getLogger("algotip_bot")
+    root.setLevel(LOG_LEVEL)
+    if LOG_FORMAT != "json":
+        return
+
+    queue: SimpleQueue = SimpleQueue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    listener = QueueListener(queue, handler)
+    root.addHandler(_QueueHandler(queue))
+    root.propagate = False
+    listener.start()
+    atexit.register(listener.stop) # Flushes the queued records on exit
+
+
+_setup()
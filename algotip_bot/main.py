@@ -2,57 +2,110 @@
 File containing the main loop
 """
 
-import traceback
-from time import sleep
+import os
+from time import monotonic
+from typing import Union
 
-from algotip_bot.clients import console, reddit
+from praw.models.reddit.comment import Comment
+from praw.models.reddit.message import Message
+
+from algotip_bot.cache import reddit_metadata
 from algotip_bot.errors import (InvalidCommandError, InvalidSubredditError,
                                InvalidUserError, NotModeratorError)
 from algotip_bot.handlers import EventHandler
+from algotip_bot.logs import get_logger
+from algotip_bot.messaging import outbox
+from algotip_bot.pipeline import Pipeline
+from algotip_bot.scheduler import PollScheduler
+from algotip_bot.services import HANDLING_COMPONENTS, STATS_INTERVAL, log_stats, poll, start_metrics
+from algotip_bot.sharding import coordinate, work
+from algotip_bot.submitter import submitter
 from algotip_bot.templates import (INVALID_COMMAND, NOT_MODERATOR,
                                   SUBREDDIT_NOT_FOUND, USER_NOT_FOUND)
-from algotip_bot.utils import stream
+from algotip_bot.utils import comment_stream
+
+WORKERS = int(os.environ.get("WORKERS", 4))
+ROLE = os.environ.get("ROLE", "standalone").lower() # standalone, coordinator or worker (see sharding.py)
+WORKER_INDEX = int(os.environ.get("WORKER_INDEX", 0))
+WORKER_COUNT = int(os.environ.get("WORKER_COUNT", 1))
+
+log = get_logger(__name__)
 
 event_handler = EventHandler()
 
+def notify_error(event: Union[Comment, Message], error: Exception) -> None:
+    """
+    Messages the author of an event that couldn't be handled (through the outbox)
+
+    Args:
+        event: the praw event that raised the error
+        error: the raised error
+    """
+    author = event.author.name
+    if isinstance(error, InvalidCommandError):
+        outbox.message(author, "Invalid Command", INVALID_COMMAND)
+    elif isinstance(error, InvalidUserError):
+        outbox.message(author, "User not found", USER_NOT_FOUND.substitute(username=error.username))
+    elif isinstance(error, InvalidSubredditError):
+        outbox.message(author, "Subreddit not found", SUBREDDIT_NOT_FOUND.substitute(subreddit=error.subreddit))
+    elif isinstance(error, NotModeratorError):
+        outbox.message(author, "Not authorize", NOT_MODERATOR)
+    else:
+        outbox.message(author, "Issue", "Hello, I'm sorry but an unknown issue occured when handling\n\n "
+                                        f"***{event.body}*** \n\n Please contact u/RedSwoosh to have it resolved")
+        log.exception("An unknown issue occured", error, event=event.fullname)
+
+def confirm(transaction: "PendingTransaction") -> None:
+    """
+    Sends the confirmation messages of a confirmed transaction and logs it
+    """
+    transaction.send_confirmation()
+    transaction.log()
+
 def main():
     """
     Function running the main loop of the bot
+    The loop only fetches the events, they are executed and
+    replied to by the pipeline workers. Between two polls (see PollScheduler),
+    it waits for the confirmations, that are checked at every new block
     """
-    waiting = 0
+    start_metrics()
+    event_handler.unconfirmed_transactions.recover()
+    event_handler.unconfirmed_transactions.start()
+    outbox.start()
+    submitter.start()
+    pipeline = Pipeline(event_handler, notify_error, workers=WORKERS)
+    pipeline.start()
+    scheduler = PollScheduler()
+    last_stats = monotonic()
 
-    console.log("Started successfully. Waiting for messages ...")
+    log.info("Started successfully. Waiting for messages ...")
 
     while True:
-        if not waiting:
-            for transaction in event_handler.unconfirmed_transactions.copy():
-                if transaction.confirmed():
-                    transaction.send_confirmation()
-                    transaction.log()
-                    event_handler.unconfirmed_transactions.remove(transaction)
-
-        for event in stream():
-            try:
-                event_handler.handle_event(event)
-            except InvalidCommandError:
-                event.author.message("Invalid Command", INVALID_COMMAND)
-            except InvalidUserError as e: # pylint: disable=C0103
-                event.author.message("User not found", USER_NOT_FOUND.substitute(username=e.username))
-            except InvalidSubredditError as e: # pylint: disable=C0103
-                event.author.message("Subreddit not found", SUBREDDIT_NOT_FOUND.substitute(subreddit=e.subreddit))
-            except NotModeratorError as e: # pylint: disable=C0103
-                event.author.message("Not authorize", NOT_MODERATOR)
-            except Exception: #pylint: disable=W0703
-                event.author.message("Issue", "Hello, I'm sorry but an unknown issue occured when handling\n\n "
-                                             f"***{event.body}*** \n\n Please contact u/RedSwoosh to have it resolved")
-                console.log("An unknown issue occured")
-                traceback.print_exc()
-            reddit.inbox.mark_read([event])
-
-        waiting = (waiting + 1) % 5
-
-        sleep(0.5)
+        events, starts = poll(scheduler)
+        events = pipeline.unhandled(events)
+        reddit_metadata.prefetch(events)
+        for event in events:
+            pipeline.submit(event, starts.get(event.fullname))
+
+        if monotonic() - last_stats > STATS_INTERVAL:
+            log_stats((("Pipeline stats", pipeline),
+                       *HANDLING_COMPONENTS,
+                       ("Comment stream", comment_stream),
+                       ("Poll scheduler", scheduler),
+                       ("Outbox", outbox)))
+            last_stats = monotonic()
+
+        deadline = monotonic() + scheduler.delay()
+        while (remaining := deadline - monotonic()) > 0:
+            for transaction in event_handler.unconfirmed_transactions.wait(remaining):
+                pipeline.reply(confirm, transaction)
 
 if __name__ == "__main__":
-    main()
+    if ROLE == "coordinator":
+        coordinate()
+    elif ROLE == "worker":
+        work(WORKER_INDEX, WORKER_COUNT, notify_error, confirm)
+    else:
+        main()
     # Put an option to choose the network I wanna connect to (mainnet or testnet)
@@ -0,0 +1,202 @@
+"""
+File containing the Outbox class, that queues the outgoing Reddit
+messages in Redis and sends them from a background thread
+"""
+
+import json
+from collections import OrderedDict
+from threading import Thread
+from time import sleep, time
+from typing import List, Optional
+from uuid import uuid4
+
+from praw.endpoints import API_PATH
+
+from algotip_bot.clients import reddit, redis
+from algotip_bot.logs import get_logger
+from algotip_bot.redis_scripts import TAKE_MESSAGES
+
+COALESCED_SUBJECT = "AlgoTip notifications"
+COALESCED_SEPARATOR = "\n\n---\n\n"
+
+log = get_logger(__name__)
+
+
+class Outbox:
+    """
+    Class queuing the private messages and replies sent by the bot.
+    Messages are persisted in Redis until they are sent, so they survive a restart:
+     * outbox: list of the messages waiting to be sent
+     * outbox:sending: list of the messages being sent, moved back to the outbox on startup
+     * outbox:retry: sorted set of the messages that failed, scored by their next attempt time
+    Only one process should run the sending thread
+    """
+    def __init__(self,
+                 batch_size: int = 20,
+                 reserve: int = 10,
+                 max_attempts: int = 5,
+                 max_backoff: float = 900) -> None:
+        self.batch_size = batch_size
+        self.reserve = reserve # Requests kept for the inbox polling in each rate-limit window
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.sent = 0
+        self.failed = 0
+        self._thread: Optional[Thread] = None
+
+    def message(self, username: str, subject: str, body: str, coalesce: bool = False) -> None:
+        """
+        Queues a private message
+
+        Args:
+            username: name of the redditor to message
+            subject: subject of the PM
+            body: body of the PM
+            coalesce: whether the message can be merged with the other
+                      coalescable messages queued for the same redditor
+        """
+        self._push({"kind": "message", "to": username.lower(), "subject": subject,
+                    "body": body, "coalesce": coalesce})
+
+    def reply(self, fullname: str, body: str) -> None:
+        """
+        Queues a reply to a comment or a private message
+
+        Args:
+            fullname: fullname of the comment or message to reply to
+            body: body of the reply
+        """
+        self._push({"kind": "reply", "to": fullname, "body": body})
+
+    def _push(self, item: dict) -> None:
+        item.update({"id": uuid4().hex, "attempts": 0})
+        redis.rpush("outbox", json.dumps(item))
+
+    def recover(self) -> None:
+        """
+        Moves the messages that were being sent when the bot stopped back to the outbox
+        """
+        while redis.rpoplpush("outbox:sending", "outbox") is not None:
+            pass
+
+    def _wait_for_rate_limit(self) -> None:
+        """
+        Sleeps until the next rate-limit window if the remaining
+        requests of the current one are reserved for the inbox polling
+        """
+        limits = reddit.auth.limits
+        if limits.get("remaining") is not None and limits["remaining"] <= self.reserve:
+            delay = max(limits["reset_timestamp"] - time(), 0) + 1
+            log.warning(f"Reddit rate limit almost reached, messages delayed by {delay:.0f}s", delay=delay)
+            sleep(delay)
+
+    @staticmethod
+    def coalesce(items: List[dict]) -> List[List[dict]]:
+        """
+        Groups the coalescable messages sent to the same redditor
+
+        Args:
+            items: the queued messages
+        Returns:
+            groups: list of groups of messages, each sent as a single message
+        """
+        groups: "OrderedDict[tuple, List[dict]]" = OrderedDict()
+        for item in items:
+            key = (item["to"],) if item["kind"] == "message" and item.get("coalesce") else (item["id"],)
+            groups.setdefault(key, []).append(item)
+        return list(groups.values())
+
+    def _deliver(self, group: List[dict]) -> None:
+        """
+        Sends a group of messages to Reddit as a single message
+        """
+        first = group[0]
+        if first["kind"] == "reply":
+            reddit.post(API_PATH["comment"], data={"text": first["body"], "thing_id": first["to"]})
+        elif len(group) == 1:
+            reddit.redditor(first["to"]).message(first["subject"], first["body"])
+        else:
+            reddit.redditor(first["to"]).message(COALESCED_SUBJECT,
+                                                 COALESCED_SEPARATOR.join(item["body"] for item in group))
+
+    def _retry(self, pipe, item: dict) -> None:
+        """
+        Schedules a failed message for a later attempt, with an exponential backoff
+        """
+        item["attempts"] += 1
+        if item["attempts"] >= self.max_attempts:
+            self.failed += 1
+            log.error(f"Gave up sending a {item['kind']} to {item['to']} after {item['attempts']} attempts",
+                      kind=item["kind"], to=item["to"])
+            return
+        backoff = min(2 ** item["attempts"] * 5, self.max_backoff)
+        pipe.zadd("outbox:retry", {json.dumps(item): time() + backoff})
+
+    def flush(self) -> int:
+        """
+        Sends one batch of queued messages
+
+        Returns:
+            count: the number of messages taken from the outbox
+        """
+        raw_items = TAKE_MESSAGES(keys=["outbox", "outbox:sending", "outbox:retry"],
+                                  args=[time(), self.batch_size])
+        if not raw_items:
+            return 0
+
+        items = {raw: json.loads(raw) for raw in raw_items}
+        raw_by_id = {item["id"]: raw for raw, item in items.items()}
+
+        for group in self.coalesce(list(items.values())):
+            self._wait_for_rate_limit()
+            try:
+                self._deliver(group)
+                self.sent += len(group)
+                succeeded = True
+            except Exception: # pylint: disable=W0703
+                log.exception(f"Could not send a {group[0]['kind']} to {group[0]['to']}",
+                              kind=group[0]["kind"], to=group[0]["to"])
+                succeeded = False
+
+            with redis.pipeline() as pipe:
+                for item in group:
+                    pipe.lrem("outbox:sending", 1, raw_by_id[item["id"]])
+                    if not succeeded:
+                        self._retry(pipe, item)
+                pipe.execute()
+
+        return len(raw_items)
+
+    def run(self) -> None:
+        """
+        Sends the queued messages forever
+        """
+        while True:
+            try:
+                if not self.flush():
+                    sleep(0.5)
+            except Exception: # pylint: disable=W0703
+                log.exception("The outbox could not be flushed")
+                sleep(5)
+
+    def start(self) -> None:
+        """
+        Recovers the messages of a previous run and starts sending
+        the queued messages in a background thread
+        """
+        if self._thread is None:
+            self.recover()
+            self._thread = Thread(target=self.run, name="outbox", daemon=True)
+            self._thread.start()
+
+    def stats(self) -> dict:
+        """
+        Returns the counters and queue lengths of the outbox
+        """
+        return {"sent": self.sent,
+                "failed": self.failed,
+                "queued": redis.llen("outbox"),
+                "retrying": redis.zcard("outbox:retry")}
+
+
+outbox = Outbox()
@@ -0,0 +1,280 @@
+"""
+File containing the Metrics class, that times the stages of the event
+handling and the calls to the external services (Reddit, algod, Redis).
+The metrics are exposed in the Prometheus text format over HTTP, or
+published as a periodic snapshot in Redis
+
+The layer is selected at startup with the METRICS environment variable
+("prometheus" or "redis"). When it is unset, the decorators return the
+functions untouched and the stage timers are a shared no-op context manager
+"""
+
+import json
+import os
+import re
+import traceback
+from bisect import bisect_left
+from contextlib import nullcontext
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import perf_counter, sleep, time
+from typing import Callable, Dict, List, Tuple
+
+METRICS = os.environ.get("METRICS", "").lower()
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9100))
+SNAPSHOT_INTERVAL = 60 # Seconds between two snapshots published in Redis
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10) # Histogram bounds, in seconds
+
+ALGOD_ENDPOINTS = ("status", "status_after_block", "block_info", "suggested_params", "account_info",
+                   "pending_transaction_info", "send_transaction", "send_transactions")
+REDDIT_NAMES = re.compile(r"^/?(user|u|r|comments)/[^/]+") # Redditor, subreddit or thread names in the paths
+
+
+class Histogram: # pylint: disable=R0903
+    """
+    Count, sum and bucketed distribution of durations, plus the number of errors
+    """
+    __slots__ = ("count", "errors", "total", "buckets", "_lock")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self._lock = Lock()
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        """
+        Records a duration, in seconds, and whether it ended with an error
+        """
+        with self._lock:
+            self.count += 1
+            self.errors += error
+            self.total += seconds
+            self.buckets[bisect_left(BUCKETS, seconds)] += 1
+
+
+class _Stage:
+    """
+    Context manager timing a stage
+    """
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram) -> None:
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self) -> "_Stage":
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        self.histogram.observe(perf_counter() - self.start, exc_type is not None)
+
+
+class Metrics:
+    """
+    Registry of the stage timers and external call counters.
+    Stages are keyed by name, external calls by (service, endpoint)
+    """
+    def __init__(self, mode: str = METRICS, port: int = METRICS_PORT) -> None:
+        self.mode = mode
+        self.enabled = mode in ("prometheus", "redis")
+        self.port = port
+        self.stages: Dict[str, Histogram] = {}
+        self.calls: Dict[Tuple[str, str], Histogram] = {}
+        self._lock = Lock()
+        self._started = False
+
+    def _histogram(self, registry: dict, key) -> Histogram:
+        if (histogram := registry.get(key)) is None:
+            with self._lock:
+                histogram = registry.setdefault(key, Histogram())
+        return histogram
+
+    def stage(self, name: str):
+        """
+        Returns a context manager timing the given stage
+
+        Args:
+            name: name of the stage
+        Returns:
+            timer: the context manager (a no-op one if the metrics are disabled)
+        """
+        if not self.enabled:
+            return _NO_STAGE
+        return _Stage(self._histogram(self.stages, name))
+
+    def timed(self, name: str) -> Callable[[Callable], Callable]:
+        """
+        Decorator timing every call of a function as a stage.
+        If the metrics are disabled, the function is returned untouched
+
+        Args:
+            name: name of the stage
+        """
+        def decorator(function: Callable) -> Callable:
+            if not self.enabled:
+                return function
+            return self._wrap(function, self._histogram(self.stages, name))
+        return decorator
+
+    @staticmethod
+    def _call(histogram: Histogram, function: Callable, *args, **kwargs):
+        """
+        Calls the function and records its duration, and whether it raised
+        """
+        start = perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException:
+            histogram.observe(perf_counter() - start, True)
+            raise
+        histogram.observe(perf_counter() - start)
+        return result
+
+    def _wrap(self, function: Callable, histogram: Histogram) -> Callable:
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            return self._call(histogram, function, *args, **kwargs)
+        return timed_function
+
+    def instrument_algod(self, client) -> None:
+        """
+        Times the calls of the algod client, by endpoint
+        """
+        for endpoint in ALGOD_ENDPOINTS:
+            setattr(client, endpoint, self._wrap(getattr(client, endpoint),
+                                                 self._histogram(self.calls, ("algod", endpoint))))
+
+    def instrument_redis(self, client) -> None:
+        """
+        Times the commands sent by a Redis client, by command.
+        A pipeline counts as a single 'pipeline' call
+        """
+        execute_command, pipeline = client.execute_command, client.pipeline
+
+        def timed_execute_command(*args, **options):
+            histogram = self._histogram(self.calls, ("redis", str(args[0]).lower()))
+            return self._call(histogram, execute_command, *args, **options)
+
+        def timed_pipeline(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            pipe.execute = self._wrap(pipe.execute, self._histogram(self.calls, ("redis", "pipeline")))
+            return pipe
+
+        client.execute_command = timed_execute_command
+        client.pipeline = timed_pipeline
+
+    def instrument_reddit(self, reddit) -> None:
+        """
+        Times the requests sent to the Reddit API, by method and path,
+        the names of redditors and subreddits being stripped from the paths
+        """
+        # praw sends all its requests through its prawcore sessions
+        sessions = {getattr(reddit, name, None) for name in ("_authorized_core", "_read_only_core")} - {None}
+        for session in sessions:
+            def timed_request(method, path, *args, request=session.request, **kwargs):
+                endpoint = method + " " + REDDIT_NAMES.sub(r"\1/*", path.lstrip("/"))
+                histogram = self._histogram(self.calls, ("reddit", endpoint))
+                return self._call(histogram, request, method, path, *args, **kwargs)
+            session.request = timed_request
+
+    def render(self) -> str:
+        """
+        Returns the metrics in the Prometheus text format
+        """
+        lines: List[str] = []
+        for metric, registry, labels in (("algotip_stage_seconds", self.stages, lambda name: f'stage="{name}"'),
+                                         ("algotip_external_call_seconds", self.calls,
+                                          lambda key: f'service="{key[0]}",endpoint="{key[1]}"')):
+            lines.append(f"# TYPE {metric} histogram")
+            for key, histogram in sorted(registry.items()):
+                label = labels(key)
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), histogram.buckets):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f"{metric}_sum{{{label}}} {histogram.total}")
+                lines.append(f"{metric}_count{{{label}}} {histogram.count}")
+            lines.append(f"# TYPE {metric.replace('_seconds', '_errors_total')} counter")
+            for key, histogram in sorted(registry.items()):
+                lines.append(f"{metric.replace('_seconds', '_errors_total')}{{{labels(key)}}} {histogram.errors}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """
+        Returns the count, errors and mean duration of every stage and external call
+        """
+        def summary(histogram: Histogram) -> dict:
+            return {"count": histogram.count,
+                    "errors": histogram.errors,
+                    "mean-ms": round(histogram.total / histogram.count * 1000, 3) if histogram.count else 0.0}
+        return {"time": time(),
+                "stages": {name: summary(histogram) for name, histogram in self.stages.items()},
+                "calls": {".".join(key): summary(histogram) for key, histogram in self.calls.items()}}
+
+    def _serve(self) -> None:
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            Serves the metrics in the Prometheus text format, whatever the path
+            """
+            def do_GET(self): # pylint: disable=C0103
+                """
+                Returns the rendered metrics
+                """
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None: # Requests aren't logged
+                pass
+
+        ThreadingHTTPServer(("", self.port), Handler).serve_forever()
+
+    def _publish(self, redis) -> None:
+        while True:
+            sleep(SNAPSHOT_INTERVAL)
+            try:
+                redis.set("metrics", json.dumps(self.snapshot()))
+            except Exception: # pylint: disable=W0703
+                traceback.print_exc()
+
+    def start(self, reddit=None, algod=None, redis=None, binary_redis=None) -> None:
+        """
+        Instruments the given clients and starts exposing the metrics.
+        Does nothing if the metrics are disabled
+
+        Args:
+            reddit: the praw client
+            algod: the algod client
+            redis: the Redis client, also used to publish the snapshots
+            binary_redis: the Redis client used for the binary values
+        """
+        if not self.enabled or self._started:
+            return
+        self._started = True
+        if reddit is not None:
+            self.instrument_reddit(reddit)
+        if algod is not None:
+            self.instrument_algod(algod)
+        for client in (redis, binary_redis):
+            if client is not None:
+                self.instrument_redis(client)
+
+        if self.mode == "prometheus":
+            Thread(target=self._serve, name="metrics", daemon=True).start()
+        elif redis is not None:
+            Thread(target=self._publish, args=(redis,), name="metrics", daemon=True).start()
+
+
+_NO_STAGE = nullcontext()
+
+metrics = Metrics()
@@ -0,0 +1,355 @@
+"""
+File containing the Pipeline class, that runs the events through
+separate stages (fetch, execute, reply) connected by bounded queues
+"""
+
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, wait
+from queue import Empty, Queue
+from threading import Lock, Thread
+from time import monotonic, time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Union
+from zlib import crc32
+
+from praw.models.reddit.comment import Comment
+from praw.models.reddit.message import Message
+
+from algotip_bot.clients import reddit, redis
+from algotip_bot.logs import get_logger
+from algotip_bot.redis_scripts import FILTER_HANDLED
+
+ACK_GRACE = 60 # Seconds during which an acknowledged event is still ignored, in case
+               # the stream fetched it before it was marked as read
+ACK_CHUNK = 25 # Largest number of messages Reddit marks as read in a single request
+ACK_DELAY = 1 # Seconds an acknowledgement can wait for others to fill its chunk
+HANDLED_RETENTION = 30 * 24 * 3600 # Seconds during which a handled message that wasn't marked as read is remembered
+
+log = get_logger(__name__)
+
+def lane_of(author: str, lanes: int) -> int:
+    """
+    Returns the lane in which the commands of an author are executed.
+    All the commands of a given author always go to the same lane, so they
+    are executed in order and can't double-spend
+
+    Args:
+        author: name of the author of the event
+        lanes: total number of lanes
+    Returns:
+        lane: index of the lane
+    """
+    return crc32(author.lower().encode()) % lanes
+
+
+class PipelineMetrics:
+    """
+    Thread-safe counters describing the activity of the pipeline
+    """
+    def __init__(self) -> None:
+        self.started = monotonic()
+        self.counters: Counter = Counter()
+        self._lock = Lock()
+
+    def incr(self, name: str, value: int = 1) -> None:
+        """
+        Increments the given counter
+
+        Args:
+            name: name of the counter
+            value: value to add to the counter
+        """
+        with self._lock:
+            self.counters[name] += value
+
+    def throughput(self) -> float:
+        """
+        Returns the number of events executed per second since the start
+        """
+        return self.counters["executed"] / max(monotonic() - self.started, 1e-9)
+
+
+class InFlight:
+    """
+    Futures of the events whose tip is being sent, by author. The next event of an author
+    waits until the previous one is done, so that each sender's commands stay in order
+    (and see the debits of the previous ones) while the other authors' events keep going.
+    Each instance is only used by a single thread
+    """
+    def __init__(self) -> None:
+        self._futures: Dict[str, Future] = {}
+
+    def wait(self, author: str) -> None:
+        """
+        Waits until the previous event of the author is done, if it is still in flight
+        """
+        if (future := self._futures.pop(author, None)) is not None:
+            wait([future])
+        self._futures = {name: future for name, future in self._futures.items() if not future.done()}
+
+    def add(self, author: str, future: Future) -> None:
+        """
+        Records the event of the author that is in flight
+        """
+        self._futures[author] = future
+
+    def handle(self,
+               event_handler: "EventHandler",
+               event: Union[Comment, Message],
+               start: Optional[int],
+               done: Callable[[Optional[Exception]], None]) -> None:
+        """
+        Handles an event once the previous event of its author is done
+
+        Args:
+            event_handler: the EventHandler running the command
+            event: the praw event to handle
+            start: position of the command in the body of a comment, if it was already found
+            done: called with the error (None if there isn't any) once the event is handled,
+                  for a tip once it is sent
+        """
+        author = event.author.name if event.author is not None else ""
+        self.wait(author)
+        try:
+            sending = event_handler.handle_event(event, start)
+        except Exception as e: # pylint: disable=W0703, C0103
+            done(e)
+            return
+        if sending is None:
+            done(None)
+        else:
+            self.add(author, sending)
+            sending.add_done_callback(lambda sending: done(sending.exception()))
+
+
+class SeenEvents:
+    """
+    Fullnames of the events that are in the pipeline or were acknowledged less than
+    ACK_GRACE seconds ago. The acknowledged ones are kept in acknowledgement order,
+    so that the expired ones are dropped from the front without scanning the others
+    """
+    def __init__(self, grace: float = ACK_GRACE) -> None:
+        self.grace = grace
+        self._in_flight: Set[str] = set()
+        self._acknowledged: "OrderedDict[str, float]" = OrderedDict() # fullname -> acknowledgement time
+        self._lock = Lock()
+
+    def __contains__(self, fullname: str) -> bool:
+        with self._lock:
+            self._expire()
+            return fullname in self._in_flight or fullname in self._acknowledged
+
+    def add(self, fullname: str) -> bool:
+        """
+        Records an event entering the pipeline
+
+        Returns:
+            added: False if the event is already in the pipeline or was just acknowledged
+        """
+        with self._lock:
+            self._expire()
+            if fullname in self._in_flight or fullname in self._acknowledged:
+                return False
+            self._in_flight.add(fullname)
+            return True
+
+    def acknowledge(self, fullnames: Iterable[str]) -> None:
+        """
+        Records events leaving the pipeline, they are still ignored for the grace period
+        """
+        now = monotonic()
+        with self._lock:
+            for fullname in fullnames:
+                self._in_flight.discard(fullname)
+                self._acknowledged.pop(fullname, None) # Keeps the acknowledgement order
+                self._acknowledged[fullname] = now
+
+    def _expire(self) -> None:
+        """
+        Drops the events acknowledged before the grace period, the lock being held
+        """
+        now = monotonic()
+        while self._acknowledged and now - next(iter(self._acknowledged.values())) > self.grace:
+            self._acknowledged.popitem(last=False)
+
+
+class Pipeline: # pylint: disable=R0902
+    """
+    Class running the bot as a pipeline:
+     * fetch: the caller submits the events coming from the stream
+     * execute: one worker thread per lane runs the EventHandler, the lane
+                being chosen from the author so that each sender's commands stay in order.
+                A worker doesn't wait for the tips it submits to be sent, the event is
+                finished when its tip is (see InFlight)
+     * reply: a worker thread sends the replies and marks the messages as read,
+              by chunks of ACK_CHUNK
+    Queues are bounded, so a slow stage slows down the stages before it
+    instead of piling up events in memory
+    The handled messages are recorded in the 'handled-events' sorted set until they
+    are marked as read, so that a message handled right before a crash isn't handled again.
+    Messages that never come back from the inbox (e.g. deleted) are trimmed after HANDLED_RETENTION
+    """
+    def __init__(self,
+                 event_handler: "EventHandler",
+                 on_error: Callable[[Union[Comment, Message], Exception], None],
+                 workers: int = 4,
+                 queue_size: int = 256) -> None:
+        self.event_handler = event_handler
+        self.on_error = on_error
+        self.lanes: List[Queue] = [Queue(maxsize=queue_size) for _ in range(workers)]
+        self.replies: Queue = Queue(maxsize=queue_size)
+        self.metrics = PipelineMetrics()
+        self.seen = SeenEvents()
+        self._acks: List[Union[Comment, Message]] = [] # Only used by the reply thread
+        self._acks_since = 0.0
+
+    def start(self) -> None:
+        """
+        Starts the execute and reply worker threads
+        """
+        threads = [Thread(target=self._execute, args=(events,), name=f"execute-{lane}", daemon=True)
+                   for lane, events in enumerate(self.lanes)]
+        threads.append(Thread(target=self._reply, name="reply", daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+    def unhandled(self, events: Iterable[Union[Comment, Message]]) -> List[Union[Comment, Message]]:
+        """
+        Returns the events that still have to be handled. The messages that were
+        handled but not marked as read (e.g. before a restart) are only acknowledged
+
+        Args:
+            events: the praw events coming from the stream
+        Returns:
+            events: the events to submit
+        """
+        events = list(events)
+        candidates = [event.fullname for event in events
+                      if isinstance(event, Message) and event.fullname not in self.seen]
+        if not candidates:
+            return events
+
+        handled = set(FILTER_HANDLED(keys=["handled-events"], args=[time() - HANDLED_RETENTION, *candidates]))
+        for event in events:
+            if event.fullname in handled:
+                self.seen.add(event.fullname)
+                self.metrics.incr("already-handled")
+                self.reply(self._acknowledge, event)
+        return [event for event in events if event.fullname not in handled]
+
+    def submit(self, event: Union[Comment, Message], start: Optional[int] = None) -> None:
+        """
+        Sends an event to the execute stage. Blocks if the lane is full
+        Events that are still in the pipeline or were just acknowledged are ignored,
+        since the inbox keeps returning them until they are marked as read
+
+        Args:
+            event: the praw event to handle
+            start: position of the command in the body of a comment, if it was already found
+        """
+        if not self.seen.add(event.fullname):
+            return
+
+        author = event.author.name if event.author is not None else ""
+        self.lanes[lane_of(author, len(self.lanes))].put((event, start))
+        self.metrics.incr("fetched")
+
+    def reply(self, function: Callable, *args) -> None:
+        """
+        Sends a reply job to the reply stage. Blocks if the queue is full
+
+        Args:
+            function: function sending the reply
+            args: arguments passed to the function
+        """
+        self.replies.put((function, args))
+
+    def _execute(self, events: Queue) -> None:
+        """
+        Execute stage: handles the events of a lane one by one
+        """
+        in_flight = InFlight()
+        while True:
+            event, start = events.get()
+            in_flight.handle(self.event_handler, event, start, lambda error, event=event: self._executed(event, error))
+            events.task_done()
+
+    def _executed(self, event: Union[Comment, Message], error: Optional[Exception]) -> None:
+        """
+        Finishes an event once it was handled: notifies the error if any, records
+        the message as handled and queues its acknowledgement
+        """
+        if error is None:
+            self.metrics.incr("executed")
+        else:
+            self.metrics.incr("failed")
+            self.reply(self.on_error, event, error)
+        if isinstance(event, Message): # Comments are claimed before being handled (see claim_comments)
+            try:
+                redis.zadd("handled-events", {event.fullname: time()})
+            except Exception: # pylint: disable=W0703
+                log.exception(f"Could not record {event.fullname} as handled", event=event.fullname)
+        self.reply(self._acknowledge, event)
+
+    def _acknowledge(self, event: Union[Comment, Message]) -> None:
+        """
+        Queues the event to be marked as read with the next chunk
+        """
+        if not self._acks:
+            self._acks_since = monotonic()
+        self._acks.append(event)
+        if len(self._acks) >= ACK_CHUNK:
+            self._flush()
+
+    def _flush(self) -> None:
+        """
+        Marks the queued messages as read in a single request, and lets the events leave the pipeline
+        """
+        events, self._acks = self._acks, []
+        messages = [event for event in events if isinstance(event, Message)]
+        try:
+            if messages:
+                reddit.inbox.mark_read(messages)
+                redis.zrem("handled-events", *[message.fullname for message in messages])
+                self.metrics.incr("ack-requests")
+        except Exception: # pylint: disable=W0703
+            # The messages stay in handled-events, they are acknowledged again once the inbox returns them
+            self.metrics.incr("ack-failed")
+            log.exception(f"{len(messages)} messages could not be marked as read", messages=len(messages))
+        finally:
+            self.seen.acknowledge(event.fullname for event in events)
+
+    def _reply(self) -> None:
+        """
+        Reply stage: runs the reply jobs in the order they were queued, and marks the
+        messages as read when a chunk is full or ACK_DELAY after the first acknowledgement
+        """
+        while True:
+            if self._acks and monotonic() - self._acks_since >= ACK_DELAY:
+                self._flush()
+            try:
+                function, args = self.replies.get(
+                    timeout=max(self._acks_since + ACK_DELAY - monotonic(), 0) if self._acks else None)
+            except Empty:
+                continue
+            try:
+                function(*args)
+                self.metrics.incr("replied")
+            except Exception: # pylint: disable=W0703
+                self.metrics.incr("reply-failed")
+                log.exception("A reply could not be sent")
+            self.replies.task_done()
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """
+        Returns the throughput and queue depths of the pipeline
+
+        Returns:
+            stats: dictionary of the metrics
+        """
+        stats = dict(self.metrics.counters)
+        stats["throughput"] = round(self.metrics.throughput(), 3)
+        stats["execute-queue"] = sum(events.qsize() for events in self.lanes)
+        stats["reply-queue"] = self.replies.qsize()
+        stats["ack-queue"] = len(self._acks)
+        return stats
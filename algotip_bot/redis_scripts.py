@@ -0,0 +1,112 @@
+"""
+File containing the Lua scripts run on Redis. Each script groups
+several commands in a single atomic round trip
+"""
+
+from algotip_bot.clients import redis
+
+# Returns the user id of a username, allocating a new one atomically if needed
+# KEYS: users:{name}, user-id
+# Returns: [user_id, created (0 or 1)]
+GET_OR_CREATE_USER = redis.register_script("""
+local user_id = redis.call('GET', KEYS[1])
+if user_id then
+    return {user_id, 0}
+end
+user_id = redis.call('INCR', KEYS[2])
+redis.call('SET', KEYS[1], user_id)
+return {user_id, 1}
+""")
+
+# Marks comments as seen in a sorted set scored by the time they were seen,
+# after dropping the ones older than the retention window
+# KEYS: comment-seen
+# ARGV: now, cutoff, comment_id, ...
+# Returns: the ids that weren't seen yet
+CLAIM_COMMENTS = redis.register_script("""
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[2])
+local claimed = {}
+for i = 3, #ARGV do
+    if redis.call('ZADD', KEYS[1], 'NX', ARGV[1], ARGV[i]) == 1 then
+        table.insert(claimed, ARGV[i])
+    end
+end
+return claimed
+""")
+
+# Returns the command id and the state of an event that was already received,
+# otherwise allocates a command id, indexes it and marks the event as started
+# (the 'command:{id}' hash is written by the caller, its name isn't known before the call)
+# KEYS: event:{fullname}, command-id, commands
+# ARGV: timestamp, ttl
+# Returns: [command_id, state ('new' if the event wasn't received yet)]
+BEGIN_EVENT = redis.register_script("""
+local state = redis.call('HGET', KEYS[1], 'state')
+if state then
+    return {redis.call('HGET', KEYS[1], 'command'), state}
+end
+local command_id = redis.call('INCR', KEYS[2])
+redis.call('ZADD', KEYS[3], ARGV[1], command_id)
+redis.call('HSET', KEYS[1], 'command', command_id, 'state', 'started')
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return {command_id, 'new'}
+""")
+
+# Moves an event from 'started' to 'sending', right before its transaction is sent.
+# Only one of the handlers of a duplicated event can succeed
+# KEYS: event:{fullname}
+# Returns: 1 if the transaction can be sent, 0 otherwise
+CLAIM_SEND = redis.register_script("""
+if redis.call('HGET', KEYS[1], 'state') ~= 'started' then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'state', 'sending')
+return 1
+""")
+
+# Moves the retried messages that are due back to the outbox, then moves
+# a batch of messages from the outbox to the list of messages being sent
+# KEYS: outbox, outbox:sending, outbox:retry
+# ARGV: now, count
+# Returns: the batch of messages
+TAKE_MESSAGES = redis.register_script("""
+local due = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1])
+if #due > 0 then
+    redis.call('RPUSH', KEYS[1], unpack(due))
+    redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', ARGV[1])
+end
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[2]) - 1)
+if #items > 0 then
+    redis.call('LTRIM', KEYS[1], #items, -1)
+    redis.call('RPUSH', KEYS[2], unpack(items))
+end
+return items
+""")
+
+# Pushes an event to the stream of its shard, unless it was already queued recently
+# (the inbox keeps returning a message until it is marked as read)
+# KEYS: events:{shard}, queued:{fullname}
+# ARGV: ttl, field, value, ...
+# Returns: the id of the stream entry, false if the event was already queued
+ENQUEUE_EVENT = redis.register_script("""
+if not redis.call('SET', KEYS[2], 1, 'NX', 'EX', ARGV[1]) then
+    return false
+end
+return redis.call('XADD', KEYS[1], '*', unpack(ARGV, 2))
+""")
+
+# Returns the events that were already handled, among the given ones,
+# after removing the events handled before the retention window
+# KEYS: handled-events
+# ARGV: oldest timestamp kept, fullname, ...
+# Returns: the fullnames of the handled events
+FILTER_HANDLED = redis.register_script("""
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[1])
+local handled = {}
+for i = 2, #ARGV do
+    if redis.call('ZSCORE', KEYS[1], ARGV[i]) then
+        table.insert(handled, ARGV[i])
+    end
+end
+return handled
+""")
@@ -0,0 +1,68 @@
+"""
+File containing the PollScheduler class, that decides how long the main
+loop waits before polling Reddit again, from the results of the last polls
+"""
+
+from collections import Counter
+from typing import Dict
+
+
+class PollScheduler:
+    """
+    Adaptive polling interval:
+     * after a poll that returned events, the next one happens after min_interval,
+       since more events usually follow (replies, bursts of tips)
+     * each empty poll doubles the interval, up to max_interval
+     * each consecutive error doubles the interval from error_interval, up to
+       max_error_interval, so that the bot doesn't hammer Reddit while it is struggling
+    """
+    def __init__(self,
+                 min_interval: float = 0.5,
+                 max_interval: float = 6.0,
+                 error_interval: float = 2.0,
+                 max_error_interval: float = 120.0) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.error_interval = error_interval
+        self.max_error_interval = max_error_interval
+        self.interval = min_interval
+        self.counters: Counter = Counter() # polls, empty-polls, errors
+        self._consecutive_errors = 0
+
+    def polled(self, events: int) -> None:
+        """
+        Records a successful poll
+
+        Args:
+            events: number of events returned by the poll
+        """
+        self.counters["polls"] += 1
+        self._consecutive_errors = 0
+        if events:
+            self.interval = self.min_interval
+        else:
+            self.counters["empty-polls"] += 1
+            self.interval = min(max(self.interval * 2, self.min_interval), self.max_interval)
+
+    def failed(self) -> None:
+        """
+        Records a poll that failed because of Reddit
+        """
+        self.counters["errors"] += 1
+        self._consecutive_errors += 1
+        self.interval = min(self.error_interval * 2 ** (self._consecutive_errors - 1), self.max_error_interval)
+
+    def delay(self) -> float:
+        """
+        Returns the number of seconds to wait before the next poll
+        """
+        return self.interval
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the counters and the current interval of the scheduler
+        """
+        return {"polls": self.counters["polls"],
+                "empty-polls": self.counters["empty-polls"],
+                "errors": self.counters["errors"],
+                "interval": self.interval}
@@ -1,4 +1,5 @@
 from algotip_bots.utils import stream
 
-for event in stream():
+events, _ = stream()
+for event in events:
     print(event)
@@ -0,0 +1,16 @@
+from time import time
+
+from algotip_bot.clients import redis
+
+# Moves the ids of the old, never expiring 'comment-cache' set to the 'comment-seen'
+# sorted set used by utils.stream. They are scored with the migration time, so they
+# expire after the usual retention window
+now = time()
+with redis.pipeline() as pipe:
+    for comment_id in redis.sscan_iter("comment-cache", count=1000):
+        pipe.zadd("comment-seen", {comment_id: now}, nx=True)
+        if len(pipe) >= 1000:
+            pipe.execute()
+    pipe.execute()
+
+redis.delete("comment-cache")
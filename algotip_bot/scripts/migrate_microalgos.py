@@ -0,0 +1,29 @@
+from algosdk.util import algos_to_microalgos
+
+from algotip_bot.clients import redis
+from algotip_bot.logs import get_logger
+
+log = get_logger("algotip_bot.scripts.migrate_microalgos")
+
+# Converts the amounts and fees stored as floats in Algos to integer microAlgos
+# in the 'transaction:{id}' hashes of the confirmed transactions.
+# Integer values are left untouched, so the script can be run more than once
+
+def is_float(value):
+    return "." in value or "e" in value
+
+converted = 0
+with redis.pipeline() as pipe:
+    for key in redis.scan_iter("transaction:*", count=1000):
+        fields = redis.hmget(key, "amount", "fee")
+        updates = {name: algos_to_microalgos(float(value))
+                   for name, value in zip(("amount", "fee"), fields)
+                   if value is not None and is_float(value)}
+        if updates:
+            pipe.hmset(key, updates)
+            converted += 1
+        if len(pipe) >= 1000:
+            pipe.execute()
+    pipe.execute()
+
+log.info(f"Converted the amounts of {converted} transactions to microAlgos", converted=converted)
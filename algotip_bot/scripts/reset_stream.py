@@ -1,5 +1,6 @@
 from algotip_bot.clients import reddit, redis
-from algotip_bot.utils import COMMENT_COMMANDS
+from algotip_bot.commands import find_comment_command
+from algotip_bot.utils import claim_comments
 
 inbox_events = list(reddit.inbox.unread())
 reddit.inbox.mark_read(inbox_events)
@@ -8,7 +9,6 @@ subreddits = redis.smembers("subreddits")
 
 
 subrredits_comments = set(reddit.subreddit("+".join(subreddits)).comments(limit=500))
-subrredits_comments = {comment for comment in subrredits_comments if any(command in comment.body for command in COMMENT_COMMANDS)}
+subrredits_comments = {comment for comment in subrredits_comments if find_comment_command(comment.body) is not None}
 
-if subrredits_comments:
-    redis.sadd("comment-cache", *{comment.id for comment in subrredits_comments})
+claim_comments(subrredits_comments)
@@ -0,0 +1,71 @@
+"""
+File containing the helpers shared by the roles of the bot (standalone,
+coordinator and worker, see main.py and sharding.py): starting the metrics,
+polling the stream with backoff and logging the stats of the components
+"""
+
+from typing import Dict, Iterable, Set, Tuple
+
+from prawcore.exceptions import RequestException, ServerError
+
+from algotip_bot.cache import balances, reddit_metadata, suggested_params
+from algotip_bot.clients import algod, binary_redis, reddit, redis
+from algotip_bot.idempotency import event_log
+from algotip_bot.instances import users
+from algotip_bot.ledger import ledger
+from algotip_bot.logs import get_logger
+from algotip_bot.metrics import metrics
+from algotip_bot.scheduler import PollScheduler
+from algotip_bot.submitter import submitter
+from algotip_bot.utils import stream
+
+STATS_INTERVAL = 60 # Seconds between two logs of the stats
+
+# Components used by every process that handles events
+HANDLING_COMPONENTS = (("Suggested params cache", suggested_params),
+                       ("Balance cache", balances),
+                       ("Ledger", ledger),
+                       ("Reddit metadata cache", reddit_metadata),
+                       ("User cache", users),
+                       ("Transaction submitter", submitter),
+                       ("Event log", event_log))
+
+log = get_logger(__name__)
+
+
+def start_metrics() -> None:
+    """
+    Instruments the clients and starts exposing the metrics (if they are enabled)
+    """
+    metrics.start(reddit, algod, redis, binary_redis)
+
+def poll(scheduler: PollScheduler) -> Tuple[Set, Dict[str, int]]:
+    """
+    Fetches the events (see stream) and records the outcome of the poll in the scheduler.
+    If Reddit is unavailable, no event is returned and the scheduler backs off,
+    instead of having the bot crash everytime the Reddit API is struggling
+
+    Args:
+        scheduler: the scheduler of the polls
+    Returns:
+        events, starts: the events and the position of the command in each comment (see stream)
+    """
+    try:
+        events, starts = stream()
+    except (ServerError, RequestException) as e: # pylint: disable=C0103
+        scheduler.failed()
+        log.warning(f"Reddit is unavailable ({e!r}), next poll in {scheduler.delay()}s", delay=scheduler.delay())
+        return set(), {}
+    scheduler.polled(len(events))
+    return events, starts
+
+def log_stats(components: Iterable[tuple]) -> None:
+    """
+    Logs the stats of the given components
+
+    Args:
+        components: (name, component) pairs, each component having a stats method
+    """
+    for name, component in components:
+        stats = component.stats()
+        log.info(f"{name} : {stats}", component=name, stats=stats)
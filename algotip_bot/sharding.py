@@ -0,0 +1,285 @@
+"""
+File containing the sharded mode of the bot, in which the work is split between processes:
+ * coordinator: fetches the stream and pushes every event to the Redis stream of its
+                shard (events:{shard}), the shard being chosen from the author.
+                It is also the only process sending the messages of the outbox
+ * workers: each worker handles the events of the shards it owns (shard % WORKER_COUNT == WORKER_INDEX),
+            one thread per shard so that each sender's commands stay in order, and tracks the
+            confirmation of the transactions it sent
+The workers read the streams through a consumer group and acknowledge an event once it
+was handled. Each shard has its own consumer, so the events a crashed worker didn't acknowledge
+are handled again by the worker that owns the shard when it (re)starts (the EventLog makes
+sure that their transactions aren't sent twice)
+"""
+
+import os
+from itertools import chain
+from threading import Thread
+from time import monotonic, sleep
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+from praw.models import Redditor
+from praw.models.reddit.comment import Comment
+from praw.models.reddit.message import Message
+from redis.exceptions import ResponseError
+
+from algotip_bot.cache import reddit_metadata
+from algotip_bot.clients import reddit, redis
+from algotip_bot.confirmations import ConfirmationTracker
+from algotip_bot.handlers import EventHandler
+from algotip_bot.logs import get_logger
+from algotip_bot.messaging import outbox
+from algotip_bot.pipeline import ACK_CHUNK, InFlight, PipelineMetrics, lane_of
+from algotip_bot.redis_scripts import ENQUEUE_EVENT
+from algotip_bot.scheduler import PollScheduler
+from algotip_bot.services import HANDLING_COMPONENTS, STATS_INTERVAL, log_stats, poll, start_metrics
+from algotip_bot.submitter import submitter
+from algotip_bot.utils import comment_stream
+
+SHARDS = int(os.environ.get("SHARDS", 16)) # Must be the same in every process, and never change
+                                           # while events or pending transactions are left
+GROUP = "workers"
+QUEUED_TTL = 3600 # Seconds during which an event pushed to a stream can't be pushed again
+READ_COUNT = 32 # Maximum number of events read at once from a shard
+READ_BLOCK = 5000 # Milliseconds a worker waits for new events on a shard
+
+log = get_logger(__name__)
+
+
+def shard_stream(shard: int) -> str:
+    """
+    Returns the name of the Redis stream holding the events of a shard
+    """
+    return f"events:{shard}"
+
+def serialize_event(event: Union[Comment, Message], start: Optional[int] = None) -> Dict[str, str]:
+    """
+    Returns the fields of an event needed to handle it, as strings
+
+    Args:
+        event: the praw event
+        start: position of the command in the body of a comment, if it was already found
+    Returns:
+        fields: the fields of the stream entry
+    """
+    fields = {"kind": "comment" if isinstance(event, Comment) else "message",
+              "id": event.id,
+              "author": event.author.name if event.author is not None else "",
+              "body": event.body,
+              "created_utc": str(event.created_utc)}
+    if isinstance(event, Comment):
+        fields.update(parent_id=event.parent_id, link_id=event.link_id, start="" if start is None else str(start))
+    else:
+        fields["subject"] = event.subject
+    return fields
+
+def deserialize_event(fields: Dict[str, str]) -> Union[Comment, Message]:
+    """
+    Rebuilds the praw event from the fields of a stream entry, without fetching it
+
+    Args:
+        fields: the fields written by serialize_event
+    Returns:
+        event: the praw Comment or Message
+    """
+    data = {"id": fields["id"], "body": fields["body"], "created_utc": float(fields["created_utc"])}
+    if fields["kind"] == "comment":
+        # Comment converts the author name to a Redditor itself
+        data.update(author=fields["author"] or "[deleted]", parent_id=fields["parent_id"], link_id=fields["link_id"])
+        return Comment(reddit, _data=data)
+    data.update(author=Redditor(reddit, fields["author"]) if fields["author"] else None, subject=fields["subject"])
+    return Message(reddit, _data=data)
+
+def ensure_groups(shards: Iterable[int]) -> None:
+    """
+    Creates the streams of the given shards and their consumer group, if they don't exist yet
+    """
+    for shard in shards:
+        try:
+            redis.xgroup_create(shard_stream(shard), GROUP, id="0", mkstream=True)
+        except ResponseError as e: # pylint: disable=C0103
+            if not str(e).startswith("BUSYGROUP"): # The group already exists
+                raise
+
+def enqueue(events: Iterable[Union[Comment, Message]], starts: Dict[str, int]) -> int:
+    """
+    Pushes the events to the streams of their shards, in a single round trip.
+    The events that were already pushed recently are skipped
+
+    Args:
+        events: the praw events coming from the stream
+        starts: position of the command in the body of the comments, by fullname
+    Returns:
+        enqueued: number of events that were pushed
+    """
+    with redis.pipeline() as pipe:
+        for event in events:
+            fields = serialize_event(event, starts.get(event.fullname))
+            ENQUEUE_EVENT(keys=[shard_stream(lane_of(fields["author"], SHARDS)), f"queued:{event.fullname}"],
+                          args=[QUEUED_TTL, *chain.from_iterable(fields.items())],
+                          client=pipe)
+        return sum(entry_id is not None for entry_id in pipe.execute())
+
+class ShardWorker:
+    """
+    Handles the events of the owned shards, one thread per shard.
+    The transactions are tracked by a ConfirmationTracker of the owned shards,
+    so that they are recovered by the worker that owns their sender after a restart
+    """
+    def __init__(self,
+                 index: int,
+                 workers: int,
+                 on_error: Callable[[Union[Comment, Message], Exception], None]) -> None:
+        self.shards: List[int] = [shard for shard in range(SHARDS) if shard % workers == index]
+        self.on_error = on_error
+        self.event_handler = EventHandler()
+        self.event_handler.unconfirmed_transactions = ConfirmationTracker(self.shards, SHARDS)
+        self.metrics = PipelineMetrics()
+
+    def start(self) -> None:
+        """
+        Recovers the pending transactions and starts the shard threads
+        """
+        ensure_groups(self.shards)
+        self.event_handler.unconfirmed_transactions.recover()
+        self.event_handler.unconfirmed_transactions.start()
+        for shard in self.shards:
+            Thread(target=self._consume, args=(shard,), name=f"shard-{shard}", daemon=True).start()
+
+    def _consume(self, shard: int) -> None:
+        """
+        Handles the events of a shard in order: first the ones that were delivered
+        but not acknowledged before a restart, then the new ones.
+        The backlog is read once, each read starting after the last entry delivered,
+        since the entries being handled stay pending until they are acknowledged
+        """
+        last_id = "0"
+        in_flight = InFlight()
+        while True:
+            try:
+                response = redis.xreadgroup(GROUP, f"shard-{shard}", {shard_stream(shard): last_id},
+                                            count=READ_COUNT, block=READ_BLOCK)
+                entries = response[0][1] if response else []
+                if last_id != ">":
+                    if not entries:
+                        last_id = ">" # Nothing left from a previous run
+                        continue
+                    last_id = entries[-1][0]
+                self._handle(shard, entries, in_flight)
+            except Exception: # pylint: disable=W0703
+                log.exception(f"Could not read the events of shard {shard}", shard=shard)
+                sleep(1)
+
+    def _handle(self, shard: int, entries: List[tuple], in_flight: InFlight) -> None:
+        """
+        Handles a batch of stream entries, and acknowledges and deletes each of them
+        once it was handled (for a tip, once it was sent)
+        """
+        events = [(entry_id, deserialize_event(fields), int(fields["start"]) if fields.get("start") else None)
+                  for entry_id, fields in entries]
+        reddit_metadata.prefetch([event for _, event, _ in events])
+        for entry_id, event, start in events:
+            self.metrics.incr("fetched")
+            in_flight.handle(self.event_handler, event, start,
+                             lambda error, entry_id=entry_id, event=event:
+                             self._executed(shard, entry_id, event, error))
+
+    def _executed(self,
+                  shard: int,
+                  entry_id: str,
+                  event: Union[Comment, Message],
+                  error: Optional[Exception]) -> None:
+        """
+        Notifies the error of a handled event if any, then acknowledges and deletes its entry
+        """
+        if error is None:
+            self.metrics.incr("executed")
+        else:
+            self.metrics.incr("failed")
+            self.on_error(event, error)
+        with redis.pipeline() as pipe:
+            pipe.xack(shard_stream(shard), GROUP, entry_id)
+            pipe.xdel(shard_stream(shard), entry_id)
+            pipe.execute()
+
+    def wait(self, timeout: float) -> list:
+        """
+        Waits at most timeout seconds for transactions of the owned shards to be confirmed
+        """
+        return self.event_handler.unconfirmed_transactions.wait(timeout)
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """
+        Returns the throughput of the worker and the number of events left in its shards
+        """
+        stats = dict(self.metrics.counters)
+        stats["throughput"] = round(self.metrics.throughput(), 3)
+        with redis.pipeline() as pipe:
+            for shard in self.shards:
+                pipe.xlen(shard_stream(shard))
+            stats["backlog"] = sum(pipe.execute())
+        return stats
+
+
+def coordinate() -> None:
+    """
+    Runs the coordinator: fetches the events and pushes them to the
+    streams of their shards, then marks them as read
+    """
+    start_metrics()
+    ensure_groups(range(SHARDS))
+    outbox.start()
+    counters = PipelineMetrics()
+    scheduler = PollScheduler()
+    last_stats = monotonic()
+
+    log.info(f"Coordinator started with {SHARDS} shards. Waiting for messages ...", shards=SHARDS)
+
+    while True:
+        events, starts = poll(scheduler)
+        if events:
+            counters.incr("enqueued", enqueue(events, starts))
+            messages = [event for event in events if isinstance(event, Message)]
+            for start in range(0, len(messages), ACK_CHUNK):
+                reddit.inbox.mark_read(messages[start:start + ACK_CHUNK])
+
+        if monotonic() - last_stats > STATS_INTERVAL:
+            stats = dict(counters.counters)
+            log.info(f"Coordinator : {stats}", component="Coordinator", stats=stats)
+            log_stats((("Outbox", outbox), ("Comment stream", comment_stream), ("Poll scheduler", scheduler)))
+            last_stats = monotonic()
+
+        sleep(scheduler.delay())
+
+def work(index: int,
+         workers: int,
+         on_error: Callable[[Union[Comment, Message], Exception], None],
+         on_confirmed: Callable[["PendingTransaction"], None]) -> None:
+    """
+    Runs a worker: handles the events of its shards and
+    passes the confirmed transactions to on_confirmed
+
+    Args:
+        index: index of the worker, from 0 to workers - 1
+        workers: total number of workers
+        on_error: called with the event and the error when an event couldn't be handled
+        on_confirmed: called with every confirmed transaction
+    """
+    start_metrics()
+    worker = ShardWorker(index, workers, on_error)
+    worker.start()
+    submitter.start()
+    last_stats = monotonic()
+
+    log.info(f"Worker {index} started on shards {worker.shards}", worker=index, shards=worker.shards)
+
+    while True:
+        for transaction in worker.wait(STATS_INTERVAL / 10):
+            try:
+                on_confirmed(transaction)
+            except Exception: # pylint: disable=W0703
+                log.exception(f"Could not notify the confirmation of {transaction.tx_id}", tx_id=transaction.tx_id)
+
+        if monotonic() - last_stats > STATS_INTERVAL:
+            log_stats((("Worker stats", worker), *HANDLING_COMPONENTS))
+            last_stats = monotonic()
@@ -0,0 +1,247 @@
+"""
+File containing the helpers used to fetch the new comments of the
+watched subreddits incrementally, split into shards of subreddits
+"""
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from praw.models.reddit.comment import Comment
+from praw.models.reddit.subreddit import Subreddit
+from prawcore.exceptions import RequestException, ServerError
+
+
+class CommentCursor: # pylint: disable=R0902
+    """
+    Class keeping the fullname of the newest comment seen in a listing,
+    so that each poll only asks Reddit for the comments posted after it.
+    The page size grows when there is a backlog and shrinks when it's quiet.
+    A full scan is done at start, after an error, when the listing changes or
+    when the cursor stayed empty for too long (e.g. the newest comment was removed,
+    in which case Reddit returns nothing newer than it)
+    """
+    def __init__(self,
+                 min_limit: int = 10,
+                 max_limit: int = 100,
+                 max_pages: int = 5,
+                 stale_polls: int = 120) -> None:
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_pages = max_pages
+        self.stale_polls = stale_polls
+        self.limit = min_limit
+        self.newest: Optional[str] = None
+        self.listing: Optional[str] = None
+        self._empty_polls = 0
+
+    def reset(self) -> None:
+        """
+        Forgets the newest comment, so that the next fetch does a full scan
+        """
+        self.newest = None
+        self.limit = self.min_limit
+        self._empty_polls = 0
+
+    def fetch(self, subreddit: Subreddit) -> List[Comment]:
+        """
+        Fetches the comments posted in the subreddit since the last call
+
+        Args:
+            subreddit: the (multi)subreddit to fetch the comments from
+        Returns:
+            comments: the new comments, newest first
+        """
+        if subreddit.display_name != self.listing:
+            self.listing = subreddit.display_name
+            self.reset()
+
+        if self.newest is None or self._empty_polls >= self.stale_polls:
+            comments = list(subreddit.comments(limit=self.max_limit))
+            self._empty_polls = 0
+        else:
+            comments = []
+            for _ in range(self.max_pages):
+                page = list(subreddit.comments(limit=self.limit, params={"before": self.newest}))
+                comments = page + comments
+                if page:
+                    self.newest = page[0].fullname
+                if len(page) < self.limit:
+                    break
+                self.limit = min(self.limit * 2, self.max_limit) # Backlog: ask for bigger pages
+
+            if len(comments) < self.limit // 4:
+                self.limit = max(self.limit // 2, self.min_limit)
+
+            self._empty_polls = 0 if comments else self._empty_polls + 1
+
+        if comments:
+            self.newest = comments[0].fullname
+
+        return comments
+
+
+class SubredditShard: # pylint: disable=R0903
+    """
+    Group of subreddits fetched as a single multireddit listing, with its own
+    cursor and polling schedule
+    """
+    def __init__(self, subreddits: Tuple[str, ...], cursor: Optional[CommentCursor] = None) -> None:
+        self.subreddits = subreddits
+        self.listing = "+".join(subreddits)
+        self.cursor = cursor if cursor is not None else CommentCursor()
+        self.next_poll = 0.0
+        self.last_poll: Optional[float] = None
+        self.failures = 0 # Consecutive errors
+
+
+class ShardedCommentStream: # pylint: disable=R0902
+    """
+    Class fetching the new comments of a set of subreddits split into shards,
+    so that the listing URLs stay short and a busy subreddit can't push the comments
+    of the quiet ones out of a shared listing
+     * subreddits are grouped by shard_size, in alphabetical order, except the busy ones
+       (more than busy_rate comments per second) that get a shard of their own
+     * each shard keeps its own CommentCursor, so no comment of a quiet shard is missed
+       even if it is rarely polled
+     * each shard is polled about every target_batch / rate seconds (bounded by
+       min_interval and max_interval), the rate being a moving average of the observed rates
+     * the shards that are due are fetched concurrently, and a shard failing
+       because of Reddit backs off exponentially, up to max_error_interval.
+       The polls only update their own shard, the rates and counters are
+       updated by the thread calling fetch
+    The shards are rebuilt when the set of subreddits changes, or every rebalance_interval
+    seconds to follow the rates. Shards that keep their subreddits keep their cursor
+    """
+    def __init__(self, # pylint: disable=R0913, R0917
+                 shard_size: int = 10,
+                 busy_rate: float = 0.5,
+                 target_batch: int = 25,
+                 min_interval: float = 0.5,
+                 max_interval: float = 10,
+                 max_error_interval: float = 120,
+                 rebalance_interval: float = 3600,
+                 workers: int = 4) -> None:
+        self.shard_size = shard_size
+        self.busy_rate = busy_rate
+        self.target_batch = target_batch
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_error_interval = max_error_interval
+        self.rebalance_interval = rebalance_interval
+        self.rates: Dict[str, float] = {} # subreddit -> comments per second
+        self.shards: List[SubredditShard] = []
+        self.polls = 0
+        self.errors = 0
+        self._subreddits: FrozenSet[str] = frozenset()
+        self._rebalanced = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="subreddit-shard")
+
+    def partition(self, subreddits: Iterable[str]) -> List[Tuple[str, ...]]:
+        """
+        Splits the subreddits into shards, the busy ones being alone in their shard
+
+        Args:
+            subreddits: names of the subreddits
+        Returns:
+            shards: the subreddits of each shard
+        """
+        subreddits = sorted(subreddits)
+        busy = [(subreddit,) for subreddit in subreddits if self.rates.get(subreddit, 0) >= self.busy_rate]
+        quiet = [subreddit for subreddit in subreddits if self.rates.get(subreddit, 0) < self.busy_rate]
+        return busy + [tuple(quiet[start:start + self.shard_size]) for start in range(0, len(quiet), self.shard_size)]
+
+    def _rebalance(self, subreddits: FrozenSet[str], now: float) -> None:
+        existing = {shard.subreddits: shard for shard in self.shards}
+        self.shards = [existing.get(names, SubredditShard(names)) for names in self.partition(subreddits)]
+        self.rates = {subreddit: rate for subreddit, rate in self.rates.items() if subreddit in subreddits}
+        self._subreddits = subreddits
+        self._rebalanced = now
+
+    def interval(self, shard: SubredditShard) -> float:
+        """
+        Returns the number of seconds to wait between two polls of the shard
+        """
+        rate = sum(self.rates.get(subreddit, 0) for subreddit in shard.subreddits)
+        if rate <= 0:
+            return self.max_interval
+        return min(max(self.target_batch / rate, self.min_interval), self.max_interval)
+
+    def _poll(self, reddit, shard: SubredditShard, now: float) -> Optional[Tuple[List[Comment], Optional[Counter]]]:
+        """
+        Fetches the new comments of a shard. Runs on the executor threads, so it only updates the shard
+
+        Returns:
+            comments, counts: the new comments and their number by subreddit (None after a full scan,
+                              which covers an unknown period), None if Reddit failed
+        """
+        full_scan = shard.cursor.newest is None
+        try:
+            comments = shard.cursor.fetch(reddit.subreddit(shard.listing))
+        except (ServerError, RequestException): # Reddit is struggling, back off and rescan the shard
+            shard.cursor.reset()
+            shard.failures += 1
+            shard.next_poll = now + min(self.min_interval * 2 ** shard.failures, self.max_error_interval)
+            return None
+        shard.failures = 0
+
+        if full_scan or shard.last_poll is None:
+            return comments, None
+        return comments, Counter(str(comment.subreddit).lower() for comment in comments)
+
+    def fetch(self, reddit, subreddits: Iterable[str], now: Optional[float] = None) -> List[Comment]:
+        """
+        Fetches the new comments of the shards that are due, and updates the rates of their subreddits
+
+        Args:
+            reddit: the praw client
+            subreddits: names of the watched subreddits
+            now: the current monotonic time
+        Returns:
+            comments: the new comments of the polled shards
+        """
+        now = monotonic() if now is None else now
+        subreddits = frozenset(subreddit.lower() for subreddit in subreddits)
+        if subreddits != self._subreddits or now - self._rebalanced > self.rebalance_interval:
+            self._rebalance(subreddits, now)
+
+        due = [shard for shard in self.shards if shard.next_poll <= now]
+        self.polls += len(due)
+        if len(due) == 1:
+            results = [self._poll(reddit, due[0], now)]
+        else:
+            results = list(self._executor.map(lambda shard: self._poll(reddit, shard, now), due))
+
+        comments = []
+        for shard, result in zip(due, results):
+            if result is None:
+                self.errors += 1
+                continue
+            shard_comments, counts = result
+            if counts is not None:
+                elapsed = max(now - shard.last_poll, 1e-3)
+                for subreddit in shard.subreddits:
+                    self.rates[subreddit] = 0.3 * counts[subreddit] / elapsed + 0.7 * self.rates.get(subreddit, 0)
+            shard.last_poll = now
+            shard.next_poll = now + self.interval(shard)
+            comments.extend(shard_comments)
+        return comments
+
+    def reset(self) -> None:
+        """
+        Makes every shard do a full scan at its next poll
+        """
+        for shard in self.shards:
+            shard.cursor.reset()
+            shard.next_poll = 0.0
+
+    def stats(self) -> dict:
+        """
+        Returns the shards and the comment rates of the stream
+        """
+        return {"shards": len(self.shards),
+                "polls": self.polls,
+                "errors": self.errors,
+                "busiest": sorted(self.rates.items(), key=lambda item: -item[1])[:3],
+                "intervals": [round(self.interval(shard), 1) for shard in self.shards]}
@@ -0,0 +1,142 @@
+"""
+File containing the BatchSubmitter class, that collects the tips ready
+in the same tick and submits them as atomic transaction groups
+"""
+
+from concurrent.futures import Future
+from threading import Event, Lock, Thread
+from typing import List, Optional, Tuple
+
+from algosdk import transaction
+from algosdk.error import AlgodHTTPError
+
+from algotip_bot.clients import algod
+from algotip_bot.idempotency import event_log
+from algotip_bot.logs import get_logger
+
+MAX_GROUP_SIZE = 16 # Maximum number of transactions in an Algorand group
+
+log = get_logger(__name__)
+
+
+class BatchSubmitter: # pylint: disable=R0902
+    """
+    Class grouping the transactions submitted by the pipeline workers.
+    Every tick (or as soon as a full group is waiting), the pending transactions are
+    split into groups of up to 16, signed and sent with a single send_transactions call per group.
+    If algod rejects a group, its transactions are sent one by one so that a single
+    invalid transaction doesn't make the others fail. Each caller gets the outcome
+    of its own transaction through a future, so that the workers don't wait for the
+    tick and keep executing the other events meanwhile
+    """
+    def __init__(self, interval: float = 0.25, group_size: int = MAX_GROUP_SIZE) -> None:
+        self.interval = interval
+        self.group_size = group_size
+        self.groups_sent = 0
+        self.groups_rejected = 0
+        self.transactions_sent = 0
+        self._waiting: List[Tuple["Transaction", Future]] = []
+        self._lock = Lock()
+        self._full = Event()
+        self._thread: Optional[Thread] = None
+
+    def submit(self, trsctn: "Transaction") -> Future:
+        """
+        Queues a validated transaction, without waiting until it is sent.
+        If the submitter isn't running, the transaction is sent right away
+
+        Args:
+            trsctn: the Transaction instance to send
+        Returns:
+            future: resolves to the PendingTransaction record once the transaction is sent,
+                    or to the error raised by algod if the transaction was rejected
+        """
+        future: Future = Future()
+        if self._thread is None:
+            self._send_group([(trsctn, future)])
+        else:
+            with self._lock:
+                self._waiting.append((trsctn, future))
+                if len(self._waiting) >= self.group_size:
+                    self._full.set()
+        return future
+
+    def flush(self) -> None:
+        """
+        Sends all the waiting transactions, one group at a time
+        """
+        with self._lock:
+            waiting, self._waiting = self._waiting, []
+            self._full.clear()
+
+        for start in range(0, len(waiting), self.group_size):
+            self._send_group(waiting[start:start + self.group_size])
+
+    def _send_group(self, batch: List[Tuple["Transaction", Future]]) -> None:
+        """
+        Signs and sends a group of transactions, falling back to individual
+        submissions if the group is rejected
+        """
+        try:
+            txns = [trsctn.build() for trsctn, _ in batch]
+            if len(txns) > 1:
+                transaction.assign_group_id(txns)
+            event_log.sending({trsctn.event: txn.get_txid() for txn, (trsctn, _) in zip(txns, batch)})
+            signed_txns = [txn.sign(trsctn.sender.wallet.private_key) for txn, (trsctn, _) in zip(txns, batch)]
+            algod.send_transactions(signed_txns)
+        except AlgodHTTPError as e: # pylint: disable=C0103
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            self.groups_rejected += 1
+            log.warning(f"Group of {len(batch)} transactions rejected, sending them one by one", size=len(batch))
+            for item in batch:
+                self._send_group([item])
+            return
+        except Exception as e: # pylint: disable=W0703, C0103
+            # The group may have reached algod (e.g. a timeout), resending
+            # the transactions one by one could pay the tips twice
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.groups_sent += 1
+        self.transactions_sent += len(batch)
+        for signed_txn, (trsctn, future) in zip(signed_txns, batch):
+            try:
+                trsctn.sent(signed_txn)
+                future.set_result(trsctn.pending)
+            except Exception as e: # pylint: disable=W0703, C0103
+                tx_id = signed_txn.transaction.get_txid()
+                log.exception(f"Transaction {tx_id} was sent but could not be recorded", e, tx_id=tx_id)
+                future.set_exception(e)
+
+    def run(self) -> None:
+        """
+        Flushes the waiting transactions every tick, forever
+        """
+        while True:
+            self._full.wait(self.interval)
+            try:
+                self.flush()
+            except Exception: # pylint: disable=W0703
+                log.exception("Could not flush the transaction submitter")
+
+    def start(self) -> None:
+        """
+        Starts flushing the transactions in a background thread
+        """
+        if self._thread is None:
+            self._thread = Thread(target=self.run, name="submitter", daemon=True)
+            self._thread.start()
+
+    def stats(self) -> dict:
+        """
+        Returns the number of groups sent and rejected, and the average size of the sent groups
+        """
+        return {"groups-sent": self.groups_sent,
+                "groups-rejected": self.groups_rejected,
+                "group-size": round(self.transactions_sent / self.groups_sent, 2) if self.groups_sent else 0.0}
+
+
+submitter = BatchSubmitter()
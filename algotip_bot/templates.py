@@ -61,5 +61,12 @@ ZERO_TRANSACTION = ("I cancelled your transaction because you tried to do a tran
                     " of less than 1e-6 Algos, which is the smallest fraction "
                     "of Algos. This transaction would send 0 Algos and make you lose the fee.")
 
+TRANSACTION_NOT_SENT = Template("I'm sorry but an issue occured when handling\n\n ***$body*** \n\n"
+                                "The transaction was not sent, you can send the command again")
+
+TRANSACTION_UNKNOWN = Template("I'm sorry but an issue occured when handling\n\n ***$body*** \n\n"
+                               "The transaction may have been sent, please check it "
+                               f"[here]({ALGOEXPLORER_LINK}/tx/$transaction_id) before sending the command again")
+
 LIST_SUBREDDITS = Template("I am currently active on these subreddits : $subreddits \n\n"
                            "It means that you can only use the `!atip` command on these specific subreddits")
@@ -0,0 +1,26 @@
+from types import SimpleNamespace
+
+from algotip_bot import cache
+from algotip_bot.cache import BalanceCache
+
+ADDRESS = "ADDRESS"
+
+
+def test_fetch_invalidated_meanwhile_is_not_cached(monkeypatch):
+    balances = BalanceCache()
+    amounts = iter([1_000_000, 2_000_000])
+    def account_info(address):
+        amount = next(amounts)
+        if amount == 1_000_000:
+            balances.invalidate(address) # A confirmation lands while the balance is fetched
+        return {"amount": amount}
+    monkeypatch.setattr(cache, "algod", SimpleNamespace(account_info=account_info))
+    assert balances.get(ADDRESS) == 2_000_000
+    assert balances.get(ADDRESS) == 2_000_000 # Cached
+
+def test_balance_past_the_grace_period_is_fetched_again(monkeypatch):
+    balances = BalanceCache(ttl=0, grace=0)
+    amounts = iter([1_000_000, 2_000_000])
+    monkeypatch.setattr(cache, "algod", SimpleNamespace(account_info=lambda address: {"amount": next(amounts)}))
+    assert balances.get(ADDRESS) == 1_000_000
+    assert balances.get(ADDRESS) == 2_000_000
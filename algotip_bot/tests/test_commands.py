@@ -0,0 +1,116 @@
+import random
+import string
+
+import pytest
+
+from algotip_bot.commands import (SubredditCommand, TipCommand, WalletCommand,
+                                WithdrawCommand, compile_commands,
+                                find_comment_command, parse_amount,
+                                parse_comment, parse_message)
+from algotip_bot.errors import InvalidCommandError
+
+ADDRESS = "Y76M3MSY6DKBRHBL7C3NNDXGS5IIMQVQVUAB6MP4XEMMGVF2QWNPL226CA"
+
+# Command bodies as users actually write them
+MESSAGE_CORPUS = [
+    ("tip 1 algorandtipbot", TipCommand(1_000_000, "", "algorandtipbot")),
+    ("Tip 0.5 RedSwoosh thanks for the help !", TipCommand(500_000, "thanks for the help !", "RedSwoosh")),
+    ("tip .25 u/redswoosh", TipCommand(250_000, "", "redswoosh")),
+    ("tip 1.1234567 redswoosh", TipCommand(1_123_456, "", "redswoosh")),
+    (f"withdraw 1.2 {ADDRESS}", WithdrawCommand(1_200_000, ADDRESS, "")),
+    (f"withdraw all {ADDRESS} to my ledger", WithdrawCommand(None, ADDRESS, "to my ledger")),
+    ("wallet", WalletCommand()),
+    ("  WALLET \n", WalletCommand()),
+    ("subreddit list", SubredditCommand("list")),
+    ("subreddit add AlgorandOfficial", SubredditCommand("add", "algorandofficial")),
+    ("subreddit remove r/bottesting", SubredditCommand("remove", "bottesting")),
+]
+
+INVALID_MESSAGES = [
+    "",
+    "hello",
+    "tip",
+    "tip 1",
+    "tip one redswoosh",
+    "tip 1e-8 redswoosh",
+    "tip nan redswoosh",
+    "tip -1 redswoosh",
+    "tip 1 a",
+    "withdraw 1",
+    "withdraw 1 notanaddress",
+    "withdraw everything " + ADDRESS,
+    "wallet please",
+    "subreddit",
+    "subreddit delete algorand",
+    "subreddit add",
+    "subreddit add r/",
+]
+
+COMMENT_CORPUS = [
+    ("!atip 1", TipCommand(1_000_000, "")),
+    ("!ATIP 2.5 great post", TipCommand(2_500_000, "great post")),
+    ("!atip 0.1\n\nthanks", TipCommand(100_000, "thanks")),
+]
+
+
+@pytest.mark.parametrize("body, command", MESSAGE_CORPUS)
+def test_parse_message(body, command):
+    assert parse_message(body) == command
+
+@pytest.mark.parametrize("body", INVALID_MESSAGES)
+def test_invalid_message(body):
+    with pytest.raises(InvalidCommandError):
+        parse_message(body)
+
+def test_anonymous_tip():
+    assert parse_message("tip 1 redswoosh", "Anonymous").anonymous
+
+@pytest.mark.parametrize("body, command", COMMENT_CORPUS)
+def test_parse_comment(body, command):
+    assert parse_comment(body) == command
+
+@pytest.mark.parametrize("body", ["great post", "!atipper 1", "!tip 1", "a", "!"])
+def test_comment_without_command(body):
+    assert parse_comment(body) is None
+
+@pytest.mark.parametrize("body", ["!atip", "!atip all", "!atip 1,5"])
+def test_invalid_comment(body):
+    with pytest.raises(InvalidCommandError):
+        parse_comment(body)
+
+@pytest.mark.parametrize("body, position", [("!atip 1", 5), ("  !ATIP 1", 7), ("!atip", 5),
+                                            ("great post !atip 1", None), ("!atipper 1", None)])
+def test_find_comment_command(body, position):
+    assert find_comment_command(body) == position
+
+def test_parse_comment_from_position():
+    body = "!atip 2.5 great post"
+    assert parse_comment(body, find_comment_command(body)) == parse_comment(body) == TipCommand(2_500_000, "great post")
+
+def test_compiled_commands_prefer_longest():
+    matcher = compile_commands({"!atip", "!atipall"})
+    assert matcher.match("!atipall 1").end() == 8
+    assert matcher.match("!atip 1").end() == 5
+
+def test_amounts_are_exact():
+    assert parse_amount("0.1") + parse_amount("0.2") == parse_amount("0.3")
+    assert parse_amount("0.000001") == 1
+    assert parse_amount("0.0000009") == 0
+
+def test_fuzz():
+    generator = random.Random(0)
+    words = ["tip", "withdraw", "wallet", "subreddit", "add", "remove", "list", "all", "!atip",
+             "1", "0.5", ".1", "1e3", "-2", "redswoosh", "u/x", ADDRESS, ADDRESS[:-1]]
+    alphabet = string.printable + "éàü€"
+    for _ in range(5000):
+        tokens = [generator.choice(words) if generator.random() < 0.7
+                  else "".join(generator.choices(alphabet, k=generator.randint(0, 8)))
+                  for _ in range(generator.randint(0, 5))]
+        body = generator.choice([" ", "\n", "  "]).join(tokens)
+        for parse in (parse_message, parse_comment):
+            try:
+                command = parse(body)
+            except InvalidCommandError:
+                continue
+            if command is not None and getattr(command, "amount", None) is not None:
+                assert isinstance(command.amount, int) and command.amount >= 0
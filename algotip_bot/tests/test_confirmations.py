@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+import pytest
+from algosdk.account import generate_account
+from algosdk.future import transaction
+
+from algotip_bot.confirmations import ConfirmationTracker, block_transaction_ids
+
+GENESIS_HASH = "SGO1GKSzyE7IEPItTxCByw9x8FmnrCDexi9/cOUJOiI="
+GENESIS_ID = "testnet-v1.0"
+
+
+def make_block(*signed_txns):
+    txns = []
+    for signed_txn in signed_txns:
+        stxn = signed_txn.dictify()
+        txn = dict(stxn["txn"])
+        genesis_hash = txn.pop("gh")
+        txn.pop("gen")
+        txns.append({"txn": txn, "sig": stxn["sig"], "hgi": True})
+    return {"gh": genesis_hash, "gen": GENESIS_ID, "txns": txns}
+
+def test_block_transaction_ids():
+    private_key, address = generate_account()
+    params = transaction.SuggestedParams(1000, 1, 1000, GENESIS_HASH, GENESIS_ID, flat_fee=True)
+    txn1 = transaction.PaymentTxn(address, params, address, 1000, note=b"tip")
+    txn2 = transaction.PaymentTxn(address, params, address, 2000)
+
+    block = make_block(txn1.sign(private_key), txn2.sign(private_key))
+
+    assert block_transaction_ids(block) == [txn1.get_txid(), txn2.get_txid()]
+
+def test_empty_block():
+    assert block_transaction_ids({"gh": b"", "gen": GENESIS_ID}) == []
+
+@pytest.fixture
+def tracker(monkeypatch):
+    tracker = ConfirmationTracker()
+    tracker.pending = {"tx1": SimpleNamespace(tx_id="tx1", first_valid=100, last_valid=103),
+                       "tx2": SimpleNamespace(tx_id="tx2", first_valid=1000, last_valid=1001)}
+    tracker.last_round = 99
+    tracker.checked, tracker.expired = [], []
+    def check_block(round_num):
+        tracker.checked.append(round_num)
+        if round_num == 101:
+            tracker.pending.pop("tx1")
+    monkeypatch.setattr(tracker, "check_block", check_block)
+    monkeypatch.setattr(tracker, "_resolve", lambda confirmed, expired: tracker.expired.extend(expired))
+    return tracker
+
+def test_only_the_validity_windows_are_checked(tracker):
+    tracker.advance(5000)
+    assert tracker.checked == [100, 101, 1000, 1001]
+    assert [transaction.tx_id for transaction in tracker.expired] == ["tx2"]
+    assert tracker.last_round == 5000 and not tracker.pending
+
+def test_block_that_could_not_be_fetched_is_checked_again(tracker, monkeypatch):
+    check_block = tracker.check_block
+    def failing_check_block(round_num):
+        if round_num == 1000:
+            raise ConnectionError
+        check_block(round_num)
+    monkeypatch.setattr(tracker, "check_block", failing_check_block)
+    with pytest.raises(ConnectionError):
+        tracker.advance(5000)
+    assert tracker.last_round == 101 and "tx2" in tracker.pending
@@ -0,0 +1,47 @@
+import pytest
+
+from algotip_bot.clients import redis
+from algotip_bot.errors import DuplicateEventError
+from algotip_bot.idempotency import DONE, NEW, SENDING, SENT, STARTED, EventLog
+
+FULLNAME = "t4_idempotencytest"
+
+
+@pytest.fixture
+def event_log():
+    redis.delete(f"event:{FULLNAME}")
+    yield EventLog(ttl=60)
+    redis.delete(f"event:{FULLNAME}")
+
+def test_command_id_is_allocated_once(event_log):
+    command_id, state = event_log.begin(FULLNAME, "redswoosh", "tip 1 algorandtipbot")
+    assert state == NEW
+    assert event_log.begin(FULLNAME, "redswoosh", "tip 1 algorandtipbot") == (command_id, STARTED)
+
+def test_transaction_is_claimed_once(event_log):
+    event_log.begin(FULLNAME, "redswoosh", "tip 1 algorandtipbot")
+    event_log.claim_send(FULLNAME)
+    with pytest.raises(DuplicateEventError):
+        event_log.claim_send(FULLNAME)
+    assert event_log.begin(FULLNAME, "redswoosh", "tip 1 algorandtipbot")[1] == SENDING
+
+def test_rejected_transaction_can_be_retried(event_log):
+    event_log.begin(FULLNAME, "redswoosh", "tip 1 algorandtipbot")
+    event_log.claim_send(FULLNAME)
+    event_log.release_send(FULLNAME)
+    event_log.claim_send(FULLNAME)
+
+def test_transaction_id_is_recorded_before_the_send(event_log):
+    event_log.begin(FULLNAME, "redswoosh", "tip 1 algorandtipbot")
+    event_log.claim_send(FULLNAME)
+    assert event_log.tx_id(FULLNAME) is None
+    event_log.sending({FULLNAME: "TXID", None: "OTHERTXID"})
+    assert event_log.tx_id(FULLNAME) == "TXID"
+    event_log.sent(FULLNAME, "TXID")
+    assert event_log.begin(FULLNAME, "redswoosh", "tip 1 algorandtipbot")[1] == SENT
+
+def test_handled_event_is_only_looked_up(event_log):
+    event_log.begin(FULLNAME, "redswoosh", "wallet")
+    event_log.done(FULLNAME)
+    assert event_log.begin(FULLNAME, "redswoosh", "wallet")[1] == DONE
+    assert event_log.duplicates == 1
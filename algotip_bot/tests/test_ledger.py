@@ -0,0 +1,42 @@
+from types import SimpleNamespace
+
+import pytest
+
+from algotip_bot.cache import balances, suggested_params
+from algotip_bot.ledger import Ledger
+
+SENDER = "SENDER"
+RECEIVER = "RECEIVER"
+
+
+@pytest.fixture
+def ledger(monkeypatch):
+    monkeypatch.setattr(balances, "get", lambda address: {SENDER: 5_000_000, RECEIVER: 0}[address])
+    return Ledger()
+
+def tip(tx_id, amount, last_valid=2000):
+    return SimpleNamespace(tx_id=tx_id, amount=amount, fee=1000, addresses=(SENDER, RECEIVER), last_valid=last_valid)
+
+def test_pending_debits_reduce_available_balance(ledger):
+    ledger.record(tip("tx1", 1_000_000))
+    ledger.record(tip("tx2", 2_000_000))
+    assert ledger.pending_debit(SENDER) == 3_002_000
+    assert ledger.available(SENDER) == 1_998_000
+
+def test_pending_credits_are_not_spendable(ledger):
+    ledger.record(tip("tx1", 1_000_000))
+    assert ledger.pending_credit(RECEIVER) == 1_000_000
+    assert ledger.available(RECEIVER) == 0
+
+def test_settle(ledger):
+    ledger.record(tip("tx1", 1_000_000))
+    ledger.settle(tip("tx1", 1_000_000))
+    assert ledger.available(SENDER) == 5_000_000
+    assert ledger.stats() == {"debited-wallets": 0, "credited-wallets": 0}
+
+def test_expired_entries_are_dropped(ledger, monkeypatch):
+    ledger.record(tip("tx1", 1_000_000, last_valid=1000))
+    ledger.record(tip("tx2", 2_000_000, last_valid=3000))
+    monkeypatch.setattr(suggested_params, "last_round", lambda: 1500)
+    assert ledger.pending_debit(SENDER) == 2_001_000
+    assert ledger.available(SENDER) == 2_999_000
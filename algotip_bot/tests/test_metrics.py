@@ -0,0 +1,58 @@
+import pytest
+
+from algotip_bot.metrics import Metrics
+
+
+class FakeRedis:
+    def execute_command(self, *args, **options):
+        if args[0] == "FAIL":
+            raise ConnectionError
+        return args
+
+    def pipeline(self):
+        pipe = type("Pipeline", (), {})()
+        pipe.execute = lambda: []
+        return pipe
+
+
+def test_disabled_metrics_cost_nothing():
+    metrics = Metrics("")
+    def function():
+        pass
+    assert metrics.timed("stage")(function) is function
+    assert metrics.stage("stage") is metrics.stage("other")
+
+def test_stages():
+    metrics = Metrics("prometheus")
+
+    @metrics.timed("double")
+    def double(value):
+        return value * 2
+
+    assert double(2) == 4
+    with pytest.raises(ValueError):
+        with metrics.stage("parse"):
+            raise ValueError
+
+    snapshot = metrics.snapshot()["stages"]
+    assert snapshot["double"]["count"] == 1
+    assert snapshot["parse"]["errors"] == 1
+
+def test_external_calls():
+    metrics = Metrics("prometheus")
+    client = FakeRedis()
+    metrics.instrument_redis(client)
+    client.execute_command("GET", "key")
+    client.execute_command("GET", "other")
+    client.pipeline().execute()
+    with pytest.raises(ConnectionError):
+        client.execute_command("FAIL")
+
+    calls = metrics.snapshot()["calls"]
+    assert calls["redis.get"]["count"] == 2
+    assert calls["redis.pipeline"]["count"] == 1
+    assert calls["redis.fail"]["errors"] == 1
+
+    text = metrics.render()
+    assert 'algotip_external_call_seconds_count{service="redis",endpoint="get"} 2' in text
+    assert 'algotip_external_call_seconds_bucket{service="redis",endpoint="get",le="+Inf"} 2' in text
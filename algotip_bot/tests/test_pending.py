@@ -0,0 +1,36 @@
+import json
+
+from algosdk.account import generate_account
+
+from algotip_bot.instances import PendingTransaction
+
+TX_ID = "ZQXMJCWCDGLIXPUB4YMJW3ITB3UVTD4LWIH26N4F2QDWJOOMHBVA"
+
+
+def make_tip():
+    _, sender_address = generate_account()
+    _, receiver_address = generate_account()
+    return PendingTransaction("tip", TX_ID, 42,
+                              "redswoosh", 1, sender_address,
+                              "algorandtipbot", 2, receiver_address,
+                              1_500_000, 1000, 1_617_000_000_000, 13_000_000, 13_001_000, True)
+
+def test_pack_round_trip():
+    tip = make_tip()
+    unpacked = PendingTransaction.unpack(tip.pack())
+    for name in PendingTransaction.__slots__:
+        assert getattr(unpacked, name) == getattr(tip, name)
+
+def test_withdraw_round_trip():
+    _, sender_address = generate_account()
+    withdraw = PendingTransaction("withdraw", TX_ID, 43, "redswoosh", 1, sender_address,
+                                  None, None, sender_address, 2_000_000, 1000, 0, 1, 1001)
+    unpacked = PendingTransaction.unpack(withdraw.pack())
+    assert (unpacked.receiver, unpacked.receiver_id) == (None, None)
+    assert unpacked.addresses == withdraw.addresses
+
+def test_record_is_compact():
+    tip = make_tip()
+    assert not hasattr(tip, "__dict__")
+    as_json = json.dumps({name: getattr(tip, name) for name in PendingTransaction.__slots__})
+    assert len(tip.pack()) < len(as_json) / 2
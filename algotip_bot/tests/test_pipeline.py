@@ -0,0 +1,20 @@
+from time import sleep
+
+from algotip_bot.pipeline import SeenEvents
+
+
+def test_events_in_flight_are_submitted_once():
+    seen = SeenEvents(grace=60)
+    assert seen.add("t4_a")
+    assert not seen.add("t4_a")
+    seen.acknowledge(["t4_a"])
+    assert not seen.add("t4_a") # Still in the grace period
+
+def test_acknowledged_events_expire():
+    seen = SeenEvents(grace=0.01)
+    seen.add("t4_a")
+    seen.add("t4_b")
+    seen.acknowledge(["t4_a"])
+    sleep(0.02)
+    assert "t4_a" not in seen and "t4_b" in seen
+    assert seen.add("t4_a")
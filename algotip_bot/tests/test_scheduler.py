@@ -0,0 +1,29 @@
+from algotip_bot.scheduler import PollScheduler
+
+
+def test_backs_off_when_idle():
+    scheduler = PollScheduler(min_interval=0.5, max_interval=6)
+    delays = []
+    for _ in range(6):
+        scheduler.polled(0)
+        delays.append(scheduler.delay())
+    assert delays == [1, 2, 4, 6, 6, 6]
+
+def test_events_reset_the_interval():
+    scheduler = PollScheduler(min_interval=0.5, max_interval=6)
+    for _ in range(4):
+        scheduler.polled(0)
+    scheduler.polled(3)
+    assert scheduler.delay() == 0.5
+
+def test_errors_back_off_exponentially():
+    scheduler = PollScheduler(error_interval=2, max_error_interval=10)
+    delays = []
+    for _ in range(4):
+        scheduler.failed()
+        delays.append(scheduler.delay())
+    assert delays == [2, 4, 8, 10]
+    scheduler.polled(1)
+    assert scheduler.delay() == scheduler.min_interval
+    scheduler.failed()
+    assert scheduler.delay() == 2
@@ -0,0 +1,26 @@
+from praw.models.reddit.comment import Comment
+from praw.models.reddit.message import Message
+
+from algotip_bot.clients import reddit
+from algotip_bot.pipeline import lane_of
+from algotip_bot.sharding import SHARDS, deserialize_event, serialize_event
+
+
+def test_message_round_trip():
+    message = Message(reddit, _data={"id": "1a2b3c", "body": "tip 1 algorandtipbot", "subject": "Anonymous",
+                                     "author": reddit.redditor("RedSwoosh"), "created_utc": 1_617_000_000.0})
+    event = deserialize_event(serialize_event(message))
+    assert isinstance(event, Message)
+    assert (event.fullname, event.author.name, event.subject, event.body) == \
+           (message.fullname, "RedSwoosh", "Anonymous", "tip 1 algorandtipbot")
+
+def test_comment_round_trip():
+    comment = Comment(reddit, _data={"id": "g1h2i3", "body": "!atip 1", "author": "RedSwoosh",
+                                     "parent_id": "t1_g0h0i0", "link_id": "t3_m1n2o3", "created_utc": 0.0})
+    event = deserialize_event(serialize_event(comment))
+    assert isinstance(event, Comment)
+    assert (event.fullname, event.author.name, event.parent_id) == (comment.fullname, "RedSwoosh", "t1_g0h0i0")
+    assert serialize_event(comment, 0)["start"] == "0" and serialize_event(comment)["start"] == ""
+
+def test_sender_shard_is_case_insensitive():
+    assert lane_of("RedSwoosh", SHARDS) == lane_of("redswoosh", SHARDS)
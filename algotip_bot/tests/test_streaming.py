@@ -0,0 +1,104 @@
+from types import SimpleNamespace
+
+from algotip_bot.streaming import CommentCursor, ShardedCommentStream
+
+
+class FakeSubreddit:
+    def __init__(self, display_name="algorand"):
+        self.display_name = display_name
+        self.listing = [] # Newest first, like Reddit listings
+        self.requests = []
+
+    def post(self, count):
+        start = len(self.listing)
+        new = [SimpleNamespace(fullname=f"t1_{i}", subreddit=self.display_name) for i in range(start, start + count)]
+        self.listing = new[::-1] + self.listing
+
+    def comments(self, limit, params=None):
+        self.requests.append((limit, params))
+        if params is None:
+            return iter(self.listing[:limit])
+        names = [comment.fullname for comment in self.listing]
+        index = names.index(params["before"])
+        return iter(self.listing[max(index - limit, 0):index])
+
+
+class FakeReddit:
+    def __init__(self):
+        self.listings = {}
+
+    def subreddit(self, display_name):
+        return self.listings.setdefault(display_name, FakeSubreddit(display_name))
+
+
+def fullnames(comments):
+    return [comment.fullname for comment in comments]
+
+def test_first_fetch_is_a_full_scan():
+    subreddit = FakeSubreddit()
+    subreddit.post(5)
+    cursor = CommentCursor()
+    assert fullnames(cursor.fetch(subreddit)) == ["t1_4", "t1_3", "t1_2", "t1_1", "t1_0"]
+    assert subreddit.requests == [(100, None)]
+    assert cursor.newest == "t1_4"
+
+def test_incremental_fetch():
+    subreddit = FakeSubreddit()
+    subreddit.post(5)
+    cursor = CommentCursor()
+    cursor.fetch(subreddit)
+    assert cursor.fetch(subreddit) == []
+    subreddit.post(2)
+    assert fullnames(cursor.fetch(subreddit)) == ["t1_6", "t1_5"]
+    assert subreddit.requests[-1] == (10, {"before": "t1_4"})
+
+def test_backlog_grows_page_size():
+    subreddit = FakeSubreddit()
+    subreddit.post(1)
+    cursor = CommentCursor(min_limit=10, max_limit=40)
+    cursor.fetch(subreddit)
+    subreddit.post(45)
+    comments = cursor.fetch(subreddit)
+    assert fullnames(comments) == [f"t1_{i}" for i in range(45, 0, -1)]
+    assert [limit for limit, _ in subreddit.requests[1:]] == [10, 20, 40]
+
+def test_reset_on_listing_change():
+    subreddit = FakeSubreddit()
+    subreddit.post(3)
+    cursor = CommentCursor()
+    cursor.fetch(subreddit)
+    subreddit.display_name = "algorand+bottesting"
+    cursor.fetch(subreddit)
+    assert subreddit.requests[-1] == (100, None)
+
+def test_busy_subreddits_get_their_own_shard():
+    stream = ShardedCommentStream(shard_size=2)
+    stream.rates = {"cryptocurrency": 5.0, "algorand": 0.1}
+    assert stream.partition({"algorand", "algorandofficial", "bottesting", "cryptocurrency"}) == \
+           [("cryptocurrency",), ("algorand", "algorandofficial"), ("bottesting",)]
+
+def test_shards_are_polled_on_their_own_schedule():
+    reddit = FakeReddit()
+    stream = ShardedCommentStream(shard_size=1, target_batch=10, min_interval=1, max_interval=60)
+    reddit.subreddit("cryptocurrency").post(1)
+    reddit.subreddit("algorand").post(1)
+    assert len(stream.fetch(reddit, {"cryptocurrency", "algorand"}, now=0)) == 2
+
+    reddit.subreddit("cryptocurrency").post(120)
+    reddit.subreddit("algorand").post(1)
+    assert len(stream.fetch(reddit, {"cryptocurrency", "algorand"}, now=60)) == 121
+    assert stream.rates["cryptocurrency"] > stream.rates["algorand"]
+
+    reddit.subreddit("cryptocurrency").post(5)
+    reddit.subreddit("algorand").post(1)
+    assert len(stream.fetch(reddit, {"cryptocurrency", "algorand"}, now=80)) == 5 # algorand isn't due yet
+    assert len(stream.fetch(reddit, {"cryptocurrency", "algorand"}, now=120)) == 1
+
+def test_new_subreddit_keeps_existing_cursors():
+    reddit = FakeReddit()
+    stream = ShardedCommentStream(shard_size=1)
+    reddit.subreddit("algorand").post(3)
+    stream.fetch(reddit, {"algorand"}, now=0)
+    cursor = stream.shards[0].cursor
+    stream.fetch(reddit, {"algorand", "bottesting"}, now=1)
+    assert stream.shards[0].cursor is cursor and len(stream.shards) == 2
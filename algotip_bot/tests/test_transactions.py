@@ -7,6 +7,7 @@ from time import sleep
 from algotip_bot.clients import algod
 from algotip_bot.errors import InsufficientFundsError, ZeroTransactionError
 from algotip_bot.instances import User, Wallet
+from algotip_bot.ledger import ledger
 from algotip_bot.tests.utils import reset_balances
 from algotip_bot.utils import wait_for_confirmation
 
@@ -28,47 +29,51 @@ def users():
     transaction = reset_balances(user1, user2)
     if transaction is not None:
         wait_for_confirmation(transaction.tx_id, 10)
+        ledger.settle(transaction) # No confirmation tracker runs here, the balances are read again
 
     yield user1, user2
 
     transaction = reset_balances(user1, user2)
     if transaction is not None:
         wait_for_confirmation(transaction.tx_id, 10)
+        ledger.settle(transaction) # No confirmation tracker runs here, the balances are read again
 
 def test_small_tip(users):
     user1, user2 = users
-    transaction = user1.send(user2, 1, "")
+    transaction = user1.send(user2, 1_000_000, "").result()
     wait_for_confirmation(transaction.tx_id, 10)
-    assert user2.wallet.balance == 1.1
+    ledger.settle(transaction)
+    assert user2.wallet.balance == 1_100_000
 
 def test_zero_tip(users):
     user1, user2 = users
     with pytest.raises(ZeroTransactionError):
-        transaction = user1.send(user2, 1e-8, "")
+        transaction = user1.send(user2, 0, "")
 
 @pytest.mark.skip(reason="Confirmation for big transactions not implemented yet")
 def test_tip_above_ten(users):
     user1, user2 = users
-    transaction = user1.send(user2, 12, "")
+    transaction = user1.send(user2, 12_000_000, "")
     pass
 
 def test_insufficient_funds_tip(users):
     user1, user2 = users
     with pytest.raises(InsufficientFundsError):
-        transaction = user2.send(user1, 0.5, "")
+        transaction = user2.send(user1, 500_000, "")
 
 def test_withdraw(users):
     user1, user2 = users
-    transaction = user1.withdraw(1, WALLET2_PUBLIC_KEY, "")
+    transaction = user1.withdraw(1_000_000, WALLET2_PUBLIC_KEY, "")
     wait_for_confirmation(transaction.tx_id, 10)
-    assert user2.wallet.balance == 1.1
+    ledger.settle(transaction)
+    assert user2.wallet.balance == 1_100_000
 
 def test_insufficient_funds_withdraw(users):
     user1, user2 = users
     with pytest.raises(InsufficientFundsError):
-        user2.withdraw(1, WALLET1_PUBLIC_KEY, "")
+        user2.withdraw(1_000_000, WALLET1_PUBLIC_KEY, "")
 
 def test_zero_withdraw(users):
     user1, user2 = users
     with pytest.raises(ZeroTransactionError):
-        user1.withdraw(1e-8, WALLET2_PUBLIC_KEY, "")
+        user1.withdraw(0, WALLET2_PUBLIC_KEY, "")
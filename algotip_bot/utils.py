@@ -2,12 +2,18 @@
 Utility functions
 """
 
-from prawcore.exceptions import NotFound, ServerError
+from time import time
 
+from algotip_bot.cache import reddit_metadata
 from algotip_bot.clients import algod, reddit, redis
+from algotip_bot.commands import find_comment_command
+from algotip_bot.redis_scripts import CLAIM_COMMENTS
+from algotip_bot.streaming import ShardedCommentStream
 
-COMMENT_COMMANDS = {"!atip"}
 SUBREDDITS = {"algorand", "algorandofficial", "cryptocurrency", "bottesting"}
+COMMENT_RETENTION = 30 * 24 * 3600 # Seconds during which a handled comment id is remembered
+
+comment_stream = ShardedCommentStream()
 
 def is_float(value: str) -> bool:
     """
@@ -30,7 +36,7 @@ def is_float(value: str) -> bool:
 
 def valid_user(username: str) -> bool:
     """
-    Checks whether or not the username is valid
+    Checks whether or not the username is valid (cached)
 
     Args:
         username: username to check
@@ -39,15 +45,11 @@ def valid_user(username: str) -> bool:
             True if username exists
             False otherwise
     """
-    try:
-        reddit.redditor(username).id
-    except NotFound:
-        return False
-    return True
+    return reddit_metadata.user_exists(username)
 
 def valid_subreddit(subreddit: str) -> bool:
     """
-    Checks whether or not the subreddit name is valid
+    Checks whether or not the subreddit name is valid (cached)
 
     Args:
         subreddit: subreddit name to check
@@ -56,31 +58,56 @@ def valid_subreddit(subreddit: str) -> bool:
             True if subreddit exists
             False otherwise
     """
-    try:
-        reddit.subreddits.search_by_name(subreddit, exact=True)
-    except NotFound:
-        return False
-    return True
+    return reddit_metadata.subreddit_exists(subreddit)
+
+def claim_comments(comments: set) -> set:
+    """
+    Marks the comments as seen and returns the ones that weren't seen before.
+    The ids are kept in the 'comment-seen' sorted set, scored by the time
+    they were seen, and expire after COMMENT_RETENTION. Comments older than that
+    are dropped since their id could have expired already
+
+    Args:
+        comments: set of praw comments
+    Returns:
+        comments: the subset of comments that weren't seen before
+    """
+    now = time()
+    comments = {comment for comment in comments if comment.created_utc > now - COMMENT_RETENTION}
+    if not comments:
+        return set()
+
+    claimed = set(CLAIM_COMMENTS(keys=["comment-seen"],
+                                 args=[now, now - COMMENT_RETENTION, *{comment.id for comment in comments}]))
+    return {comment for comment in comments if comment.id in claimed}
 
 def stream():
     """
-    Fetches the unread items in the inbox and all comments in the
+    Fetches the unread items in the inbox and the new comments in the
     targeted subreddits that contain an AlgoTip command
-    Adds the comments to a cache to know which ones were already dealt with
+    The subreddits are fetched by shards, each on its own schedule (see ShardedCommentStream)
+    Claims the comments in a sorted set (see claim_comments) to know which
+    ones were already dealt with
+
+    Returns:
+        events: the unread inbox items and the new comments with a command
+        starts: position of the command in the body of each comment, by fullname,
+                so that the command isn't searched for again when it is parsed
+    Raises:
+        ServerError, RequestException: if the inbox couldn't be fetched, so that the
+                                       caller can back off (the failing comment shards back off by themselves)
     """
-    try:
-        inbox_unread = set(reddit.inbox.unread())
-        comment_cache = redis.smembers("comment-cache")
-        comments = {comment for comment in reddit.subreddit("+".join(redis.smembers('subreddits'))).comments(limit=100)
-                            if any(command in comment.body for command in COMMENT_COMMANDS)
-                            and comment.id not in comment_cache}
-    except ServerError: # Avoid having the bot crash everytime the Reddit API is struggling
-        return set()
+    inbox_unread = set(reddit.inbox.unread())
+
+    comments, starts = set(), {}
+    for comment in comment_stream.fetch(reddit, redis.smembers("subreddits")):
+        if (start := find_comment_command(comment.body)) is not None:
+            comments.add(comment)
+            starts[comment.fullname] = start
 
-    if comments:
-        redis.sadd("comment-cache", *{comment.id for comment in comments})
+    comments = claim_comments(comments)
 
-    return set.union(inbox_unread, comments)
+    return set.union(inbox_unread, comments), starts
 
 
 # Comes from https://developer.algorand.org/docs/build-apps/hello_world/